@@ -1,4 +1,5 @@
 from flask import Flask, render_template
+from werkzeug.middleware.proxy_fix import ProxyFix
 from app.extensions import db, login_manager
 from app.config import config
 import os
@@ -9,14 +10,32 @@ def create_app(config_name=None):
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    hops = app.config.get('PROXY_FIX_HOPS', 0)
+    if hops:
+        # Адрес и схема клиента — из заголовков доверенных прокси (ограничение входа по IP)
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
     db.init_app(app)
     login_manager.init_app(app)
 
+    from app import database
+    database.init_app(app)
+
     from app.models import Employee, Role
+    from app import aggregates  # регистрирует обработчики событий сессии
+    from app import search  # создаёт индекс поиска вместе с таблицами
+
+    from app import principals
+    principals.init_app(app)
+    login_manager.user_loader(principals.load_user)
+
+    from app import caching
+    caching.init_app(app)
 
-    @login_manager.user_loader
-    def load_user(user_id):
-        return db.session.get(Employee, int(user_id))
+    from app import ratelimit
+    ratelimit.init_app(app)
+
+    from app import images
+    app.add_template_global(images.photo_sources)
 
     from app.views import views as views_blueprint
     from app.auth import auth as auth_blueprint
@@ -24,12 +43,26 @@ def create_app(config_name=None):
     app.register_blueprint(views_blueprint)
     app.register_blueprint(auth_blueprint)
 
+    from app.commands import register_commands
+    register_commands(app)
+
     @app.errorhandler(404)
     def not_found_error(error):
         return render_template('error_404.html'), 404
 
     with app.app_context():
+            # Новая база создаётся сразу со всеми индексами — её миграции только отмечаются
+            fresh = not db.inspect(db.engine).has_table('employees')
             db.create_all()
+            # create_all не меняет существующие таблицы — индексы и ограничения доводят миграции.
+            # Миграции, меняющие данные, при старте существующей базы не выполняются — только flask db-upgrade
+            from app.migrations import run_migrations, pending_migrations
+            run_migrations(log=app.logger.info, include_manual=fresh)
+            for version, description in pending_migrations():
+                app.logger.warning("Миграция %s (%s) не применена: выполните flask db-upgrade", version, description)
+            # Ключ оценок проверяется при старте, а не первым сохранением (см. evaluations.save_evaluations)
+            from app import evaluations
+            evaluations.has_unique_key()
             if Role.query.count() == 0:
                 admin_role = Role(name='admin', description='Полный доступ')
                 manager_role = Role(name='manager', description='Руководитель подразделения')
@@ -0,0 +1,409 @@
+import json
+from collections import defaultdict
+from sqlalchemy import event, func, inspect, select, update, insert, delete
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app import rankings
+from app.models import (
+    CycleStats, DepartmentCycleStats, CategoryCycleStats, EmployeeCycleStats,
+    EmployeeMetric, EvaluationCycle, Employee, PerformanceMetric
+)
+
+# Гистограмма баллов: корзины 0..10, баллы выше 10 попадают в последнюю корзину
+HISTOGRAM_BINS = 11
+# Допуск при сверке сумм, накопленных инкрементально
+TOLERANCE = 1e-6
+
+STATS_MODELS = (CycleStats, DepartmentCycleStats, CategoryCycleStats, EmployeeCycleStats)
+
+
+def score_bin(score):
+    return min(max(int(score), 0), HISTOGRAM_BINS - 1)
+
+
+# --- Инкрементальное обновление через события сессии ---
+
+def _old_value(session, obj, name):
+    history = inspect(obj).attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    if not history.added:
+        return getattr(obj, name)
+    # Старое значение не было загружено — читаем его из базы
+    column = EmployeeMetric.__table__.c[name]
+    return session.execute(
+        select(column).where(EmployeeMetric.__table__.c.id == obj.id)
+    ).scalar()
+
+
+def _row_key(session, obj, old):
+    names = ('cycle_id', 'employee_id', 'metric_id', 'score')
+    if old:
+        values = [_old_value(session, obj, name) for name in names]
+    else:
+        values = [getattr(obj, name) for name in names]
+    return tuple(values[:3]), values[3]
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_score_changes(session, flush_context, instances):
+    changes = session.info.setdefault('score_changes', [])
+    deleted_cycles = session.info.setdefault('deleted_cycles', set())
+
+    for obj in session.new:
+        if isinstance(obj, EmployeeMetric):
+            key, score = _row_key(session, obj, old=False)
+            changes.append((key, score, 1))
+
+    for obj in session.dirty:
+        if isinstance(obj, EmployeeMetric) and session.is_modified(obj, include_collections=False):
+            old_key, old_score = _row_key(session, obj, old=True)
+            new_key, new_score = _row_key(session, obj, old=False)
+            if (old_key, old_score) != (new_key, new_score):
+                changes.append((old_key, old_score, -1))
+                changes.append((new_key, new_score, 1))
+
+    for obj in session.deleted:
+        if isinstance(obj, EmployeeMetric):
+            key, score = _row_key(session, obj, old=True)
+            changes.append((key, score, -1))
+        elif isinstance(obj, EvaluationCycle):
+            deleted_cycles.add(obj.id)
+
+    # Перевод сотрудника в другое подразделение: его агрегаты переносятся после записи
+    moved = session.info.setdefault('moved_employees', {})
+    for obj in session.dirty:
+        if isinstance(obj, Employee) and obj.id is not None \
+                and inspect(obj).attrs.department_id.history.has_changes():
+            moved[obj.id] = obj.department_id
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_pending_changes(session, flush_context):
+    changes = session.info.pop('score_changes', None)
+    deleted_cycles = session.info.pop('deleted_cycles', None)
+    moved = session.info.pop('moved_employees', None)
+    if changes:
+        apply_score_changes(session, changes)
+    if moved:
+        for employee_id, department_id in moved.items():
+            move_employee(session, employee_id, department_id)
+    if deleted_cycles:
+        for model in STATS_MODELS:
+            table = model.__table__
+            session.execute(delete(table).where(table.c.cycle_id.in_(deleted_cycles)))
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_pending_changes(session, previous_transaction):
+    session.info.pop('score_changes', None)
+    session.info.pop('deleted_cycles', None)
+    session.info.pop('moved_employees', None)
+
+
+def _add_to_row(session, table, key, deltas):
+    where = [table.c[name] == value for name, value in key.items()]
+    result = session.execute(
+        update(table).where(*where).values({name: table.c[name] + value for name, value in deltas.items()})
+    )
+    if result.rowcount == 0:
+        session.execute(insert(table).values(**key, **deltas))
+
+
+def apply_score_changes(session, changes):
+    """Применяет изменения оценок ((cycle_id, employee_id, metric_id), score, ±1) к агрегатам."""
+    employee_ids = {key[1] for key, _, _ in changes}
+    metric_ids = {key[2] for key, _, _ in changes}
+    emp_table = Employee.__table__
+    metric_table = PerformanceMetric.__table__
+    departments = dict(session.execute(
+        select(emp_table.c.id, emp_table.c.department_id).where(emp_table.c.id.in_(employee_ids))
+    ).all())
+    categories = dict(session.execute(
+        select(metric_table.c.id, metric_table.c.category_id).where(metric_table.c.id.in_(metric_ids))
+    ).all())
+
+    employee_deltas = defaultdict(lambda: [0.0, 0])
+    category_deltas = defaultdict(lambda: [0.0, 0])
+    histogram_deltas = defaultdict(lambda: [0] * HISTOGRAM_BINS)
+    for (cycle_id, employee_id, metric_id), score, sign in changes:
+        employee_deltas[(cycle_id, employee_id)][0] += sign * score
+        employee_deltas[(cycle_id, employee_id)][1] += sign
+        category_id = categories.get(metric_id)
+        if category_id is not None:
+            category_deltas[(cycle_id, category_id)][0] += sign * score
+            category_deltas[(cycle_id, category_id)][1] += sign
+        histogram_deltas[cycle_id][score_bin(score)] += sign
+
+    department_deltas = defaultdict(lambda: [0.0, 0, 0])
+    cycle_deltas = defaultdict(lambda: [0.0, 0, 0])
+    emp_stats = EmployeeCycleStats.__table__
+    for (cycle_id, employee_id), (score_delta, count_delta) in employee_deltas.items():
+        if not score_delta and not count_delta:
+            continue
+        where = (emp_stats.c.cycle_id == cycle_id, emp_stats.c.employee_id == employee_id)
+        row = session.execute(
+            select(emp_stats.c.department_id, emp_stats.c.score_sum, emp_stats.c.score_count).where(*where)
+        ).first()
+        old_count = row.score_count if row else 0
+        new_count = old_count + count_delta
+        new_sum = (row.score_sum if row else 0.0) + score_delta if new_count > 0 else 0.0
+        values = {
+            'score_sum': new_sum,
+            'score_count': new_count,
+            'avg_score': new_sum / new_count if new_count > 0 else None
+        }
+        if row:
+            department_id = row.department_id
+            session.execute(update(emp_stats).where(*where).values(values))
+        else:
+            department_id = departments.get(employee_id)
+            if department_id is None:
+                continue
+            session.execute(insert(emp_stats).values(
+                cycle_id=cycle_id, employee_id=employee_id, department_id=department_id, **values
+            ))
+
+        evaluated_delta = (new_count > 0) - (old_count > 0)
+        for deltas in (department_deltas[(cycle_id, department_id)], cycle_deltas[cycle_id]):
+            deltas[0] += score_delta
+            deltas[1] += count_delta
+            deltas[2] += evaluated_delta
+
+    # Итоговые баллы — только у сотрудников с изменёнными оценками; места цикла пересчитаются при чтении
+    changed_employees = defaultdict(set)
+    for cycle_id, employee_id in employee_deltas:
+        changed_employees[cycle_id].add(employee_id)
+    for cycle_id, employee_ids in changed_employees.items():
+        rankings.update_composites(session, cycle_id, employee_ids)
+
+    for (cycle_id, department_id), (score_delta, count_delta, evaluated_delta) in department_deltas.items():
+        _add_to_row(session, DepartmentCycleStats.__table__,
+                    {'cycle_id': cycle_id, 'department_id': department_id},
+                    {'score_sum': score_delta, 'score_count': count_delta, 'evaluated_count': evaluated_delta})
+
+    for (cycle_id, category_id), (score_delta, count_delta) in category_deltas.items():
+        _add_to_row(session, CategoryCycleStats.__table__,
+                    {'cycle_id': cycle_id, 'category_id': category_id},
+                    {'score_sum': score_delta, 'score_count': count_delta})
+
+    cycle_table = CycleStats.__table__
+    for cycle_id, bins_delta in histogram_deltas.items():
+        score_delta, count_delta, evaluated_delta = cycle_deltas.get(cycle_id, (0.0, 0, 0))
+        row = session.execute(
+            select(cycle_table.c.histogram).where(cycle_table.c.cycle_id == cycle_id)
+        ).first()
+        histogram = _parse_histogram(row.histogram if row else None)
+        histogram = [old + delta for old, delta in zip(histogram, bins_delta)]
+        if row:
+            session.execute(update(cycle_table).where(cycle_table.c.cycle_id == cycle_id).values(
+                score_sum=cycle_table.c.score_sum + score_delta,
+                score_count=cycle_table.c.score_count + count_delta,
+                evaluated_count=cycle_table.c.evaluated_count + evaluated_delta,
+                histogram=json.dumps(histogram),
+                ranks_stale=True
+            ))
+        else:
+            session.execute(insert(cycle_table).values(
+                cycle_id=cycle_id, score_sum=score_delta, score_count=count_delta,
+                evaluated_count=evaluated_delta, histogram=json.dumps(histogram),
+                ranks_stale=True, composites_stale=False
+            ))
+
+
+def move_employee(session, employee_id, department_id):
+    """Переносит агрегаты сотрудника во всех циклах в подразделение department_id:
+    суммы подразделений, подразделение в employee_cycle_stats; места циклов помечаются устаревшими."""
+    emp_stats = EmployeeCycleStats.__table__
+    where = (emp_stats.c.employee_id == employee_id, emp_stats.c.department_id != department_id)
+    rows = session.execute(
+        select(emp_stats.c.cycle_id, emp_stats.c.department_id, emp_stats.c.score_sum, emp_stats.c.score_count)
+        .where(*where)
+    ).all()
+    if not rows:
+        return
+    dept_table = DepartmentCycleStats.__table__
+    for row in rows:
+        evaluated = int(row.score_count > 0)
+        _add_to_row(session, dept_table, {'cycle_id': row.cycle_id, 'department_id': row.department_id},
+                    {'score_sum': -row.score_sum, 'score_count': -row.score_count, 'evaluated_count': -evaluated})
+        _add_to_row(session, dept_table, {'cycle_id': row.cycle_id, 'department_id': department_id},
+                    {'score_sum': row.score_sum, 'score_count': row.score_count, 'evaluated_count': evaluated})
+    session.execute(update(emp_stats).where(*where).values(department_id=department_id))
+    cycle_table = CycleStats.__table__
+    session.execute(update(cycle_table).where(cycle_table.c.cycle_id.in_({row.cycle_id for row in rows}))
+                    .values(ranks_stale=True))
+
+
+def _parse_histogram(raw):
+    bins = json.loads(raw) if raw else []
+    return (bins + [0] * HISTOGRAM_BINS)[:HISTOGRAM_BINS]
+
+
+# --- Полный пересчёт и сверка ---
+
+def compute_cycle_stats(cycle_id, session=None):
+    """Считает агрегаты цикла напрямую по employee_metrics."""
+    session = session or db.session
+    employees = {}
+    rows = session.query(
+        EmployeeMetric.employee_id,
+        Employee.department_id,
+        func.sum(EmployeeMetric.score),
+        func.count(EmployeeMetric.id)
+    ).join(Employee, Employee.id == EmployeeMetric.employee_id) \
+     .filter(EmployeeMetric.cycle_id == cycle_id) \
+     .group_by(EmployeeMetric.employee_id, Employee.department_id)
+    for employee_id, department_id, score_sum, score_count in rows:
+        employees[employee_id] = {
+            'department_id': department_id,
+            'score_sum': float(score_sum),
+            'score_count': score_count
+        }
+
+    departments = defaultdict(lambda: {'score_sum': 0.0, 'score_count': 0, 'evaluated_count': 0})
+    for item in employees.values():
+        dept = departments[item['department_id']]
+        dept['score_sum'] += item['score_sum']
+        dept['score_count'] += item['score_count']
+        dept['evaluated_count'] += 1
+
+    categories = {}
+    rows = session.query(
+        PerformanceMetric.category_id,
+        func.sum(EmployeeMetric.score),
+        func.count(EmployeeMetric.id)
+    ).join(PerformanceMetric, PerformanceMetric.id == EmployeeMetric.metric_id) \
+     .filter(EmployeeMetric.cycle_id == cycle_id) \
+     .group_by(PerformanceMetric.category_id)
+    for category_id, score_sum, score_count in rows:
+        categories[category_id] = {'score_sum': float(score_sum), 'score_count': score_count}
+
+    histogram = [0] * HISTOGRAM_BINS
+    rows = session.query(
+        func.cast(EmployeeMetric.score, db.Integer),
+        func.count(EmployeeMetric.id)
+    ).filter(EmployeeMetric.cycle_id == cycle_id) \
+     .group_by(func.cast(EmployeeMetric.score, db.Integer))
+    for bucket, count in rows:
+        histogram[score_bin(bucket)] += count
+
+    cycle = {
+        'score_sum': sum(item['score_sum'] for item in employees.values()),
+        'score_count': sum(item['score_count'] for item in employees.values()),
+        'evaluated_count': len(employees),
+        'histogram': histogram
+    }
+    return {'cycle': cycle, 'departments': dict(departments), 'categories': categories, 'employees': employees}
+
+
+def load_cycle_stats(cycle_id):
+    """Читает сохранённые агрегаты цикла в том же формате, что и compute_cycle_stats."""
+    stored = db.session.get(CycleStats, cycle_id)
+    cycle = None
+    if stored:
+        cycle = {
+            'score_sum': stored.score_sum,
+            'score_count': stored.score_count,
+            'evaluated_count': stored.evaluated_count,
+            'histogram': _parse_histogram(stored.histogram)
+        }
+    departments = {
+        row.department_id: {'score_sum': row.score_sum, 'score_count': row.score_count,
+                            'evaluated_count': row.evaluated_count}
+        for row in DepartmentCycleStats.query.filter_by(cycle_id=cycle_id)
+        if row.score_count
+    }
+    categories = {
+        row.category_id: {'score_sum': row.score_sum, 'score_count': row.score_count}
+        for row in CategoryCycleStats.query.filter_by(cycle_id=cycle_id)
+        if row.score_count
+    }
+    employees = {
+        row.employee_id: {'department_id': row.department_id, 'score_sum': row.score_sum,
+                          'score_count': row.score_count}
+        for row in EmployeeCycleStats.query.filter_by(cycle_id=cycle_id)
+        if row.score_count
+    }
+    return {'cycle': cycle, 'departments': departments, 'categories': categories, 'employees': employees}
+
+
+def rebuild_cycle_stats(cycle_id, session=None):
+    """Полностью пересобирает агрегаты цикла в session (по умолчанию — сессии запроса).
+    Коммит — на стороне вызывающего кода."""
+    session = session or db.session
+    computed = compute_cycle_stats(cycle_id, session)
+    for model in STATS_MODELS:
+        session.query(model).filter_by(cycle_id=cycle_id).delete(synchronize_session=False)
+
+    cycle = computed['cycle']
+    session.add(CycleStats(
+        cycle_id=cycle_id,
+        score_sum=cycle['score_sum'],
+        score_count=cycle['score_count'],
+        evaluated_count=cycle['evaluated_count'],
+        histogram=json.dumps(cycle['histogram'])
+    ))
+    for department_id, item in computed['departments'].items():
+        session.add(DepartmentCycleStats(cycle_id=cycle_id, department_id=department_id, **item))
+    for category_id, item in computed['categories'].items():
+        session.add(CategoryCycleStats(cycle_id=cycle_id, category_id=category_id, **item))
+    for employee_id, item in computed['employees'].items():
+        session.add(EmployeeCycleStats(
+            cycle_id=cycle_id, employee_id=employee_id,
+            avg_score=item['score_sum'] / item['score_count'], **item
+        ))
+    session.flush()
+    rankings.update_composites(session, cycle_id)
+    rankings.update_ranks(session, cycle_id)
+    session.execute(update(CycleStats.__table__).where(CycleStats.cycle_id == cycle_id)
+                    .values(ranks_stale=False, composites_stale=False))
+    return computed
+
+
+def _diff(section, key, expected, actual):
+    problems = []
+    for name, value in expected.items():
+        stored = actual.get(name) if actual else None
+        if isinstance(value, float):
+            if stored is None or abs(stored - value) > TOLERANCE:
+                problems.append(f"{section}[{key}].{name}: ожидалось {value}, сохранено {stored}")
+        elif stored != value:
+            problems.append(f"{section}[{key}].{name}: ожидалось {value}, сохранено {stored}")
+    return problems
+
+
+def check_cycle_stats(cycle_id):
+    """Сверяет сохранённые агрегаты с полным пересчётом; возвращает список расхождений."""
+    expected = compute_cycle_stats(cycle_id)
+    actual = load_cycle_stats(cycle_id)
+    if actual['cycle'] is None:
+        return [f"cycle_stats[{cycle_id}]: нет записи"]
+
+    problems = _diff('cycle_stats', cycle_id, expected['cycle'], actual['cycle'])
+    for section in ('departments', 'categories', 'employees'):
+        keys = set(expected[section]) | set(actual[section])
+        for key in sorted(keys, key=str):
+            problems.extend(_diff(section, key, expected[section].get(key, {}), actual[section].get(key))
+                            if key in expected[section]
+                            else [f"{section}[{key}]: лишняя запись"])
+    return problems
+
+
+def get_cycle_stats(cycle_id):
+    """Агрегаты цикла для страницы статистики; при отсутствии — достраивает их в отдельной
+    транзакции: страницы читают агрегаты в GET, и сессия запроса при этом не коммитится."""
+    # Без autoflush: сброшенные изменения сессии запроса держали бы блокировку записи,
+    # и пересборка в отдельной транзакции ждала бы её (как в rankings.ensure_ranking)
+    with db.session.no_autoflush:
+        stats = db.session.get(CycleStats, cycle_id)
+        if stats is None:
+            with db.engine.begin() as connection, Session(bind=connection) as session:
+                rebuild_cycle_stats(cycle_id, session)
+                session.flush()
+            stats = db.session.get(CycleStats, cycle_id)
+    return stats
+
+
+def cycle_histogram(stats):
+    return _parse_histogram(stats.histogram)
@@ -0,0 +1,145 @@
+from collections import namedtuple
+import numpy as np
+from app.extensions import db
+from app.models import CycleStats, Department, Employee, EmployeeMetric, MetricCategory, PerformanceMetric
+from app import caching
+
+# Аналитика цикла на NumPy: баллы цикла читаются одним запросом в массивы, дальше всё считается
+# векторно. Итоговый балл сотрудника — взвешенный и нормированный: балл делится на максимум метрики,
+# внутри категории усредняется с весами метрик, категории складываются с весами категорий, шкала 0..100.
+# В шаблоны уходят только сводные числа и корзины гистограмм — объём страницы не зависит от числа оценок.
+
+# Корзины итогового балла: 0–10, 10–20, ..., 90–100
+COMPOSITE_BINS = 10
+PERCENTILES = (10, 25, 50, 75, 90)
+# |z| выше порога — заметное отклонение от среднего по циклу
+OUTLIER_Z = 2.0
+# Сколько секунд живёт расчёт (страховка для правок весов из других процессов)
+ANALYTICS_TTL = 300
+# Таблицы, правка которых через сессию меняет итоговые баллы без изменения самих оценок
+_DEPENDS = ('performance_metrics', 'metric_categories', 'employees')
+
+# Итоговые баллы сотрудников цикла: параллельные массивы, упорядочены по employee_id
+EmployeeScores = namedtuple('EmployeeScores', 'employee_ids department_ids composite zscores percentiles')
+# Распределение итоговых баллов: по циклу в целом или по подразделению
+Distribution = namedtuple('Distribution', 'count mean std min max percentiles histogram')
+CycleAnalytics = namedtuple('CycleAnalytics', 'cycle_id scores overall departments outliers')
+
+_cache = caching.MemoryBackend(maxsize=16)
+
+
+def _load_arrays(cycle_id):
+    """Оценки цикла одним запросом: (employee_id, department_id, category_id, нормированный балл,
+    вес метрики, вес категории) — массивами одинаковой длины."""
+    rows = db.session.query(
+        EmployeeMetric.employee_id,
+        Employee.department_id,
+        PerformanceMetric.category_id,
+        EmployeeMetric.score,
+        PerformanceMetric.max_score,
+        PerformanceMetric.weight,
+        MetricCategory.weight
+    ).join(PerformanceMetric, PerformanceMetric.id == EmployeeMetric.metric_id) \
+     .join(Employee, Employee.id == EmployeeMetric.employee_id) \
+     .outerjoin(MetricCategory, MetricCategory.id == PerformanceMetric.category_id) \
+     .filter(EmployeeMetric.cycle_id == cycle_id).all()
+
+    data = np.array(rows, dtype=float).reshape(-1, 7)
+    # NULL -> nan: веса и максимум по умолчанию, как в модели
+    employee_ids, department_ids, category_ids = (data[:, i].astype(np.int64) for i in range(3))
+    max_scores = np.nan_to_num(data[:, 4], nan=10.0)
+    max_scores[max_scores <= 0] = 10.0
+    normalized = np.clip(data[:, 3] / max_scores, 0.0, 1.0)
+    metric_weights = np.clip(np.nan_to_num(data[:, 5], nan=1.0), 0.0, None)
+    category_weights = np.clip(np.nan_to_num(data[:, 6], nan=0.25), 0.0, None)
+    return employee_ids, department_ids, category_ids, normalized, metric_weights, category_weights
+
+
+def _weighted_mean(groups, values, weights, size):
+    """Средневзвешенное по группам; группы с нулевым суммарным весом — простое среднее."""
+    weight_sums = np.bincount(groups, weights=weights, minlength=size)
+    counts = np.bincount(groups, minlength=size)
+    plain = np.bincount(groups, weights=values, minlength=size) / np.maximum(counts, 1)
+    weighted = np.bincount(groups, weights=values * weights, minlength=size)
+    return np.where(weight_sums > 0, weighted / np.where(weight_sums > 0, weight_sums, 1), plain)
+
+
+def composite_scores(employee_ids, department_ids, category_ids, normalized, metric_weights, category_weights):
+    """Итоговые баллы (0..100) по массивам оценок. Возвращает EmployeeScores."""
+    if not len(employee_ids):
+        empty = np.array([], dtype=float)
+        return EmployeeScores(np.array([], dtype=np.int64), np.array([], dtype=np.int64), empty, empty, empty)
+
+    emp_unique, emp_index = np.unique(employee_ids, return_inverse=True)
+    # Пара (сотрудник, категория) -> балл категории: средневзвешенное по метрикам.
+    # Пара кодируется одним целым — np.unique по одномерному массиву в разы быстрее, чем по строкам
+    span = int(category_ids.max()) + 1
+    pairs, pair_index = np.unique(emp_index * span + category_ids, return_inverse=True)
+    pair_index = pair_index.ravel()
+    category_scores = _weighted_mean(pair_index, normalized, metric_weights, len(pairs))
+    # Вес категории у пары один и тот же — берём из любой строки пары
+    pair_weights = np.zeros(len(pairs))
+    pair_weights[pair_index] = category_weights
+    composite = _weighted_mean(pairs // span, category_scores, pair_weights, len(emp_unique)) * 100.0
+
+    departments = np.zeros(len(emp_unique), dtype=np.int64)
+    departments[emp_index] = department_ids
+    std = composite.std()
+    zscores = (composite - composite.mean()) / std if std > 0 else np.zeros_like(composite)
+    # Процентильный ранг: доля сотрудников с баллом не выше (одинаковые баллы — одинаковый ранг)
+    ordered = np.sort(composite)
+    percentiles = np.searchsorted(ordered, composite, side='right') / len(composite) * 100.0
+    return EmployeeScores(emp_unique, departments, composite, zscores, percentiles)
+
+
+def distribution(values):
+    """Distribution по массиву итоговых баллов; гистограмма — COMPOSITE_BINS корзин по 0..100."""
+    if not len(values):
+        return Distribution(0, None, None, None, None, {p: None for p in PERCENTILES}, [0] * COMPOSITE_BINS)
+    histogram, _ = np.histogram(values, bins=COMPOSITE_BINS, range=(0.0, 100.0))
+    return Distribution(
+        int(len(values)), float(values.mean()), float(values.std()), float(values.min()), float(values.max()),
+        dict(zip(PERCENTILES, (float(v) for v in np.percentile(values, PERCENTILES)))),
+        histogram.tolist()
+    )
+
+
+def _department_distributions(scores):
+    """{department_id: Distribution}: сотрудники сортируются по подразделению и режутся на группы."""
+    if not len(scores.employee_ids):
+        return {}
+    order = np.argsort(scores.department_ids, kind='stable')
+    departments, starts = np.unique(scores.department_ids[order], return_index=True)
+    groups = np.split(scores.composite[order], starts[1:])
+    return {int(department_id): distribution(group) for department_id, group in zip(departments, groups)}
+
+
+def compute(cycle_id):
+    scores = composite_scores(*_load_arrays(cycle_id))
+    return CycleAnalytics(
+        cycle_id, scores, distribution(scores.composite), _department_distributions(scores),
+        {'above': int((scores.zscores > OUTLIER_Z).sum()), 'below': int((scores.zscores < -OUTLIER_Z).sum())}
+    )
+
+
+def cycle_analytics(cycle_id):
+    """Аналитика цикла из кэша. Ключ включает строку cycle_stats (меняется при любой записи оценок,
+    в том числе мимо сессии) и версии таблиц метрик, категорий и сотрудников."""
+    stats = db.session.get(CycleStats, cycle_id)
+    stamp = (stats.score_count, stats.score_sum, stats.histogram) if stats else None
+    versions = tuple(caching.table_version(table) for table in _DEPENDS)
+    key = (cycle_id, stamp, versions)
+    result = _cache.get(key)
+    if result is None:
+        result = compute(cycle_id)
+        _cache.set(key, result, ANALYTICS_TTL)
+    return result
+
+
+def department_rows(analytics):
+    """Строки для таблицы распределения по подразделениям, по убыванию медианы."""
+    names = dict(db.session.query(Department.id, Department.name)
+                 .filter(Department.id.in_(list(analytics.departments))).all()) if analytics.departments else {}
+    rows = [{'name': names.get(department_id, '—'), 'distribution': item}
+            for department_id, item in analytics.departments.items()]
+    return sorted(rows, key=lambda row: row['distribution'].percentiles[50], reverse=True)
@@ -1,7 +1,8 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required
+from sqlalchemy import func
 from app.models import Employee
-from werkzeug.security import check_password_hash
+from app import principals, ratelimit
 
 auth = Blueprint('auth', __name__)
 
@@ -9,18 +10,44 @@ auth = Blueprint('auth', __name__)
 @auth.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        email = request.form.get('email')
+        email = (request.form.get('email') or '').strip().lower()
         password = request.form.get('password')
 
-        employee = Employee.query.filter_by(email=email).first()
-
-        if employee and check_password_hash(employee.password_hash, password):
+        # Попытка по IP списывается до проверки пароля: при переборе хэш не считается вовсе.
+        # Корзина пары IP и email только проверяется — списывается лишь неудачной попыткой.
+        # Адрес за обратным прокси — из X-Forwarded-For (PROXY_FIX_HOPS)
+        account = ratelimit.account_key(request.remote_addr, email)
+        wait = ratelimit.check(ip=request.remote_addr) or ratelimit.wait('account', account)
+        if wait:
+            flash(f'Слишком много попыток входа. Повторите через {wait} с.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(wait)}
+        # Неудачи с любых адресов к этому email только замедляют вход — владельца они не блокируют
+        ratelimit.throttle('email', email)
+
+        # Поиск по индексу ix_employees_email_lower
+        employee = Employee.query.filter(func.lower(Employee.email) == email).first()
+
+        try:
+            # Для неизвестного email проверяется фиктивный хэш — ответ приходит за то же время
+            valid = ratelimit.verify_password(employee.password_hash if employee else None, password)
+        except ratelimit.Busy:
+            flash('Сервер перегружен, повторите вход через несколько секунд.', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '1'}
+
+        if not valid:
+            ratelimit.hit('account', account)
+            ratelimit.hit('email', email)
+        else:
+            # Удачный вход возвращает неудачные попытки с этого адреса: опечатки до него не копятся.
+            # Корзина email не сбрасывается — перебор с других адресов продолжает её замедлять
+            ratelimit.reset('account', account)
+            # При входе данные пользователя перечитываются заново
+            principals.invalidate(employee.id)
             login_user(employee)
 
             flash(f'Добро пожаловать, {employee.full_name}!', 'success')
-            return redirect(url_for('views.employees')) 
-        else:
-            flash('Неверный email или пароль.', 'error')
+            return redirect(url_for('views.employees'))
+        flash('Неверный email или пароль.', 'error')
 
     return render_template('login.html')
 
@@ -0,0 +1,274 @@
+import hashlib
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Кэш готовых страниц для анонимных посетителей. Ключ страницы включает версии таблиц, от которых
+# она зависит: запись в таблицу через сессию меняет её версию, и старые страницы больше не находятся.
+# Версии хранятся в том же хранилище, поэтому файловый кэш сбрасывается сразу во всех процессах.
+
+
+class MemoryBackend:
+    """LRU-кэш процесса с временем жизни записей."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemBackend:
+    """Кэш в каталоге: файл на ключ, общий для всех процессов сервера. Раз в CLEANUP_INTERVAL секунд
+    удаляются истёкшие файлы; когда файлов больше maxsize — ещё и самые давние, до трёх четвертей maxsize."""
+
+    # Заголовок файла — момент истечения (0 — бессрочно): очистка читает только его
+    _HEADER = struct.Struct('<d')
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self, directory, maxsize=1024):
+        self.directory = directory
+        self.maxsize = maxsize
+        self._cleaned = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.cache')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, = self._HEADER.unpack(f.read(self._HEADER.size))
+                if expires and expires < time.time():
+                    value = None
+                else:
+                    return pickle.load(f)
+        except (OSError, EOFError, struct.error, pickle.UnpicklingError):
+            return None
+        self._remove(path)
+        return value
+
+    def set(self, key, value, ttl=None):
+        # Пишем во временный файл и подменяем целиком — читатели не увидят половину записи
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._HEADER.pack(time.time() + ttl if ttl else 0.0))
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            self._remove(tmp)
+            return
+        with self._lock:
+            # Счёт приблизительный: перезапись ключа и записи других процессов не учитываются
+            self._count += 1
+            due = self._count > self.maxsize or time.time() - self._cleaned > self.CLEANUP_INTERVAL
+        if due:
+            self.cleanup()
+
+    def cleanup(self):
+        """Удаляет истёкшие записи (в том числе страницы старых версий таблиц — они не читаются
+        и истекают по ttl) и брошенные временные файлы; при переполнении — самые давние."""
+        now = time.time()
+        with self._lock:
+            self._cleaned = now
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.tmp'):
+                    if entry.stat().st_mtime < now - self.CLEANUP_INTERVAL:
+                        self._remove(entry.path)
+                    continue
+                if not entry.name.endswith('.cache'):
+                    continue
+                with open(entry.path, 'rb') as f:
+                    expires, = self._HEADER.unpack(f.read(self._HEADER.size))
+                mtime = entry.stat().st_mtime
+            except (OSError, struct.error):
+                continue
+            if expires and expires < now:
+                self._remove(entry.path)
+            else:
+                entries.append((mtime, entry.path))
+        if len(entries) > self.maxsize:
+            # Ужимаем с запасом, чтобы следующая очистка по переполнению была не на каждой записи
+            entries.sort()
+            excess = len(entries) - self.maxsize * 3 // 4
+            for _, path in entries[:excess]:
+                self._remove(path)
+            entries = entries[excess:]
+        with self._lock:
+            self._count = len(entries)
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.cache'):
+                self._remove(os.path.join(self.directory, name))
+
+
+class NullBackend:
+    """Кэш выключен."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+backend = NullBackend()
+
+
+def init_app(app):
+    global backend
+    kind = app.config.get('RESPONSE_CACHE_TYPE', 'memory')
+    if kind == 'filesystem':
+        backend = FileSystemBackend(app.config['RESPONSE_CACHE_DIR'], app.config.get('RESPONSE_CACHE_DIR_SIZE', 1024))
+    elif kind == 'memory':
+        backend = MemoryBackend(app.config.get('RESPONSE_CACHE_SIZE', 256))
+    else:
+        backend = NullBackend()
+
+
+def table_version(table):
+    key = f'version:{table}'
+    version = backend.get(key)
+    if version is None:
+        # Версия могла вытесниться из LRU — новая не совпадёт ни с одной из прежних
+        version = time.time_ns()
+        backend.set(key, version)
+    return version
+
+
+def invalidate(*tables):
+    """Сбросить страницы, зависящие от таблиц (для записей мимо сессии: массовые UPDATE/DELETE, Core)."""
+    for table in tables:
+        backend.set(f'version:{table}', time.time_ns())
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_changed_tables(session, flush_context):
+    changed = session.info.setdefault('cache_changed_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table:
+            changed.add(table)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    changed = session.info.pop('cache_changed_tables', None)
+    if changed:
+        invalidate(*changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_tables(session):
+    session.info.pop('cache_changed_tables', None)
+
+
+def _cacheable_request():
+    # Страницы вошедших пользователей содержат их имя и меню; несъеденные flash-сообщения
+    # должны попасть на страницу — такие запросы не кэшируем
+    return request.method == 'GET' and not current_user.is_authenticated and '_flashes' not in session
+
+
+def _page_key(query_args, versions):
+    # Ключ — путь и только те параметры запроса, которые читает страница: произвольные
+    # параметры в адресе не плодят копии одной и той же страницы
+    params = '&'.join(f'{name}={request.args.get(name, "")}' for name in query_args)
+    return f'page:{request.path}?{params}|{versions}'
+
+
+def cached_page(ttl=300, depends=(), query_args=()):
+    """Кэширует страницу для анонимных посетителей на ttl секунд (RESPONSE_CACHE_TTLS переопределяет
+    по имени маршрута) и до записи в любую из таблиц depends. query_args — параметры запроса, от которых
+    зависит страница. Отдаёт ETag и Last-Modified, на условный запрос с совпавшей версией отвечает 304."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _cacheable_request():
+                return f(*args, **kwargs)
+
+            versions = ','.join(f'{table}={table_version(table)}' for table in depends)
+            key = _page_key(query_args, versions)
+            entry = backend.get(key)
+            if entry is None:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200 or response.direct_passthrough or 'Set-Cookie' in response.headers:
+                    return response
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'last_modified': datetime.now(timezone.utc).replace(microsecond=0)
+                }
+                route_ttl = current_app.config.get('RESPONSE_CACHE_TTLS', {}).get(request.endpoint, ttl)
+                backend.set(key, entry, route_ttl)
+
+            response = current_app.response_class(entry['body'], mimetype=entry['mimetype'])
+            response.set_etag(entry['etag'])
+            response.last_modified = entry['last_modified']
+            # Браузер хранит страницу, но перед показом сверяет её с сервером
+            response.cache_control.public = True
+            response.cache_control.max_age = 0
+            response.cache_control.must_revalidate = True
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
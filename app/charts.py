@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+from flask import current_app, request
+from app.extensions import db
+from app.models import Department, DepartmentCycleStats, CategoryCycleStats, MetricCategory
+from app import aggregates, analytics
+
+# Данные графиков для /api/charts/*: страницы отдают только каркас, графики подгружаются отдельно
+# (static/scripts.js). Ответ — готовые корзины и ряды в одном формате для Chart.js:
+# {"type": ..., "labels": [...], "datasets": [{"label": ..., "data": [...]}]}.
+# Размер ответа зависит от числа корзин, циклов и подразделений, но не от числа оценок.
+
+# Сколько секунд браузер и прокси хранят данные графиков общей статистики
+CHART_MAX_AGE = 60
+# Ответы короче не сжимаются: выигрыш меньше заголовков
+GZIP_MIN_SIZE = 512
+
+
+def chart(kind, labels, datasets, **options):
+    return dict(type=kind, labels=labels, datasets=datasets, **options)
+
+
+def empty_chart(kind='bar'):
+    return chart(kind, [], [])
+
+
+def score_histogram(cycle_id):
+    """Баллы цикла по корзинам 0..10 — из материализованной гистограммы."""
+    bins = aggregates.cycle_histogram(aggregates.get_cycle_stats(cycle_id))
+    labels = [str(i) for i in range(len(bins))]
+    labels[-1] += '+'
+    return chart('bar', labels, [{'label': 'Оценок', 'data': bins}])
+
+
+def department_averages(cycle_id):
+    rows = db.session.query(Department.name, DepartmentCycleStats.score_sum, DepartmentCycleStats.score_count) \
+        .join(Department, Department.id == DepartmentCycleStats.department_id) \
+        .filter(DepartmentCycleStats.cycle_id == cycle_id, DepartmentCycleStats.score_count > 0) \
+        .order_by(Department.name).all()
+    return chart('bar', [row.name for row in rows],
+                 [{'label': 'Средний балл', 'data': [round(row.score_sum / row.score_count, 2) for row in rows]}])
+
+
+def category_averages(cycle_id):
+    rows = db.session.query(MetricCategory.name, CategoryCycleStats.score_sum, CategoryCycleStats.score_count) \
+        .join(MetricCategory, MetricCategory.id == CategoryCycleStats.category_id) \
+        .filter(CategoryCycleStats.cycle_id == cycle_id, CategoryCycleStats.score_count > 0) \
+        .order_by(MetricCategory.name).all()
+    return chart('bar', [row.name for row in rows],
+                 [{'label': 'Средний балл', 'data': [round(row.score_sum / row.score_count, 2) for row in rows]}])
+
+
+def composite_histogram(cycle_id):
+    overall = analytics.cycle_analytics(cycle_id).overall
+    width = 100 // analytics.COMPOSITE_BINS
+    labels = [f"{i * width}–{(i + 1) * width}" for i in range(analytics.COMPOSITE_BINS)]
+    return chart('bar', labels, [{'label': 'Сотрудников', 'data': overall.histogram}])
+
+
+def employee_performance(rows, weighted=False):
+    """Динамика сотрудника по циклам: rows — из views.employee_cycle_scores."""
+    labels = [f"{row.name} ({row.start_date.strftime('%m.%Y')})" for row in rows]
+    label = 'Взвешенный балл' if weighted else 'Средний балл'
+    return chart('line', labels, [{'label': label, 'data': [round(float(row.avg_score), 2) for row in rows]}])
+
+
+def chart_response(payload, max_age=CHART_MAX_AGE, private=False):
+    """JSON с ETag и Cache-Control; на совпавший If-None-Match — 304, при поддержке клиентом — gzip."""
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha1(body).hexdigest()
+    response = current_app.response_class(body, mimetype='application/json')
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.vary.add('Accept-Encoding')
+    if len(body) >= GZIP_MIN_SIZE and 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        # У сжатого и несжатого представлений разные ETag
+        etag += '-gz'
+    response.set_etag(etag)
+    return response.make_conditional(request)
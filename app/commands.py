@@ -0,0 +1,89 @@
+import click
+from app.extensions import db
+
+
+def register_commands(app):
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        """Применить непримененные миграции схемы."""
+        from app.migrations import run_migrations
+        done = run_migrations(log=click.echo)
+        click.echo(f"Применено миграций: {len(done)}")
+
+    @app.cli.command('db-status')
+    def db_status():
+        """Показать непримененные миграции схемы."""
+        from app.migrations import pending_migrations
+        pending = pending_migrations()
+        for version, description in pending:
+            click.echo(f"{version}: {description}")
+        click.echo(f"Ожидают применения: {len(pending)}")
+
+    @app.cli.command('cycles-tick')
+    def cycles_tick():
+        """Завершить истёкшие и запустить запланированные циклы оценки (для запуска по cron)."""
+        from app.cycles import run_maintenance
+        expired, activated = run_maintenance()
+        click.echo(f"Завершено циклов: {expired}, запущено: {activated}")
+
+    @app.cli.command('photos-backfill')
+    @click.option('--force', is_flag=True, help='Пересоздать копии и для уже обработанных фото.')
+    def photos_backfill(force):
+        """Подготовить уменьшенные копии фото сотрудников, загруженных до появления копий."""
+        from app.images import backfill
+        from app.models import Employee
+
+        query = Employee.query.filter(Employee.photo.isnot(None), Employee.photo != '')
+        if not force:
+            query = query.filter(Employee.photo_hash.is_(None))
+        employees = query.all()
+        hashes = backfill(employees)
+        for employee in employees:
+            if employee.id in hashes:
+                employee.photo_hash = hashes[employee.id]
+        db.session.commit()
+        click.echo(f"Обработано фото: {len(hashes)} из {len(employees)}")
+
+    @app.cli.command('search-reindex')
+    def search_reindex():
+        """Перестроить полнотекстовый индекс поиска."""
+        from app.search import reindex
+        count = reindex()
+        db.session.commit()
+        click.echo(f"В индексе записей: {count}")
+
+    @app.cli.command('stats-rebuild')
+    @click.option('--cycle', 'cycle_id', type=int, help='ID цикла (по умолчанию — все циклы).')
+    def stats_rebuild(cycle_id):
+        """Пересобрать материализованную статистику по циклам."""
+        from app.aggregates import rebuild_cycle_stats
+        from app.models import EvaluationCycle
+
+        cycle_ids = [cycle_id] if cycle_id else [c.id for c in EvaluationCycle.query.order_by(EvaluationCycle.id)]
+        for cid in cycle_ids:
+            computed = rebuild_cycle_stats(cid)
+            db.session.commit()
+            click.echo(f"Цикл {cid}: {computed['cycle']['score_count']} оценок, "
+                       f"{computed['cycle']['evaluated_count']} сотрудников")
+
+    @app.cli.command('stats-check')
+    @click.option('--cycle', 'cycle_id', type=int, help='ID цикла (по умолчанию — все циклы).')
+    def stats_check(cycle_id):
+        """Сверить материализованную статистику с полным пересчётом."""
+        from app.aggregates import check_cycle_stats
+        from app.models import EvaluationCycle
+
+        cycle_ids = [cycle_id] if cycle_id else [c.id for c in EvaluationCycle.query.order_by(EvaluationCycle.id)]
+        failed = False
+        for cid in cycle_ids:
+            problems = check_cycle_stats(cid)
+            if problems:
+                failed = True
+                click.echo(f"Цикл {cid}: расхождений — {len(problems)}")
+                for problem in problems:
+                    click.echo(f"  {problem}")
+            else:
+                click.echo(f"Цикл {cid}: OK")
+        if failed:
+            raise SystemExit(1)
@@ -20,13 +20,108 @@ class Config:
     LOGIN_MESSAGE = 'Пожалуйста, войдите, чтобы получить доступ к этой странице.'
     LOGIN_MESSAGE_CATEGORY = 'info'
 
+    # Фоновые задачи: число рабочих потоков и каталог для загрузок и готовых файлов
+    JOB_WORKERS = 2
+    JOBS_FOLDER = os.path.join(BASE_DIR, 'jobs_data')
+    # Выполнять задачи сразу в потоке запроса (для тестов)
+    JOBS_EAGER = False
+
+    # Уменьшенные копии фото сотрудников: потоки пула и каталог (по умолчанию static/uploads/thumbs)
+    IMAGE_WORKERS = 2
+    THUMBS_FOLDER = None
+
+    # Кэш пользователей для проверок доступа: размер и время жизни записи, сек (0 — без кэша)
+    PRINCIPAL_CACHE_SIZE = 1024
+    PRINCIPAL_CACHE_TTL = 60
+
+    # Планировщик циклов оценки: окончание и запуск по дате, раз в столько секунд (0 — только flask cycles-tick).
+    # Запускается из main.py; по умолчанию выключен, включён в production
+    CYCLE_SCHEDULER_INTERVAL = 0
+
+    # Кэш публичных страниц (app/caching.py): memory — LRU процесса, filesystem — общий каталог, none — выключен
+    RESPONSE_CACHE_TYPE = 'memory'
+    RESPONSE_CACHE_SIZE = 256
+    RESPONSE_CACHE_DIR = os.path.join(BASE_DIR, 'cache_data')
+    # Файлов в каталоге кэша не больше стольких; лишние и истёкшие удаляются при записи
+    RESPONSE_CACHE_DIR_SIZE = 1024
+    # Время жизни страниц по имени маршрута, сек (перекрывает значения в декораторах)
+    RESPONSE_CACHE_TTLS = {}
+
+    # Сколько доверенных обратных прокси стоит перед сервером: адрес и схема клиента берутся из их
+    # X-Forwarded-For и X-Forwarded-Proto (ProxyFix). 0 — заголовки не учитываются, адрес — соединения.
+    # Задаётся только при развёртывании за прокси: без прокси клиент подставил бы любой адрес
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 0))
+
+    # Ограничение попыток входа (app/ratelimit.py): memory — в процессе, database — в таблице rate_limits,
+    # none — выключено. Лимиты — (попыток, за сколько секунд): ip — все попытки с адреса,
+    # account — неудачные попытки с адреса к одному email, email — неудачные попытки к email с любых адресов
+    # (мягкий лимит: сверх него вход не запрещается, а идёт после паузы LOGIN_THROTTLE_DELAY, сек)
+    LOGIN_RATE_LIMIT_STORAGE = 'memory'
+    LOGIN_RATE_LIMIT_SIZE = 10000
+    LOGIN_RATE_LIMITS = {
+        'ip': (20, 60),
+        'account': (5, 300),
+        'email': (20, 600),
+    }
+    LOGIN_THROTTLE_DELAY = 2.0
+    # Проверка паролей: потоков пула и сколько проверок может ждать в очереди
+    LOGIN_HASH_WORKERS = 2
+    LOGIN_HASH_QUEUE = 8
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(Config.BASE_DIR, "database_dev.db")}'
 
 
+class ProductionConfig(Config):
+    DEBUG = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', Config.SECRET_KEY)
+    DATABASE_PATH = os.environ.get('DATABASE_PATH', Config.DATABASE_PATH)
+    SQLALCHEMY_DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
+
+    # Пул соединений: столько потоков сервера работают с базой одновременно
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 3600
+    }
+    # Отдельный движок только для чтения под отчёты, статистику и выгрузки (app/database.py)
+    SQLALCHEMY_BINDS = {
+        'reports': {
+            'url': f'sqlite:///file:{DATABASE_PATH}?mode=ro&uri=true',
+            'pool_size': 5,
+            'max_overflow': 5
+        }
+    }
+    # WAL: читатели не блокируются пишущими запросами; busy_timeout — ожидание блокировки вместо
+    # ошибки "database is locked"; synchronous=NORMAL в WAL безопасен при падении процесса
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    }
+    # Несколько процессов сервера делят один кэш страниц и версии таблиц
+    RESPONSE_CACHE_TYPE = 'filesystem'
+    # Попытки входа считаются общими для всех процессов сервера
+    LOGIN_RATE_LIMIT_STORAGE = 'database'
+    CYCLE_SCHEDULER_INTERVAL = 60
+
+
+class TestingConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    # Тесты подставляют свою временную базу (tests/test.py); по умолчанию — в памяти
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
 config = {
     'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
\ No newline at end of file
@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import update, event
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models import Employee, EvaluationCycle, PerformanceMetric
+from app import caching
+
+# Активные циклы меняются только планировщиком (окончание, запуск по дате начала) и администратором,
+# поэтому страницы читают их из кэша процесса, а не запрашивают и тем более не правят на каждый запрос.
+
+# Неизменяемый снимок цикла: не привязан к сессии, безопасно отдавать в шаблоны из любого потока
+CycleInfo = namedtuple('CycleInfo', 'id name start_date end_date description is_active')
+
+# Состояние активного цикла: активные циклы, набор активных метрик и число участников (активных сотрудников)
+ActiveState = namedtuple('ActiveState', 'cycles metric_ids participant_count')
+
+# Сколько секунд живёт снимок (правки из других процессов видны не позже)
+ACTIVE_CYCLES_TTL = 60
+# Таблицы, запись в которые через сессию сбрасывает снимок
+_STATE_TABLES = {'evaluation_cycles', 'performance_metrics', 'employees'}
+
+_active = None
+_active_expires = 0
+_active_generation = 0
+_active_lock = threading.Lock()
+
+
+def expire_cycles(now=None):
+    """Снимает активность с циклов, у которых прошла дата окончания. Возвращает число циклов."""
+    result = db.session.execute(
+        update(EvaluationCycle)
+        .where(EvaluationCycle.is_active == True, EvaluationCycle.end_date < (now or datetime.utcnow()))
+        .values(is_active=False)
+    )
+    return result.rowcount
+
+
+def activate_due_cycles(now=None):
+    """Запускает запланированные циклы, у которых наступила дата начала. Возвращает число циклов.
+    Отметка снимается при запуске: цикл, вручную остановленный позже, сам не включится."""
+    now = now or datetime.utcnow()
+    result = db.session.execute(
+        update(EvaluationCycle)
+        .where(EvaluationCycle.auto_activate == True,
+               EvaluationCycle.start_date <= now,
+               EvaluationCycle.end_date >= now)
+        .values(is_active=True, auto_activate=False)
+    )
+    return result.rowcount
+
+
+def run_maintenance(now=None):
+    """Один проход планировщика: окончание и запуск циклов одной транзакцией.
+    Обновления условные, поэтому одновременный запуск в нескольких процессах безопасен."""
+    try:
+        expired = expire_cycles(now)
+        activated = activate_due_cycles(now)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if expired or activated:
+        # UPDATE идёт мимо событий сессии — кэши сбрасываем явно
+        invalidate()
+        caching.invalidate(EvaluationCycle.__tablename__)
+    return expired, activated
+
+
+def _snapshot(cycle):
+    return CycleInfo(cycle.id, cycle.name, cycle.start_date, cycle.end_date, cycle.description, cycle.is_active)
+
+
+def _current(state):
+    # Без планировщика (CYCLE_SCHEDULER_INTERVAL = 0 вне production) закончившийся цикл остаётся
+    # отмеченным активным — дата окончания проверяется при каждом чтении снимка
+    now = datetime.utcnow()
+    if all(cycle.end_date >= now for cycle in state.cycles):
+        return state
+    return state._replace(cycles=tuple(cycle for cycle in state.cycles if cycle.end_date >= now))
+
+
+def active_state():
+    """Снимок ActiveState из кэша; после сброса или по истечении ACTIVE_CYCLES_TTL — три запроса.
+    Циклы с прошедшей датой окончания в снимок не попадают, даже если их ещё не закрыл планировщик."""
+    global _active, _active_expires
+    with _active_lock:
+        if _active is not None and _active_expires > time.monotonic():
+            return _current(_active)
+        generation = _active_generation
+    rows = EvaluationCycle.query.filter_by(is_active=True).order_by(EvaluationCycle.id).all()
+    metric_ids = frozenset(metric_id for metric_id, in
+                           db.session.query(PerformanceMetric.id).filter(PerformanceMetric.is_active == True))
+    participant_count = Employee.query.filter_by(is_active=True).count()
+    state = ActiveState(tuple(_snapshot(cycle) for cycle in rows), metric_ids, participant_count)
+    with _active_lock:
+        # Сброс во время загрузки — снимок мог устареть, отдаём его только этому запросу
+        if generation == _active_generation:
+            _active = state
+            _active_expires = time.monotonic() + ACTIVE_CYCLES_TTL
+    return _current(state)
+
+
+def active_cycles():
+    """Активные циклы (снимки CycleInfo) по возрастанию id."""
+    return active_state().cycles
+
+
+def active_cycle():
+    """Текущий активный цикл (CycleInfo) или None."""
+    cycles = active_state().cycles
+    return cycles[0] if cycles else None
+
+
+def invalidate():
+    global _active, _active_generation
+    with _active_lock:
+        _active = None
+        _active_generation += 1
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_state_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if getattr(obj, '__tablename__', None) in _STATE_TABLES:
+            session.info['active_state_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('active_state_changed', False):
+        invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_state_changes(session):
+    session.info.pop('active_state_changed', None)
+
+
+class CycleScheduler:
+    """Фоновый поток процесса: раз в interval секунд вызывает run_maintenance."""
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='cycle-scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    expired, activated = run_maintenance()
+                    if expired or activated:
+                        self.app.logger.info(f"Циклы оценки: завершено {expired}, запущено {activated}")
+                except Exception:
+                    self.app.logger.exception("Ошибка планировщика циклов оценки")
+                finally:
+                    db.session.remove()
+
+
+def start_scheduler(app):
+    """Проход при запуске сервера и фоновый планировщик (CYCLE_SCHEDULER_INTERVAL > 0); вызывается
+    только из точки входа сервера (main.py), не из create_app — команды flask и тесты его не запускают.
+    При 0 проходы запускаются извне: flask cycles-tick по cron."""
+    interval = app.config.get('CYCLE_SCHEDULER_INTERVAL', 0)
+    if interval <= 0:
+        return
+    with app.app_context():
+        run_maintenance()
+        db.session.remove()
+    if 'cycle_scheduler' not in app.extensions:
+        scheduler = CycleScheduler(app, interval)
+        scheduler.start()
+        app.extensions['cycle_scheduler'] = scheduler
@@ -0,0 +1,132 @@
+import threading
+from collections import namedtuple
+from sqlalchemy import event, func, select, union_all
+from sqlalchemy.orm import Session, joinedload
+from app.extensions import db
+from app.models import EmployeeMetric, EmployeeCycleStats, EvaluationCycle, Feedback, PerformanceMetric
+from app import caching, pagination
+
+# Личный кабинет: оценки — одним запросом, обратная связь (непрочитанная и страница архива) — вторым.
+# Сводка пользователя (счётчики и средний балл за последний цикл) хранится в кэше процесса и
+# сбрасывается после коммита записи в его оценки или обратную связь.
+
+# Сводка: число полученных и выставленных оценок, непрочитанной и архивной обратной связи,
+# последний цикл с оценками пользователя и средний балл за него
+UserSummary = namedtuple('UserSummary', 'received_count given_count unread_count archived_count '
+                                        'latest_cycle latest_average')
+
+# Сколько секунд живёт сводка (записи из других процессов видны не позже)
+SUMMARY_TTL = 300
+SUMMARY_CACHE_SIZE = 1024
+ARCHIVE_PAGE_SIZE = 10
+ARCHIVE_ORDER = [(Feedback.created_at, True), (Feedback.id, True)]
+
+_summaries = caching.MemoryBackend(SUMMARY_CACHE_SIZE)
+# Поколение сводки пользователя: сброс во время загрузки не даёт сохранить устаревшую сводку
+_generations = {}
+_lock = threading.Lock()
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def _load_summary(user_id):
+    counts = db.session.execute(select(
+        _count(EmployeeMetric, EmployeeMetric.employee_id == user_id),
+        _count(EmployeeMetric, EmployeeMetric.evaluator_id == user_id),
+        _count(Feedback, Feedback.employee_id == user_id, Feedback.is_archived == False),
+        _count(Feedback, Feedback.employee_id == user_id, Feedback.is_archived == True),
+    )).one()
+    # Средние уже посчитаны в агрегатах (app/aggregates.py) — берём последний цикл по дате начала
+    latest = db.session.query(EvaluationCycle.name, EmployeeCycleStats.avg_score) \
+        .join(EvaluationCycle, EvaluationCycle.id == EmployeeCycleStats.cycle_id) \
+        .filter(EmployeeCycleStats.employee_id == user_id, EmployeeCycleStats.score_count > 0) \
+        .order_by(EvaluationCycle.start_date.desc(), EvaluationCycle.id.desc()) \
+        .first()
+    return UserSummary(*counts, *(latest or (None, None)))
+
+
+def user_summary(user_id):
+    """Сводка пользователя из кэша; при промахе — два запроса."""
+    summary = _summaries.get(user_id)
+    if summary is not None:
+        return summary
+    with _lock:
+        generation = _generations.get(user_id, 0)
+    summary = _load_summary(user_id)
+    with _lock:
+        if generation == _generations.get(user_id, 0):
+            _summaries.set(user_id, summary, SUMMARY_TTL)
+    return summary
+
+
+def invalidate(*user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _generations[user_id] = _generations.get(user_id, 0) + 1
+            _summaries.delete(user_id)
+
+
+def note_changes(session, user_ids):
+    """Сбросить сводки пользователей после коммита (для записей мимо событий сессии: Core, пакетные)."""
+    session.info.setdefault('dashboard_users', set()).update(user_ids)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_user_changes(session, flush_context):
+    users = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, EmployeeMetric):
+            users.update((obj.employee_id, obj.evaluator_id))
+        elif isinstance(obj, Feedback):
+            users.add(obj.employee_id)
+    if users:
+        note_changes(session, users)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    users = session.info.pop('dashboard_users', None)
+    if users:
+        invalidate(*users)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_user_changes(session):
+    session.info.pop('dashboard_users', None)
+
+
+def received_evaluations(user_id, cycle_ids):
+    """Оценки пользователя за циклы вместе с метрикой, её категорией и циклом — одним запросом."""
+    if not cycle_ids:
+        return []
+    return EmployeeMetric.query.options(
+        joinedload(EmployeeMetric.metric).joinedload(PerformanceMetric.category),
+        joinedload(EmployeeMetric.cycle)
+    ).filter(
+        EmployeeMetric.employee_id == user_id,
+        EmployeeMetric.cycle_id.in_(cycle_ids)
+    ).order_by(EmployeeMetric.cycle_id, EmployeeMetric.metric_id, EmployeeMetric.id).all()
+
+
+def feedback(user_id, cursor=None, per_page=ARCHIVE_PAGE_SIZE):
+    """(непрочитанная обратная связь, KeysetPage архива) одним запросом: id обеих выборок
+    объединяются через UNION ALL, записи загружаются с типом и отправителем."""
+    archive_query, state = pagination.keyset_query(
+        Feedback.query.filter(Feedback.employee_id == user_id, Feedback.is_archived == True),
+        ARCHIVE_ORDER, cursor, per_page
+    )
+    archive_ids = archive_query.with_entities(Feedback.id).subquery()
+    unread_ids = select(Feedback.id).where(Feedback.employee_id == user_id, Feedback.is_archived == False)
+    rows = Feedback.query.options(
+        joinedload(Feedback.feedback_type),
+        joinedload(Feedback.sender)
+    ).filter(Feedback.id.in_(union_all(unread_ids, select(archive_ids.c.id)))).all()
+
+    def key(item):
+        return item.created_at, item.id
+    unread = sorted((fb for fb in rows if not fb.is_archived), key=key, reverse=True)
+    # keyset_page ждёт строки в порядке запроса страницы: от курсора вперёд или назад
+    archived = sorted((fb for fb in rows if fb.is_archived), key=key, reverse=pagination.is_forward(state))
+    return unread, pagination.keyset_page(archived, ARCHIVE_ORDER, state, per_page)
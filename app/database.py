@@ -0,0 +1,51 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.extensions import db
+
+# Имя привязки (SQLALCHEMY_BINDS) для отчётных запросов только на чтение
+REPORTS_BIND = 'reports'
+
+
+def init_app(app):
+    """Настройки соединений SQLite из SQLITE_PRAGMAS: выставляются при каждом новом подключении пула."""
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if engine.dialect.name != 'sqlite':
+                continue
+            read_only = bind_key == REPORTS_BIND
+            event.listen(engine, 'connect', _pragma_setter(pragmas, read_only))
+
+
+def _pragma_setter(pragmas, read_only):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                # Режим журнала хранится в файле базы, с соединения только для чтения его не сменить
+                if read_only and name == 'journal_mode':
+                    continue
+                cursor.execute(f"PRAGMA {name}={value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+@contextmanager
+def report_session():
+    """Сессия для тяжёлых отчётных запросов: на отдельном движке только для чтения, если он настроен,
+    иначе — обычная сессия приложения. В WAL-режиме такие чтения не ждут пишущие запросы."""
+    engine = db.engines.get(REPORTS_BIND)
+    if engine is None:
+        yield db.session
+        return
+    session = Session(bind=engine)
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,245 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import event, insert, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.extensions import db
+from app.models import Employee, EmployeeMetric, PerformanceMetric, MetricExclusion
+from app import aggregates, dashboard
+
+
+class SaveResult:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    @property
+    def saved(self):
+        return self.inserted + self.updated
+
+
+class MetricRules:
+    """Снимок правил применимости метрик: активные метрики (общие и по подразделениям) и исключения.
+    Наборы id для пары (подразделение, должность) вычисляются один раз, исключения сотрудника — поверх."""
+
+    def __init__(self, metrics, exclusions):
+        global_ids = set()
+        by_department = defaultdict(set)
+        for metric_id, department_id in metrics:
+            if department_id is None:
+                global_ids.add(metric_id)
+            else:
+                by_department[department_id].add(metric_id)
+        by_position = defaultdict(set)
+        by_employee = defaultdict(set)
+        for metric_id, employee_id, position_id in exclusions:
+            if employee_id:
+                by_employee[employee_id].add(metric_id)
+            else:
+                by_position[position_id].add(metric_id)
+
+        self.global_ids = frozenset(global_ids)
+        self.by_department = {key: frozenset(ids) for key, ids in by_department.items()}
+        self.excluded_by_position = {key: frozenset(ids) for key, ids in by_position.items()}
+        self.excluded_by_employee = {key: frozenset(ids) for key, ids in by_employee.items()}
+        self._combinations = {}
+        self._lock = threading.Lock()
+
+    def for_position(self, department_id, position_id):
+        key = (department_id, position_id)
+        ids = self._combinations.get(key)
+        if ids is None:
+            ids = (self.global_ids | self.by_department.get(department_id, frozenset())) \
+                - self.excluded_by_position.get(position_id, frozenset())
+            with self._lock:
+                self._combinations[key] = ids
+        return ids
+
+    def for_employee(self, employee_id, department_id, position_id):
+        ids = self.for_position(department_id, position_id)
+        excluded = self.excluded_by_employee.get(employee_id)
+        return ids - excluded if excluded else ids
+
+
+# Сколько секунд живёт снимок правил (правки из других процессов видны не позже)
+METRIC_RULES_TTL = 60
+
+_rules = None
+_rules_expires = 0
+_rules_generation = 0
+_rules_lock = threading.Lock()
+
+
+def metric_rules():
+    global _rules, _rules_expires
+    with _rules_lock:
+        if _rules is not None and _rules_expires > time.monotonic():
+            return _rules
+        generation = _rules_generation
+    metrics = db.session.query(PerformanceMetric.id, PerformanceMetric.department_id) \
+        .filter(PerformanceMetric.is_active == True).all()
+    exclusions = db.session.query(MetricExclusion.metric_id, MetricExclusion.employee_id,
+                                  MetricExclusion.position_id).all()
+    rules = MetricRules(metrics, exclusions)
+    with _rules_lock:
+        # Если правила успели сбросить во время загрузки — снимок уже устарел, не сохраняем его
+        if generation == _rules_generation:
+            _rules = rules
+            _rules_expires = time.monotonic() + METRIC_RULES_TTL
+    return rules
+
+
+def invalidate_metric_rules():
+    """Сбросить кэш применимости метрик (после изменения метрик или исключений)."""
+    global _rules, _rules_generation
+    with _rules_lock:
+        _rules = None
+        _rules_generation += 1
+
+
+# Изменения метрик и исключений через сессию сбрасывают кэш после коммита
+@event.listens_for(Session, 'after_flush')
+def _note_metric_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (PerformanceMetric, MetricExclusion)):
+            session.info['metric_rules_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('metric_rules_changed', False):
+        invalidate_metric_rules()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_metric_changes(session):
+    session.info.pop('metric_rules_changed', None)
+
+
+def applicable_metric_ids(employees):
+    """{employee_id: frozenset(metric_id)} — по кэшированным правилам, без запросов к базе."""
+    rules = metric_rules()
+    return {
+        employee.id: rules.for_employee(employee.id, employee.department_id, employee.position_id)
+        for employee in employees
+    }
+
+
+def department_metric_ids(department_id):
+    """{employee_id: frozenset(metric_id)} для всех активных сотрудников подразделения — один запрос к сотрудникам."""
+    employees = db.session.query(Employee.id, Employee.department_id, Employee.position_id) \
+        .filter(Employee.department_id == department_id, Employee.is_active == True) \
+        .order_by(Employee.id).all()
+    return applicable_metric_ids(employees)
+
+
+def applicable_metrics(employees):
+    """Активные метрики, по которым можно оценить каждого сотрудника: {employee_id: {metric_id: метрика}}.
+    Метрики подразделения и общие, без исключений по должности и по сотруднику; сами метрики — одним запросом."""
+    ids = applicable_metric_ids(employees)
+    all_ids = set().union(*ids.values()) if ids else set()
+    metrics = PerformanceMetric.query.filter(PerformanceMetric.id.in_(all_ids)) \
+        .order_by(PerformanceMetric.id).all() if all_ids else []
+    return {
+        employee_id: {metric.id: metric for metric in metrics if metric.id in metric_ids}
+        for employee_id, metric_ids in ids.items()
+    }
+
+
+# Уникальный ключ оценки, по которому работает ON CONFLICT (миграция 0010, flask db-upgrade)
+UNIQUE_KEY_INDEX = 'uq_employee_metrics_employee_cycle_metric_evaluator'
+
+_unique_key_ready = False
+
+
+def has_unique_key():
+    """Есть ли в базе уникальный ключ оценки. Найденный ключ запоминается; пока его нет — проверяется
+    при каждом сохранении, чтобы сервер перешёл на UPSERT сразу после flask db-upgrade."""
+    global _unique_key_ready
+    if not _unique_key_ready:
+        _unique_key_ready = db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"), {'name': UNIQUE_KEY_INDEX}
+        ).first() is not None
+    return _unique_key_ready
+
+
+def save_evaluations(cycle_id, evaluator_id, scores):
+    """Сохраняет оценки одного оценщика за цикл: scores — {(employee_id, metric_id): (балл, комментарий)}.
+    Существующие оценки читаются одним запросом, неизменённые пропускаются, остальное пишется
+    одним INSERT ... ON CONFLICT DO UPDATE по ключу оценки (до миграции 0010 — пакетными INSERT
+    и UPDATE по id найденных оценок). Коммит — на стороне вызывающего кода."""
+    result = SaveResult()
+    if not scores:
+        return result
+
+    existing = {}
+    row_ids = {}
+    rows = db.session.query(
+        EmployeeMetric.id, EmployeeMetric.employee_id, EmployeeMetric.metric_id,
+        EmployeeMetric.score, EmployeeMetric.comment
+    ).filter(
+        EmployeeMetric.cycle_id == cycle_id,
+        EmployeeMetric.evaluator_id == evaluator_id,
+        EmployeeMetric.employee_id.in_({employee_id for employee_id, _ in scores})
+    )
+    for row in rows:
+        existing[(row.employee_id, row.metric_id)] = (row.score, row.comment)
+        row_ids[(row.employee_id, row.metric_id)] = row.id
+
+    values = []
+    changes = []
+    now = datetime.utcnow()
+    for (employee_id, metric_id), (score, comment) in scores.items():
+        key = (cycle_id, employee_id, metric_id)
+        old = existing.get((employee_id, metric_id))
+        if old is not None:
+            if old == (score, comment):
+                result.unchanged += 1
+                continue
+            changes.append((key, old[0], -1))
+            result.updated += 1
+        else:
+            result.inserted += 1
+        changes.append((key, score, 1))
+        values.append({
+            'employee_id': employee_id,
+            'metric_id': metric_id,
+            'cycle_id': cycle_id,
+            'evaluator_id': evaluator_id,
+            'score': score,
+            'comment': comment,
+            'evaluated_at': now
+        })
+
+    if not values:
+        return result
+    if has_unique_key():
+        statement = sqlite_insert(EmployeeMetric.__table__)
+        # Дата первой оценки при обновлении не меняется — как и при правке через форму раньше
+        statement = statement.on_conflict_do_update(
+            index_elements=['employee_id', 'cycle_id', 'metric_id', 'evaluator_id'],
+            set_={'score': statement.excluded.score, 'comment': statement.excluded.comment}
+        )
+        db.session.execute(statement, values)
+    else:
+        # До миграции 0010 ключа для ON CONFLICT нет: новые оценки вставляются, найденные — обновляются по id
+        inserts = []
+        updates = []
+        for row in values:
+            row_id = row_ids.get((row['employee_id'], row['metric_id']))
+            if row_id is None:
+                inserts.append(row)
+            else:
+                updates.append({'id': row_id, 'score': row['score'], 'comment': row['comment']})
+        if inserts:
+            db.session.execute(insert(EmployeeMetric), inserts)
+        if updates:
+            db.session.execute(update(EmployeeMetric), updates)
+    # Запись идёт мимо событий сессии — агрегаты и сводки кабинета обновляем явно
+    aggregates.apply_score_changes(db.session, changes)
+    dashboard.note_changes(db.session, {evaluator_id} | {row['employee_id'] for row in values})
+    return result
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+from sqlalchemy.orm import aliased
+from app.database import report_session
+from app.models import Employee, Department, PerformanceMetric, MetricCategory, EmployeeMetric
+
+# Сколько строк читаем из базы за раз (серверный курсор, память не зависит от размера цикла)
+EXPORT_ROWS_BATCH = 1000
+# Размер блока при отдаче готового XLSX
+EXPORT_FILE_BLOCK = 64 * 1024
+
+EXPORT_COLUMNS = ('id', 'employee', 'email', 'department', 'metric', 'category',
+                  'score', 'comment', 'evaluator', 'evaluated_at')
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+
+# Оценки цикла со справочными полями, по возрастанию id
+def evaluation_rows(session, cycle_id):
+    Evaluator = aliased(Employee)
+    query = session.query(
+        EmployeeMetric.id,
+        Employee.full_name,
+        Employee.email,
+        Department.name,
+        PerformanceMetric.name,
+        MetricCategory.name,
+        EmployeeMetric.score,
+        EmployeeMetric.comment,
+        Evaluator.email,
+        EmployeeMetric.evaluated_at
+    ).join(Employee, EmployeeMetric.employee_id == Employee.id) \
+     .outerjoin(Department, Employee.department_id == Department.id) \
+     .join(PerformanceMetric, EmployeeMetric.metric_id == PerformanceMetric.id) \
+     .outerjoin(MetricCategory, PerformanceMetric.category_id == MetricCategory.id) \
+     .outerjoin(Evaluator, EmployeeMetric.evaluator_id == Evaluator.id) \
+     .filter(EmployeeMetric.cycle_id == cycle_id) \
+     .order_by(EmployeeMetric.id)
+    return query.yield_per(EXPORT_ROWS_BATCH)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= EXPORT_ROWS_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def generate_csv(rows):
+    # BOM — чтобы Excel открыл кириллицу без настройки кодировки
+    yield '\ufeff'
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in _batches(rows):
+        for row in batch:
+            writer.writerow(row[:-1] + (_iso(row[-1]),))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def generate_jsonl(rows):
+    for batch in _batches(rows):
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row[:-1] + (_iso(row[-1]),))), ensure_ascii=False) + '\n'
+            for row in batch
+        )
+
+
+def generate_xlsx(rows):
+    # Книга в write-only режиме: строки сразу уходят во временный файл на диске,
+    # готовый файл отдаётся блоками (формат zip не позволяет отдавать его до записи целиком)
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Оценки')
+    sheet.append(EXPORT_COLUMNS)
+    for row in rows:
+        sheet.append(tuple(row))
+
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook.save(path)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(EXPORT_FILE_BLOCK), b''):
+                yield block
+    finally:
+        os.remove(path)
+
+
+GENERATORS = {
+    'csv': generate_csv,
+    'xlsx': generate_xlsx,
+    'jsonl': generate_jsonl,
+}
+
+
+def export_evaluations(cycle_id, fmt):
+    """Генератор содержимого выгрузки оценок цикла в формате fmt (csv, xlsx, jsonl)."""
+    with report_session() as session:
+        yield from GENERATORS[fmt](evaluation_rows(session, cycle_id))
@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, url_for
+from PIL import Image, ImageOps
+from app.extensions import db
+from app.models import Employee
+
+# Уменьшенные копии фото сотрудников: имя — хэш содержимого исходника, поэтому файл по адресу никогда
+# не меняется и отдаётся с кэшированием на год. Новое фото — новый хэш и новые адреса.
+# Вариант -> (размер, обрезать до квадрата). sm — аватары в списках (50px, с запасом под плотные экраны)
+VARIANTS = {
+    'sm': (100, True),
+    'md': (300, False),
+    'lg': (800, False),
+}
+# Формат -> (расширение, параметры сохранения Pillow)
+FORMATS = {
+    'webp': ('webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# Кэширование готовых копий браузером и CDN, сек
+THUMB_MAX_AGE = 365 * 24 * 3600
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2),
+                                           thread_name_prefix='images')
+    return _executor
+
+
+def thumbs_folder(app=None):
+    app = app or current_app
+    folder = app.config.get('THUMBS_FOLDER') or os.path.join(app.root_path, 'static', 'uploads', 'thumbs')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def thumb_name(digest, variant, fmt):
+    return f"{digest}_{variant}.{FORMATS[fmt][0]}"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:20]
+
+
+def generate_variants(source, folder):
+    """Пишет все варианты фото в folder; готовые файлы с тем же хэшем не пересоздаются. Возвращает хэш."""
+    digest = file_digest(source)
+    targets = {(variant, fmt): os.path.join(folder, thumb_name(digest, variant, fmt))
+               for variant in VARIANTS for fmt in FORMATS}
+    if all(os.path.exists(path) for path in targets.values()):
+        return digest
+
+    with Image.open(source) as original:
+        # Поворот по EXIF и перевод в RGB: у JPEG нет прозрачности, палитровые PNG сжимаются хуже
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    for variant, (size, square) in VARIANTS.items():
+        if square:
+            resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for fmt, (_, options) in FORMATS.items():
+            path = targets[(variant, fmt)]
+            # Запись во временный файл и переименование: браузер не получит недописанный файл
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            resized.save(tmp, fmt.upper(), **options)
+            os.replace(tmp, path)
+    return digest
+
+
+def remove_variants(digest, folder):
+    for variant in VARIANTS:
+        for fmt in FORMATS:
+            try:
+                os.remove(os.path.join(folder, thumb_name(digest, variant, fmt)))
+            except OSError:
+                pass
+
+
+def process_employee_photo(app, employee_id, photo, replaced_hash=None):
+    """Готовит копии фото и записывает хэш сотруднику, если фото с тех пор не сменили.
+    replaced_hash — хэш прежнего фото: его копии удаляются, если больше никому не нужны."""
+    with app.app_context():
+        try:
+            folder = thumbs_folder(app)
+            digest = generate_variants(os.path.join(app.static_folder, photo), folder)
+            employee = db.session.get(Employee, employee_id)
+            if employee is None or employee.photo != photo:
+                return
+            employee.photo_hash = digest
+            db.session.commit()
+            if replaced_hash and replaced_hash != digest and \
+                    not Employee.query.filter_by(photo_hash=replaced_hash).count():
+                remove_variants(replaced_hash, folder)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"Не удалось подготовить фото сотрудника {employee_id}")
+        finally:
+            db.session.remove()
+
+
+def backfill(employees, app=None):
+    """Готовит копии фото для списка сотрудников в пуле потоков; хэши записывает вызывающий код.
+    Возвращает {employee_id: хэш}; фото, которые не удалось обработать, пропускаются."""
+    app = app or current_app._get_current_object()
+    folder = thumbs_folder(app)
+    sources = {employee.id: os.path.join(app.static_folder, employee.photo) for employee in employees}
+    done = {}
+    with ThreadPoolExecutor(max_workers=app.config.get('IMAGE_WORKERS', 2)) as pool:
+        futures = {employee_id: pool.submit(generate_variants, source, folder)
+                   for employee_id, source in sources.items()}
+        for employee_id, future in futures.items():
+            try:
+                done[employee_id] = future.result()
+            except Exception:
+                app.logger.exception(f"Не удалось подготовить фото сотрудника {employee_id}")
+    return done
+
+
+def submit_employee_photo(employee, replaced_hash=None):
+    """Ставит подготовку копий фото в пул потоков, чтобы не задерживать ответ на загрузку."""
+    app = current_app._get_current_object()
+    if app.config.get('JOBS_EAGER'):
+        process_employee_photo(app, employee.id, employee.photo, replaced_hash)
+    else:
+        _get_executor(app).submit(process_employee_photo, app, employee.id, employee.photo, replaced_hash)
+
+
+def photo_sources(employee, variant='sm'):
+    """Адреса фото для шаблона: {'webp': ..., 'jpeg': ...}; пока копий нет — только исходный файл в 'jpeg'."""
+    if not employee.photo:
+        return None
+    if not employee.photo_hash:
+        original = url_for('static', filename=employee.photo)
+        return {'webp': None, 'jpeg': original}
+    return {fmt: url_for('views.photo_thumb', filename=thumb_name(employee.photo_hash, variant, fmt))
+            for fmt in FORMATS}
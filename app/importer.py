@@ -0,0 +1,219 @@
+import csv
+import hashlib
+import time
+from sqlalchemy import insert, update
+from app.extensions import db
+from app.models import Employee, PerformanceMetric, EmployeeMetric, ImportCheckpoint
+from app import aggregates, dashboard
+
+# Сколько идентификаторов сотрудников передаём в один IN (...) при загрузке существующих оценок
+LOOKUP_CHUNK = 500
+# Размер пачки строк: каждая пачка записывается и коммитится отдельно
+IMPORT_CHUNK_SIZE = 1000
+# Сколько ошибок храним в отчёте (остальные только считаем)
+IMPORT_ERROR_LIMIT = 1000
+
+
+class ImportReport:
+    def __init__(self):
+        self.total = 0
+        self.inserted = 0
+        self.updated = 0
+        self.errors = []
+        self.error_count = 0
+        self.resumed_from = 0
+        self.elapsed = 0.0
+
+    @property
+    def imported(self):
+        return self.inserted + self.updated
+
+    @property
+    def rows_per_second(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, row_number, email, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_ERROR_LIMIT:
+            self.errors.append({'row': row_number, 'email': email, 'message': message})
+
+
+def read_rows(path, filename):
+    """Строки файла импорта: (номер строки, email, метрика, балл, комментарий); заголовок пропускается.
+    Файл читается потоково, целиком в память не загружается."""
+    if filename.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            for row_number, row in enumerate(csv.reader(csvfile), start=1):
+                if row_number == 1 or len(row) < 3:
+                    continue
+                yield row_number, row[0], row[1], row[2], row[3] if len(row) > 3 else ''
+    else:
+        from openpyxl import load_workbook
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+                row = tuple(row) + (None,) * (4 - len(row))
+                if not row[0]:
+                    continue
+                yield row_number, row[0], row[1], row[2], row[3] or ''
+        finally:
+            workbook.close()
+
+
+def count_rows(path, filename):
+    """Оценка числа строк данных (для индикатора прогресса), без загрузки файла в память."""
+    if filename.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as csvfile:
+            return max(sum(1 for _ in csvfile) - 1, 0)
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return max((workbook.active.max_row or 1) - 1, 0)
+    finally:
+        workbook.close()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _normalize_email(email):
+    return str(email or '').strip().lower()
+
+
+def _load_lookups():
+    # Email сравнивается без учёта регистра и пробелов, как при входе (auth.login)
+    employee_ids = {}
+    for email, employee_id in db.session.query(Employee.email, Employee.id).order_by(Employee.id):
+        employee_ids.setdefault(_normalize_email(email), employee_id)
+    metric_ids = {}
+    for metric_id, name in db.session.query(PerformanceMetric.id, PerformanceMetric.name).order_by(PerformanceMetric.id):
+        metric_ids.setdefault(name, metric_id)
+    return employee_ids, metric_ids
+
+
+def _existing_evaluations(cycle_id, employee_ids):
+    existing = {}
+    employee_ids = sorted(employee_ids)
+    for i in range(0, len(employee_ids), LOOKUP_CHUNK):
+        chunk = employee_ids[i:i + LOOKUP_CHUNK]
+        rows = db.session.query(
+            EmployeeMetric.id, EmployeeMetric.employee_id, EmployeeMetric.metric_id, EmployeeMetric.score
+        ).filter(EmployeeMetric.cycle_id == cycle_id, EmployeeMetric.employee_id.in_(chunk)) \
+         .order_by(EmployeeMetric.id)
+        for row in rows:
+            # Как и раньше, обновляется первая найденная оценка по (сотрудник, метрика, цикл)
+            existing.setdefault((row.employee_id, row.metric_id), (row.id, row.score))
+    return existing
+
+
+def _write_chunk(rows, lookups, cycle_id, evaluator_id, report):
+    employee_ids, metric_ids = lookups
+    resolved = {}
+    for row_number, emp_email, metric_name, score, comment in rows:
+        report.total += 1
+        employee_id = employee_ids.get(_normalize_email(emp_email))
+        if employee_id is None:
+            report.add_error(row_number, emp_email, f"Не найден сотрудник с email: {emp_email}")
+            continue
+        metric_id = metric_ids.get(metric_name)
+        if metric_id is None:
+            report.add_error(row_number, emp_email, f"Не найдена метрика: {metric_name}")
+            continue
+        try:
+            score = float(score)
+        except (TypeError, ValueError):
+            report.add_error(row_number, emp_email, f"Некорректный балл: {score}")
+            continue
+        # Повтор той же пары в файле перекрывает предыдущее значение
+        resolved[(employee_id, metric_id)] = (score, str(comment))
+
+    existing = _existing_evaluations(cycle_id, {employee_id for employee_id, _ in resolved})
+    inserts = []
+    updates = []
+    changes = []
+    for (employee_id, metric_id), (score, comment) in resolved.items():
+        key = (cycle_id, employee_id, metric_id)
+        if (employee_id, metric_id) in existing:
+            row_id, old_score = existing[(employee_id, metric_id)]
+            updates.append({'id': row_id, 'score': score, 'comment': comment})
+            changes.append((key, old_score, -1))
+        else:
+            inserts.append({
+                'employee_id': employee_id,
+                'metric_id': metric_id,
+                'cycle_id': cycle_id,
+                'score': score,
+                'comment': comment,
+                'evaluator_id': evaluator_id
+            })
+        changes.append((key, score, 1))
+
+    if inserts:
+        db.session.execute(insert(EmployeeMetric), inserts)
+    if updates:
+        db.session.execute(update(EmployeeMetric), updates)
+    # Пакетная запись идёт мимо событий сессии — агрегаты и сводки кабинета обновляем явно
+    if changes:
+        aggregates.apply_score_changes(db.session, changes)
+        dashboard.note_changes(db.session, {evaluator_id} | {key[1] for key, _, _ in changes})
+
+    report.inserted += len(inserts)
+    report.updated += len(updates)
+
+
+def import_evaluations(rows, cycle_id, evaluator_id, chunk_size=IMPORT_CHUNK_SIZE, checkpoint=None,
+                       on_chunk=None):
+    """Импортирует оценки пачками по chunk_size строк: справочники загружаются один раз,
+    каждая пачка пишется пакетными INSERT/UPDATE по ключу (employee_id, metric_id, cycle_id)
+    и коммитится вместе с точкой восстановления. Строки до checkpoint.last_row пропускаются.
+    on_chunk(report) вызывается после коммита каждой пачки."""
+    report = ImportReport()
+    started = time.perf_counter()
+    lookups = _load_lookups()
+    if checkpoint is not None:
+        report.resumed_from = checkpoint.last_row
+
+    def flush(chunk):
+        _write_chunk(chunk, lookups, cycle_id, evaluator_id, report)
+        if checkpoint is not None:
+            checkpoint.last_row = chunk[-1][0]
+            checkpoint.rows_done = (checkpoint.rows_done or 0) + len(chunk)
+        db.session.commit()
+        if on_chunk is not None:
+            on_chunk(report)
+
+    chunk = []
+    for row in rows:
+        if checkpoint is not None and row[0] <= report.resumed_from:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def start_checkpoint(path, cycle_id):
+    """Точка восстановления для файла: если прошлый импорт того же файла прервался — продолжаем с неё."""
+    digest = file_hash(path)
+    checkpoint = ImportCheckpoint.query.filter_by(file_hash=digest, cycle_id=cycle_id).first()
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(file_hash=digest, cycle_id=cycle_id, last_row=0, rows_done=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    return checkpoint
+
+
+def finish_checkpoint(checkpoint):
+    db.session.delete(checkpoint)
+    db.session.commit()
@@ -0,0 +1,204 @@
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import update
+from app.extensions import db
+from app.models import Job, EvaluationCycle
+
+# Обработчики задач по виду: kind -> функция(job, params)
+HANDLERS = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def job_handler(kind):
+    def decorator(f):
+        HANDLERS[kind] = f
+        return f
+    return decorator
+
+
+def _get_executor(app):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('JOB_WORKERS', 2),
+                                           thread_name_prefix='jobs')
+    return _executor
+
+
+def jobs_folder(app=None):
+    app = app or current_app
+    folder = app.config.get('JOBS_FOLDER') or os.path.join(app.root_path, 'jobs_data')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def save_upload(file):
+    """Сохраняет загруженный файл в каталог задач; файл удаляется обработчиком после выполнения."""
+    ext = os.path.splitext(file.filename)[1].lower()
+    path = os.path.join(jobs_folder(), f"upload_{uuid.uuid4().hex}{ext}")
+    file.save(path)
+    return path
+
+
+def submit_job(kind, owner_id, params):
+    job = Job(kind=kind, owner_id=owner_id, params=json.dumps(params), status='queued', progress=0)
+    db.session.add(job)
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    if app.config.get('JOBS_EAGER'):
+        run_job(app, job.id)
+        db.session.refresh(job)
+    else:
+        _get_executor(app).submit(run_job, app, job.id)
+    return job
+
+
+def _worker_id():
+    # pid берётся при каждом вызове: после fork у рабочих процессов сервера он свой
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _worker_alive(worker):
+    """Жив ли процесс, забравший задачу. Процессы других хостов проверить нельзя — считаются живыми."""
+    if not worker:
+        return False
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+def _claim(job_id):
+    # Условный UPDATE: задачу забирает ровно один исполнитель, даже при нескольких процессах
+    result = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.status == 'queued')
+        .values(status='running', started_at=datetime.utcnow(), worker=_worker_id())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def run_job(app, job_id):
+    with app.app_context():
+        if not _claim(job_id):
+            return
+        job = db.session.get(Job, job_id)
+        try:
+            HANDLERS[job.kind](job, json.loads(job.params or '{}'))
+            job.status = 'done'
+            job.progress = 100
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("Ошибка фоновой задачи %s", job_id)
+            job = db.session.get(Job, job_id)
+            job.status = 'failed'
+            job.message = str(e)
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def set_progress(job, progress, message=None):
+    job.progress = max(0, min(int(progress), 100))
+    if message is not None:
+        job.message = message
+    db.session.commit()
+
+
+def recover_jobs(app):
+    """При старте сервера: задачи, чей процесс завершился, помечаются ошибкой, ожидающие — отправляются
+    исполнителю. Задачи живых процессов (другие рабочие процессы сервера, команды flask) не трогаются.
+    Вызывается только из точки входа сервера (main.py), не из create_app — команды flask, тесты
+    и замеры производительности чужие задачи не восстанавливают."""
+    running = Job.query.filter_by(status='running').all()
+    for job in running:
+        if _worker_alive(job.worker):
+            continue
+        job.status = 'failed'
+        job.message = "Задача прервана перезапуском сервера."
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
+    for job_id, in db.session.query(Job.id).filter_by(status='queued').order_by(Job.id):
+        _get_executor(app).submit(run_job, app, job_id)
+
+
+def job_payload(job):
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'has_result': bool(job.result_path)
+    }
+
+
+# --- Обработчики ---
+
+@job_handler('import')
+def run_import(job, params):
+    from app import importer
+
+    path = params['path']
+    filename = params['filename']
+    try:
+        total = importer.count_rows(path, filename) or 1
+        checkpoint = importer.start_checkpoint(path, params['cycle_id'])
+
+        def on_chunk(report):
+            set_progress(job, report.total * 100 / total,
+                         f"Обработано строк: {report.total}, импортировано: {report.imported}")
+
+        report = importer.import_evaluations(importer.read_rows(path, filename), params['cycle_id'],
+                                             params['evaluator_id'], checkpoint=checkpoint,
+                                             on_chunk=on_chunk)
+        importer.finish_checkpoint(checkpoint)
+        job.message = (f"Импортировано {report.imported} оценок, строк с ошибками: {report.error_count} "
+                       f"({report.rows_per_second:.0f} строк/с).")
+        if report.errors:
+            # Отчёт об ошибках сохраняется как результат задачи
+            result_path = os.path.join(jobs_folder(), f"job_{job.id}_errors.json")
+            with open(result_path, 'w', encoding='utf-8') as f:
+                json.dump(report.errors, f, ensure_ascii=False, indent=1)
+            job.result_path = result_path
+            job.result_name = f"import_errors_{job.id}.json"
+            job.result_mimetype = 'application/json'
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@job_handler('export_pdf')
+def run_export_pdf(job, params):
+    from app import reports
+
+    cycle = db.session.get(EvaluationCycle, params['cycle_id'])
+    if cycle is None:
+        raise ValueError("Цикл оценки не найден.")
+    set_progress(job, 10, "Формирование отчёта")
+    pdf_output, download_name = reports.build_performance_report(
+        params.get('report_type'), params.get('department_id'), cycle
+    )
+    result_path = os.path.join(jobs_folder(), f"job_{job.id}.pdf")
+    with open(result_path, 'wb') as f:
+        f.write(pdf_output)
+    job.result_path = result_path
+    job.result_name = download_name
+    job.result_mimetype = 'application/pdf'
+    job.message = "Отчёт готов."
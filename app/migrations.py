@@ -0,0 +1,168 @@
+from datetime import datetime
+from sqlalchemy import text
+from app.extensions import db
+
+# Версии схемы, применённые к базе. create_all создаёт только недостающие таблицы и не меняет
+# существующие, поэтому индексы и ограничения для старых таблиц добавляются миграциями ниже.
+# Миграции идемпотентны: на новой базе (таблицы уже созданы с индексами) они только отмечаются.
+# Миграции, меняющие данные (manual=True), выполняются только командой flask db-upgrade:
+# при старте приложения они пропускаются и попадают в предупреждение в журнале.
+MIGRATIONS = []
+
+
+def migration(version, description, manual=False):
+    def decorator(f):
+        MIGRATIONS.append((version, description, manual, f))
+        return f
+    return decorator
+
+
+def _ensure_version_table():
+    db.session.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version VARCHAR(64) PRIMARY KEY, description VARCHAR(255), applied_at DATETIME)"
+    ))
+
+
+def applied_versions():
+    _ensure_version_table()
+    return {row[0] for row in db.session.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [(version, description) for version, description, _, _ in MIGRATIONS if version not in applied]
+
+
+def run_migrations(log=None, include_manual=True):
+    """Применяет непримененные миграции по порядку; каждая — в своей транзакции. Возвращает список версий.
+    include_manual=False пропускает миграции, меняющие данные (см. manual)."""
+    applied = applied_versions()
+    db.session.commit()
+    done = []
+    for version, description, manual, upgrade in MIGRATIONS:
+        if version in applied or (manual and not include_manual):
+            continue
+        if log:
+            log(f"{version}: {description}")
+        try:
+            upgrade()
+            db.session.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {'v': version, 'd': description, 't': datetime.utcnow()}
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        done.append(version)
+    return done
+
+
+def add_column(table_name, column_name):
+    """Добавляет столбец, описанный в модели, если его ещё нет."""
+    connection = db.session.connection()
+    existing = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table_name})"))}
+    if column_name in existing:
+        return
+    column = db.metadata.tables[table_name].c[column_name]
+    ddl = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+    if column.server_default is not None:
+        default = column.server_default.arg
+        default = default.compile(dialect=connection.dialect) if hasattr(default, 'compile') else f"'{default}'"
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    connection.execute(text(ddl))
+
+
+def create_index(table_name, index_name):
+    """Создаёт индекс, описанный в модели, если его ещё нет."""
+    table = db.metadata.tables[table_name]
+    index = next(index for index in table.indexes if index.name == index_name)
+    # Проверка по имени: checkfirst не видит индексы по выражениям (lower(email))
+    connection = db.session.connection()
+    exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                                {'name': index_name}).first()
+    if not exists:
+        index.create(connection)
+
+
+# --- Миграции ---
+
+@migration('0001_list_sort_indexes', 'Индексы ключей сортировки постраничных списков')
+def _list_sort_indexes():
+    create_index('employees', 'ix_employees_full_name_id')
+    create_index('news', 'ix_news_published_at_id')
+    create_index('faqs', 'ix_faqs_category_id')
+    create_index('contact_messages', 'ix_contact_messages_created_at_id')
+
+
+@migration('0002_employee_metrics_indexes', 'Составные индексы оценок')
+def _employee_metrics_indexes():
+    create_index('employee_metrics', 'ix_employee_metrics_cycle_employee_score')
+    create_index('employee_metrics', 'ix_employee_metrics_evaluator_cycle')
+
+
+@migration('0003_cycle_auto_activate', 'Запуск циклов оценки по дате начала')
+def _cycle_auto_activate():
+    add_column('evaluation_cycles', 'auto_activate')
+
+
+@migration('0004_employee_photo_hash', 'Уменьшенные копии фото сотрудников')
+def _employee_photo_hash():
+    add_column('employees', 'photo_hash')
+
+
+@migration('0005_search_index', 'Полнотекстовый поиск: индекс FTS5 и триггеры синхронизации')
+def _search_index():
+    from app import search
+    search.reindex()
+
+
+@migration('0006_feedback_recipient_index', 'Индекс обратной связи получателя для личного кабинета')
+def _feedback_recipient_index():
+    create_index('feedbacks', 'ix_feedbacks_employee_archived_created_id')
+
+
+@migration('0007_ranking_index', 'Места, процентили и итоговые баллы сотрудников по циклам')
+def _ranking_index():
+    for column in ('composite_score', 'rank', 'percentile', 'dept_rank', 'dept_percentile'):
+        add_column('employee_cycle_stats', column)
+    # Новые столбцы отметок по умолчанию true: места и итоговые баллы посчитаются при первом чтении
+    add_column('cycle_stats', 'ranks_stale')
+    add_column('cycle_stats', 'composites_stale')
+    create_index('employee_cycle_stats', 'ix_employee_cycle_stats_cycle_rank')
+    create_index('employee_cycle_stats', 'ix_employee_cycle_stats_cycle_dept_rank')
+
+
+@migration('0008_login_email_index', 'Индекс email без учёта регистра для входа')
+def _login_email_index():
+    create_index('employees', 'ix_employees_email_lower')
+
+
+@migration('0009_job_worker', 'Процесс, выполняющий фоновую задачу')
+def _job_worker():
+    add_column('jobs', 'worker')
+
+
+# Удаляет повторные оценки — только через flask db-upgrade. Пока ключа нет, оценки сохраняются
+# без ON CONFLICT (см. evaluations.save_evaluations)
+@migration('0010_employee_metrics_unique_key', 'Уникальный ключ оценок (удаляет повторные оценки)', manual=True)
+def _employee_metrics_unique_key():
+    from app import aggregates
+
+    # Повторные оценки одним оценщиком одной метрики в цикле: остаётся последняя
+    duplicates = db.session.execute(text(
+        "SELECT id, cycle_id FROM employee_metrics WHERE id NOT IN ("
+        " SELECT MAX(id) FROM employee_metrics"
+        " GROUP BY employee_id, cycle_id, metric_id, evaluator_id)"
+    )).all()
+    if duplicates:
+        db.session.execute(text("DELETE FROM employee_metrics WHERE id IN :ids")
+                           .bindparams(db.bindparam('ids', expanding=True)),
+                           {'ids': [row.id for row in duplicates]})
+        for cycle_id in {row.cycle_id for row in duplicates}:
+            aggregates.rebuild_cycle_stats(cycle_id)
+
+    create_index('employee_metrics', 'uq_employee_metrics_employee_cycle_metric_evaluator')
@@ -39,6 +39,8 @@ class Employee(db.Model, UserMixin):
     hire_date = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     photo = db.Column(db.String(255), nullable=True)
+    # Хэш исходного фото: имена уменьшенных копий (app/images.py); пусто, пока копии не готовы
+    photo_hash = db.Column(db.String(40), nullable=True)
 
     # Связи
     role = db.relationship('Role')
@@ -52,6 +54,13 @@ class Employee(db.Model, UserMixin):
     faqs_created = db.relationship('FAQ', backref='author')
     news_created = db.relationship('News', backref='author')
 
+    # Ключ постраничного вывода списков сотрудников
+    __table_args__ = (
+        db.Index('ix_employees_full_name_id', 'full_name', 'id'),
+        # Вход ищет сотрудника по email без учёта регистра (app/auth.py)
+        db.Index('ix_employees_email_lower', db.func.lower(email)),
+    )
+
 # Цикл оценки
 class EvaluationCycle(db.Model):
     __tablename__ = 'evaluation_cycles'
@@ -60,10 +69,18 @@ class EvaluationCycle(db.Model):
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
+    # Запустить цикл автоматически в дату начала (app/cycles.py); снимается при запуске
+    auto_activate = db.Column(db.Boolean, default=False, server_default=db.false(), nullable=False)
     description = db.Column(db.Text)
     evaluations = db.relationship('EmployeeMetric', backref='cycle', cascade="all, delete", lazy='dynamic')
     feedbacks = db.relationship('Feedback', backref='cycle', cascade="all, delete", lazy='dynamic')
 
+    @property
+    def is_open(self):
+        # Без планировщика (CYCLE_SCHEDULER_INTERVAL = 0) is_active не снимается в дату окончания —
+        # закончившийся цикл считается завершённым, как в cycles.active_state
+        return bool(self.is_active) and self.end_date >= datetime.utcnow()
+
 # Категория метрики
 class MetricCategory(db.Model):
     __tablename__ = 'metric_categories'
@@ -104,6 +121,113 @@ class EmployeeMetric(db.Model):
     metric = db.relationship('PerformanceMetric')
     evaluator = db.relationship('Employee', foreign_keys=[evaluator_id])
 
+    # Для существующих баз индексы создаются миграцией (app/migrations.py)
+    __table_args__ = (
+        # Ключ оценки: одна оценка метрики от оценщика за цикл; префикс (employee_id, cycle_id) —
+        # оценки сотрудника за цикл
+        db.Index('uq_employee_metrics_employee_cycle_metric_evaluator',
+                 'employee_id', 'cycle_id', 'metric_id', 'evaluator_id', unique=True),
+        # Оценки цикла: статистика, отчёты, выгрузки (средние по сотрудникам — только по индексу)
+        db.Index('ix_employee_metrics_cycle_employee_score', 'cycle_id', 'employee_id', 'score'),
+        # Оценки, выставленные пользователем (кабинет)
+        db.Index('ix_employee_metrics_evaluator_cycle', 'evaluator_id', 'cycle_id'),
+    )
+
+# Материализованные агрегаты оценок по циклу (обновляются инкрементально, см. app/aggregates.py)
+class CycleStats(db.Model):
+    __tablename__ = 'cycle_stats'
+    cycle_id = db.Column(db.Integer, db.ForeignKey('evaluation_cycles.id'), primary_key=True)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    evaluated_count = db.Column(db.Integer, nullable=False, default=0)
+    histogram = db.Column(db.Text, nullable=False, default='[]')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Места в employee_cycle_stats устарели (изменились оценки) — пересчёт при чтении (app/rankings.py)
+    ranks_stale = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    # Итоговые баллы устарели целиком (изменились веса или максимумы метрик)
+    composites_stale = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+
+class DepartmentCycleStats(db.Model):
+    __tablename__ = 'department_cycle_stats'
+    cycle_id = db.Column(db.Integer, db.ForeignKey('evaluation_cycles.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), primary_key=True)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    evaluated_count = db.Column(db.Integer, nullable=False, default=0)
+
+class CategoryCycleStats(db.Model):
+    __tablename__ = 'category_cycle_stats'
+    cycle_id = db.Column(db.Integer, db.ForeignKey('evaluation_cycles.id'), primary_key=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('metric_categories.id'), primary_key=True)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+
+class EmployeeCycleStats(db.Model):
+    __tablename__ = 'employee_cycle_stats'
+    cycle_id = db.Column(db.Integer, db.ForeignKey('evaluation_cycles.id'), primary_key=True)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), primary_key=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    avg_score = db.Column(db.Float)
+    # Взвешенный нормированный балл 0..100 (app/analytics.py)
+    composite_score = db.Column(db.Float)
+    # Место и процентиль по среднему баллу: в цикле и в подразделении (app/rankings.py)
+    rank = db.Column(db.Integer)
+    percentile = db.Column(db.Float)
+    dept_rank = db.Column(db.Integer)
+    dept_percentile = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_employee_cycle_stats_cycle_avg', 'cycle_id', 'avg_score'),
+        # Рейтинг цикла и подразделения — чтение диапазона по месту
+        db.Index('ix_employee_cycle_stats_cycle_rank', 'cycle_id', 'rank', 'employee_id'),
+        db.Index('ix_employee_cycle_stats_cycle_dept_rank', 'cycle_id', 'department_id', 'dept_rank'),
+    )
+
+# Точка восстановления импорта: последняя закоммиченная строка файла
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+    id = db.Column(db.Integer, primary_key=True)
+    file_hash = db.Column(db.String(64), nullable=False)
+    cycle_id = db.Column(db.Integer, db.ForeignKey('evaluation_cycles.id'), nullable=False)
+    last_row = db.Column(db.Integer, nullable=False, default=0)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('file_hash', 'cycle_id', name='uq_import_checkpoint_file_cycle'),
+    )
+
+# Ограничение частоты входа (app/ratelimit.py): корзина токенов в виде одного момента времени
+class RateLimit(db.Model):
+    __tablename__ = 'rate_limits'
+    key = db.Column(db.String(200), primary_key=True)
+    # Теоретическое время следующей попытки (GCRA), секунды от эпохи
+    tat = db.Column(db.Float, nullable=False)
+
+# Фоновая задача (импорт, экспорт отчёта), см. app/jobs.py
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    message = db.Column(db.Text)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    result_path = db.Column(db.String(500))
+    result_name = db.Column(db.String(255))
+    result_mimetype = db.Column(db.String(100))
+    owner_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False, index=True)
+    # Процесс, выполняющий задачу: «хост:pid»
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    owner = db.relationship('Employee')
+
 # Тип обратной связи
 class FeedbackType(db.Model):
     __tablename__ = 'feedback_types'
@@ -124,6 +248,11 @@ class Feedback(db.Model):
     is_archived = db.Column(db.Boolean, default=False) 
     feedback_type = db.relationship('FeedbackType')
 
+    __table_args__ = (
+        # Обратная связь получателя: непрочитанная и архив по дате (личный кабинет), счётчики сводки
+        db.Index('ix_feedbacks_employee_archived_created_id', 'employee_id', 'is_archived', 'created_at', 'id'),
+    )
+
 # Сообщение из формы обратной связи (публичное)
 class ContactMessage(db.Model):
     __tablename__ = 'contact_messages'
@@ -134,6 +263,10 @@ class ContactMessage(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     read = db.Column(db.Boolean, default=False)
 
+    __table_args__ = (
+        db.Index('ix_contact_messages_created_at_id', 'created_at', 'id'),
+    )
+
 class FAQ(db.Model):
     __tablename__ = 'faqs'
     id = db.Column(db.Integer, primary_key=True)
@@ -145,6 +278,10 @@ class FAQ(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     author_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
 
+    __table_args__ = (
+        db.Index('ix_faqs_category_id', 'category', 'id'),
+    )
+
 class News(db.Model):
     __tablename__ = 'news'
     id = db.Column(db.Integer, primary_key=True)
@@ -157,6 +294,10 @@ class News(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('employees.id'))
     image_url = db.Column(db.String(500))
 
+    __table_args__ = (
+        db.Index('ix_news_published_at_id', 'published_at', 'id'),
+    )
+
 
 class MetricExclusion(db.Model):
     __tablename__ = 'metric_exclusions'
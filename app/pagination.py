@@ -0,0 +1,188 @@
+import base64
+import json
+from collections import defaultdict
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import and_, or_, event
+from sqlalchemy.orm import Session
+from app import caching
+
+# Размер страницы по умолчанию и предел для ?per_page=
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# Сколько секунд живёт закэшированное общее число строк (между процессами — только по времени)
+COUNT_TTL = 300
+# Сколько подсчётов хранится: ключ включает параметры запроса (?department=, пользователь),
+# поэтому самые давние вытесняются
+COUNT_CACHE_SIZE = 1024
+
+_counts = caching.MemoryBackend(COUNT_CACHE_SIZE)
+# Поколение таблицы: растёт при любой записи в неё через сессию, старые подсчёты перестают совпадать по ключу
+_generations = defaultdict(int)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_generations(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table:
+            _generations[table] += 1
+
+
+class KeysetPage:
+    def __init__(self, items, per_page, start, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        # Номер первой строки страницы с нуля (для сквозной нумерации)
+        self.start = start
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def _url(self, cursor):
+        args = request.args.to_dict()
+        args['cursor'] = cursor
+        return url_for(request.endpoint, **request.view_args, **args)
+
+    @property
+    def next_url(self):
+        return self._url(self.next_cursor) if self.next_cursor else None
+
+    @property
+    def prev_url(self):
+        return self._url(self.prev_cursor) if self.prev_cursor else None
+
+    @property
+    def first_url(self):
+        args = request.args.to_dict()
+        args.pop('cursor', None)
+        return url_for(request.endpoint, **request.view_args, **args)
+
+
+def encode_cursor(values, position, direction):
+    payload = {
+        'k': [value.isoformat() if isinstance(value, datetime) else value for value in values],
+        'n': position,
+        'd': direction
+    }
+    raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _decode_value(value, python_type):
+    # Значение ключа из курсора приводится к типу столбца: в сравнение WHERE не попадают
+    # строки и объекты из подделанного курсора. None — значение не подходит
+    if python_type is datetime:
+        return datetime.fromisoformat(value) if isinstance(value, str) else None
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    return python_type(value)
+
+
+def decode_cursor(cursor, order):
+    """(значения ключа, позиция, направление) или None, если курсор испорчен."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        values = payload['k']
+        if len(values) != len(order) or payload['d'] not in ('next', 'prev'):
+            return None
+        decoded = []
+        for value, (column, _) in zip(values, order):
+            value = _decode_value(value, column.type.python_type)
+            if value is None:
+                return None
+            decoded.append(value)
+        return decoded, int(payload['n']), payload['d']
+    except (ValueError, KeyError, TypeError, NotImplementedError):
+        return None
+
+
+def _seek(order, values, forward):
+    # (a, b) после (va, vb): a за va, либо a = va и b за vb
+    clauses = []
+    for i, (column, desc) in enumerate(order):
+        less = desc if forward else not desc
+        step = column < values[i] if less else column > values[i]
+        clauses.append(and_(*[order[j][0] == values[j] for j in range(i)], step))
+    return or_(*clauses)
+
+
+def _order_by(order, forward):
+    return [column.desc() if desc == forward else column.asc() for column, desc in order]
+
+
+def page_size():
+    per_page = request.args.get('per_page', PAGE_SIZE, type=int)
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+def is_forward(state):
+    return state is None or state[2] == 'next'
+
+
+def keyset_query(query, order, cursor=None, per_page=PAGE_SIZE):
+    """Запрос страницы без выполнения — чтобы встроить его в общий запрос (см. app/dashboard.py).
+    Возвращает (запрос, состояние курсора); строки запроса передаются в keyset_page."""
+    state = decode_cursor(cursor, order) if cursor else None
+    forward = is_forward(state)
+    if state is not None:
+        query = query.filter(_seek(order, state[0], forward))
+    return query.order_by(*_order_by(order, forward)).limit(per_page + 1), state
+
+
+def keyset_page(rows, order, state, per_page=PAGE_SIZE, total=None):
+    """KeysetPage из строк keyset_query (в порядке его ORDER BY)."""
+    def key(item):
+        return [getattr(item, column.key) for column, _ in order]
+
+    if state is None:
+        items = rows[:per_page]
+        has_more = len(rows) > per_page
+        return KeysetPage(items, per_page, 0,
+                          encode_cursor(key(items[-1]), len(items), 'next') if has_more else None,
+                          None, total)
+
+    _, position, direction = state
+    if direction == 'next':
+        items = rows[:per_page]
+        start = position
+        next_cursor = encode_cursor(key(items[-1]), start + len(items), 'next') if len(rows) > per_page else None
+        prev_cursor = encode_cursor(key(items[0]), start, 'prev') if items and start > 0 else None
+    else:
+        has_more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        start = max(position - len(items), 0) if has_more else 0
+        prev_cursor = encode_cursor(key(items[0]), start, 'prev') if has_more else None
+        next_cursor = encode_cursor(key(items[-1]), start + len(items), 'next') if items else None
+    return KeysetPage(items, per_page, start, next_cursor, prev_cursor, total)
+
+
+def paginate(query, order, cursor=None, per_page=PAGE_SIZE, total=None):
+    """Постраничная выборка по ключу (keyset): следующая страница — строки после последнего ключа,
+    поэтому дальние страницы стоят столько же, сколько первая.
+    order — [(столбец, по_убыванию)], последний столбец уникален; значения ключа не должны быть NULL."""
+    query, state = keyset_query(query, order, cursor, per_page)
+    return keyset_page(query.all(), order, state, per_page, total)
+
+
+def cached_count(query):
+    """Общее число строк запроса; пересчитывается после записи в таблицу или по истечении COUNT_TTL."""
+    table = query.column_descriptions[0]['entity'].__tablename__
+    compiled = query.statement.compile()
+    key = (str(compiled), tuple(sorted(compiled.params.items())))
+    # Записи прошлых поколений больше не совпадают по ключу и вытесняются как самые давние
+    cache_key = (table, key, _generations[table])
+    value = _counts.get(cache_key)
+    if value is None:
+        value = query.order_by(None).count()
+        _counts.set(cache_key, value, COUNT_TTL)
+    return value
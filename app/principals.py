@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask_login import current_user
+from sqlalchemy.orm import joinedload
+from app.extensions import db
+from app.models import Employee
+
+# Права ролей: 'manage' — разделы руководителя (сотрудники, метрики, импорт/экспорт), 'admin' — всё остальное
+ROLE_PERMISSIONS = {
+    'admin': frozenset({'manage', 'admin'}),
+    'manager': frozenset({'manage'}),
+    'employee': frozenset(),
+}
+
+# Неизменяемое описание пользователя для проверок доступа
+Principal = namedtuple('Principal', 'id role_name department_id position_id permissions')
+
+_Entry = namedtuple('_Entry', 'principal employee expires')
+
+
+class PrincipalCache:
+    """LRU-кэш пользователей процесса с ограниченным временем жизни записей.
+    Хранит принципала и отсоединённую копию сотрудника с ролью, подразделением и должностью."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry.expires < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id, principal, employee):
+        with self._lock:
+            self._entries[user_id] = _Entry(principal, employee, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+def init_app(app):
+    principal_cache.maxsize = app.config.get('PRINCIPAL_CACHE_SIZE', 1024)
+    principal_cache.ttl = app.config.get('PRINCIPAL_CACHE_TTL', 60)
+
+
+def make_principal(employee):
+    role_name = employee.role.name if employee.role else None
+    return Principal(employee.id, role_name, employee.department_id, employee.position_id,
+                     ROLE_PERMISSIONS.get(role_name, frozenset()))
+
+
+def load_user(user_id):
+    """Сотрудник для Flask-Login: из кэша — без запросов к базе, иначе одним запросом
+    вместе с ролью, подразделением и должностью."""
+    user_id = int(user_id)
+    if not principal_cache.ttl:
+        return _query_employee(user_id)
+
+    entry = principal_cache.get(user_id)
+    if entry is not None:
+        employee = entry.employee
+    else:
+        employee = _query_employee(user_id)
+        if employee is None:
+            return None
+        # В кэше лежит отсоединённая копия вместе со связанными объектами,
+        # в сессию запроса попадает её слияние без обращения к базе
+        for obj in (employee, employee.role, employee.department, employee.position):
+            if obj is not None:
+                db.session.expunge(obj)
+        principal_cache.put(user_id, make_principal(employee), employee)
+    return db.session.merge(employee, load=False)
+
+
+def _query_employee(user_id):
+    return db.session.execute(
+        db.select(Employee).options(
+            joinedload(Employee.role),
+            joinedload(Employee.department),
+            joinedload(Employee.position)
+        ).filter_by(id=user_id)
+    ).scalar_one_or_none()
+
+
+def current_principal():
+    if not current_user.is_authenticated:
+        return None
+    entry = principal_cache.get(current_user.id)
+    if entry is not None:
+        return entry.principal
+    return make_principal(current_user)
+
+
+def has_permission(permission):
+    principal = current_principal()
+    return principal is not None and permission in principal.permissions
+
+
+def invalidate(user_id):
+    principal_cache.invalidate(user_id)
@@ -0,0 +1,144 @@
+from sqlalchemy import bindparam, event, inspect, text, update
+from sqlalchemy.orm import Session
+from app.extensions import db
+from app.models import CycleStats, MetricCategory, PerformanceMetric
+
+# Рейтинг цикла хранится в employee_cycle_stats: средний и итоговый балл, место и процентиль в цикле
+# и в подразделении. Итоговый балл сотрудника пересчитывается вместе с агрегатами при записи его оценок
+# (одним UPDATE по его строкам — без выгрузки оценок в Python);
+# места зависят от всех сотрудников цикла, поэтому запись только помечает цикл, а места
+# пересчитываются одним UPDATE с оконными функциями при первом чтении рейтинга.
+
+# Поля метрик и категорий, от которых зависит итоговый балл
+_COMPOSITE_FIELDS = {
+    PerformanceMetric: ('weight', 'max_score', 'category_id'),
+    MetricCategory: ('weight',),
+}
+
+# Место — RANK() по убыванию среднего балла (равные баллы — одно место);
+# процентиль — доля сотрудников со средним не выше (CUME_DIST), как в app/analytics.py
+_RANKS_SQL = text("""
+    UPDATE employee_cycle_stats
+    SET rank = ranked.rank, percentile = ranked.percentile,
+        dept_rank = ranked.dept_rank, dept_percentile = ranked.dept_percentile
+    FROM (
+        SELECT employee_id,
+               RANK() OVER (ORDER BY avg_score DESC) AS rank,
+               CUME_DIST() OVER (ORDER BY avg_score) * 100.0 AS percentile,
+               RANK() OVER (PARTITION BY department_id ORDER BY avg_score DESC) AS dept_rank,
+               CUME_DIST() OVER (PARTITION BY department_id ORDER BY avg_score) * 100.0 AS dept_percentile
+        FROM employee_cycle_stats
+        WHERE cycle_id = :cycle_id AND score_count > 0
+    ) AS ranked
+    WHERE employee_cycle_stats.cycle_id = :cycle_id AND employee_cycle_stats.employee_id = ranked.employee_id
+""")
+_CLEAR_RANKS_SQL = text("""
+    UPDATE employee_cycle_stats SET rank = NULL, percentile = NULL, dept_rank = NULL, dept_percentile = NULL
+    WHERE cycle_id = :cycle_id AND score_count = 0 AND rank IS NOT NULL
+""")
+
+
+def _composites_sql(filtered):
+    # Та же формула, что в analytics.composite_scores: балл / максимум метрики (0..1), средневзвешенное
+    # по метрикам внутри категории, затем по категориям с их весами; при нулевых весах — простое среднее
+    employee_filter = "AND em.employee_id IN :employee_ids" if filtered else ""
+    target_filter = "AND employee_id IN :employee_ids" if filtered else ""
+    return text(f"""
+        WITH scored AS (
+            SELECT em.employee_id, pm.category_id,
+                   MIN(MAX(em.score / CASE WHEN COALESCE(pm.max_score, 10.0) > 0
+                                           THEN COALESCE(pm.max_score, 10.0) ELSE 10.0 END, 0.0), 1.0) AS norm,
+                   MAX(COALESCE(pm.weight, 1.0), 0.0) AS weight,
+                   MAX(COALESCE(mc.weight, 0.25), 0.0) AS category_weight
+            FROM employee_metrics em
+            JOIN performance_metrics pm ON pm.id = em.metric_id
+            LEFT JOIN metric_categories mc ON mc.id = pm.category_id
+            WHERE em.cycle_id = :cycle_id {employee_filter}
+        ), categories AS (
+            SELECT employee_id,
+                   CASE WHEN SUM(weight) > 0 THEN SUM(norm * weight) / SUM(weight) ELSE AVG(norm) END AS score,
+                   MAX(category_weight) AS category_weight
+            FROM scored GROUP BY employee_id, category_id
+        ), composites AS MATERIALIZED (
+            SELECT employee_id,
+                   CASE WHEN SUM(category_weight) > 0 THEN SUM(score * category_weight) / SUM(category_weight)
+                        ELSE AVG(score) END * 100.0 AS composite
+            FROM categories GROUP BY employee_id
+        )
+        UPDATE employee_cycle_stats
+        SET composite_score = (SELECT composite FROM composites
+                               WHERE composites.employee_id = employee_cycle_stats.employee_id)
+        WHERE cycle_id = :cycle_id {target_filter}
+    """)
+
+
+def update_composites(session, cycle_id, employee_ids=None):
+    """Пересчитывает итоговые баллы сотрудников цикла одним UPDATE (всех, если employee_ids не задан).
+    Сотрудникам без оценок балл сбрасывается в NULL."""
+    if employee_ids is None:
+        session.execute(_composites_sql(False), {'cycle_id': cycle_id})
+    else:
+        statement = _composites_sql(True).bindparams(bindparam('employee_ids', expanding=True))
+        session.execute(statement, {'cycle_id': cycle_id, 'employee_ids': list(employee_ids)})
+
+
+def update_ranks(session, cycle_id):
+    session.execute(_RANKS_SQL, {'cycle_id': cycle_id})
+    session.execute(_CLEAR_RANKS_SQL, {'cycle_id': cycle_id})
+
+
+def refresh_ranking(cycle_id):
+    """Пересчитывает устаревшие итоговые баллы и места цикла в отдельной транзакции —
+    сессия запроса с её несохранёнными изменениями не коммитится."""
+    table = CycleStats.__table__
+    with db.engine.begin() as connection:
+        # Отметки снимаются условными UPDATE первыми: запись сразу берёт блокировку, и параллельный
+        # пересчёт того же цикла дождётся её и ничего не найдёт, а не повторит работу
+        def claim(column):
+            return connection.execute(
+                update(table).where(table.c.cycle_id == cycle_id, column == True)
+                .values({column.name: False}).returning(table.c.cycle_id)
+            ).first() is not None
+        composites = claim(table.c.composites_stale)
+        ranks = claim(table.c.ranks_stale)
+        if composites:
+            update_composites(connection, cycle_id)
+        if composites or ranks:
+            update_ranks(connection, cycle_id)
+
+
+def ensure_ranking(cycle_id):
+    """Досчитывает устаревшие итоговые баллы и места цикла. Возвращает строку CycleStats.
+    Вызывается до записей в сессии запроса: сброшенные в базу изменения держат блокировку записи."""
+    # Отметки ставятся UPDATE мимо сессии — перечитываем строку, а не берём из карты объектов.
+    # Без autoflush: записанные, но не закоммиченные изменения сессии держали бы блокировку
+    # записи, и пересчёт в отдельной транзакции ждал бы её
+    with db.session.no_autoflush:
+        stats = db.session.get(CycleStats, cycle_id, populate_existing=True)
+        if stats is None:
+            from app import aggregates
+            stats = aggregates.get_cycle_stats(cycle_id)
+        if stats.ranks_stale or stats.composites_stale:
+            refresh_ranking(cycle_id)
+            stats = db.session.get(CycleStats, cycle_id, populate_existing=True)
+    return stats
+
+
+def cycle_mean(stats):
+    """Средний балл по всем оценкам цикла — из агрегатов, без запроса к оценкам."""
+    return stats.score_sum / stats.score_count if stats.score_count else 0.0
+
+
+# Правка весов или максимумов метрик меняет итоговые баллы во всех циклах — помечаем циклы,
+# баллы пересчитаются при следующем чтении рейтинга
+@event.listens_for(Session, 'after_flush')
+def _mark_composites_stale(session, flush_context):
+    for obj in session.dirty:
+        fields = _COMPOSITE_FIELDS.get(type(obj))
+        if fields is None:
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[name].history.has_changes() for name in fields):
+            continue
+        session.execute(update(CycleStats.__table__).values(ranks_stale=True, composites_stale=True))
+        return
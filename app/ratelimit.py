@@ -0,0 +1,220 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from werkzeug.security import check_password_hash, generate_password_hash
+from app.extensions import db
+
+# Защита входа от перебора паролей. Попытки ограничиваются корзинами токенов: по IP — каждая попытка,
+# по паре IP и email (account) — только неудачные, поэтому чужие ошибки не блокируют вход владельцу;
+# по email — неудачные попытки с любых адресов, но эта корзина только замедляет вход (throttle):
+# перебор одной учётной записи с множества адресов идёт медленнее, а владельца не блокирует;
+# корзина хранится как один момент времени — «теоретическое время прихода» следующей попытки (GCRA):
+# каждая попытка сдвигает его на интервал между попытками, и попытка разрешена, пока оно опережает
+# текущее время не больше чем на период лимита.
+# Проверка хэша пароля (PBKDF2) выполняется в ограниченном пуле потоков: поток входа не занимает
+# больше процессора, чем позволяет пул, и остальные запросы обслуживаются даже во время волны входов.
+
+# Новая корзина вставляется, существующая сдвигается, только если попытка разрешена;
+# запрещённая попытка не возвращает строк
+_UPSERT_SQL = text("""
+    INSERT INTO rate_limits (key, tat) VALUES (:key, :now + :interval)
+    ON CONFLICT (key) DO UPDATE SET tat = MAX(tat, :now) + :interval
+    WHERE MAX(tat, :now) + :interval - :now <= :burst
+    RETURNING tat
+""")
+_TAT_SQL = text("SELECT tat FROM rate_limits WHERE key = :key")
+_DELETE_SQL = text("DELETE FROM rate_limits WHERE key = :key")
+_PURGE_SQL = text("DELETE FROM rate_limits WHERE tat < :now")
+
+
+class Busy(Exception):
+    """Пул проверки паролей заполнен."""
+
+
+# Хранилища корзин: memory — словарь процесса, database — таблица rate_limits (общая для процессов)
+class MemoryStore:
+    """Корзины в памяти процесса; самые давние вытесняются при переполнении (вытесненная — полная)."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key, interval, burst, now):
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+        return max(tat - burst - now, 0.0)
+
+    def hit(self, key, interval, burst, now):
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+            if tat - now > burst:
+                return tat - burst - now
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            while len(self._tats) > self.maxsize:
+                self._tats.popitem(last=False)
+            return 0.0
+
+    def reset(self, key):
+        with self._lock:
+            self._tats.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class DatabaseStore:
+    """Корзины в таблице rate_limits: проверка и списание — один UPSERT, без гонок между процессами."""
+
+    # Раз в столько секунд удаляются полные корзины — таблица не растёт от перебора разных email
+    PURGE_INTERVAL = 60
+
+    def __init__(self):
+        self._purged = 0.0
+
+    def peek(self, key, interval, burst, now):
+        with db.engine.connect() as connection:
+            tat = connection.execute(_TAT_SQL, {'key': key}).scalar()
+        return max(max(tat or now, now) + interval - burst - now, 0.0)
+
+    def hit(self, key, interval, burst, now):
+        with db.engine.begin() as connection:
+            if now - self._purged > self.PURGE_INTERVAL:
+                self._purged = now
+                connection.execute(_PURGE_SQL, {'now': now})
+            params = {'key': key, 'now': now, 'interval': interval, 'burst': burst}
+            if connection.execute(_UPSERT_SQL, params).first() is not None:
+                return 0.0
+            tat = connection.execute(_TAT_SQL, {'key': key}).scalar()
+        return tat + interval - burst - now
+
+    def reset(self, key):
+        with db.engine.begin() as connection:
+            connection.execute(_DELETE_SQL, {'key': key})
+
+    def clear(self):
+        with db.engine.begin() as connection:
+            connection.execute(text("DELETE FROM rate_limits"))
+
+
+class NullStore:
+    """Ограничение выключено."""
+
+    def peek(self, key, interval, burst, now):
+        return 0.0
+
+    def hit(self, key, interval, burst, now):
+        return 0.0
+
+    def reset(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+store = MemoryStore()
+# Вид корзины -> (попыток, за сколько секунд)
+limits = {}
+# Пауза перед проверкой пароля при исчерпанной мягкой корзине, сек
+throttle_delay = 0.0
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+_dummy_hash = None
+
+
+def init_app(app):
+    global store, limits, throttle_delay, _executor, _slots, _dummy_hash
+    kind = app.config.get('LOGIN_RATE_LIMIT_STORAGE', 'memory')
+    if kind == 'database':
+        store = DatabaseStore()
+    elif kind == 'memory':
+        store = MemoryStore(app.config.get('LOGIN_RATE_LIMIT_SIZE', 10000))
+    else:
+        store = NullStore()
+    limits = dict(app.config.get('LOGIN_RATE_LIMITS', {}))
+    throttle_delay = app.config.get('LOGIN_THROTTLE_DELAY', 2.0)
+    with _executor_lock:
+        if _executor is None:
+            workers = app.config.get('LOGIN_HASH_WORKERS', 2)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login')
+            # Выполняются и ждут в очереди не больше стольких проверок; остальным входам — отказ
+            _slots = threading.BoundedSemaphore(workers + app.config.get('LOGIN_HASH_QUEUE', 8))
+            # Фиктивный хэш тем же методом и с той же стоимостью, что у настоящих паролей;
+            # считается заранее, чтобы первая проверка неизвестного email не была дольше остальных
+            _dummy_hash = generate_password_hash('dummy-password')
+
+
+def _bucket(kind, value):
+    attempts, period = limits[kind]
+    return f'{kind}:{value}', period / attempts, period
+
+
+def hit(kind, value):
+    """Списывает попытку из корзины kind:value. Возвращает 0, если попытка разрешена,
+    иначе — через сколько секунд её можно повторить."""
+    if kind not in limits or not value:
+        return 0.0
+    return store.hit(*_bucket(kind, value), time.time())
+
+
+def wait(kind, value):
+    """Через сколько секунд (целое, 0 — сейчас) корзина kind:value разрешит попытку; не списывает её."""
+    if kind not in limits or not value:
+        return 0
+    return math.ceil(store.peek(*_bucket(kind, value), time.time()))
+
+
+def check(**keys):
+    """Списывает попытку из всех корзин (ip=..., ...). Возвращает целое число секунд
+    до следующей разрешённой попытки или 0."""
+    delay = 0.0
+    for kind, value in keys.items():
+        delay = max(delay, hit(kind, value))
+        if delay:
+            break
+    return math.ceil(delay)
+
+
+def throttle(kind, value):
+    """Мягкое ограничение: если корзина kind:value исчерпана, попытка не запрещается,
+    а выполняется после паузы throttle_delay. Возвращает длительность паузы."""
+    if not throttle_delay or not wait(kind, value):
+        return 0.0
+    time.sleep(throttle_delay)
+    return throttle_delay
+
+
+def account_key(ip, email):
+    return f'{ip}|{email}' if email else None
+
+
+def reset(kind, value):
+    store.reset(f'{kind}:{value}')
+
+
+def _check_hash(password_hash, password):
+    try:
+        return check_password_hash(password_hash, password)
+    finally:
+        _slots.release()
+
+
+def verify_password(password_hash, password):
+    """Проверка пароля в пуле. Без хэша (нет такого сотрудника) проверяется фиктивный —
+    время ответа не выдаёт, существует ли email. Busy, если пул и очередь заняты."""
+    if not _slots.acquire(blocking=False):
+        raise Busy()
+    try:
+        future = _executor.submit(_check_hash, password_hash or _dummy_hash, password or '')
+    except BaseException:
+        _slots.release()
+        raise
+    return future.result() and password_hash is not None
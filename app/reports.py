@@ -0,0 +1,184 @@
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import datetime
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+from app.database import report_session
+from app.models import Employee, Department, EmployeeCycleStats
+from app import rankings
+
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'fonts')
+FONT_PATH = os.path.join(FONTS_DIR, 'DejaVuSans.ttf')
+FONT_PATH_B = os.path.join(FONTS_DIR, 'DejaVuSans-Bold.ttf')
+FONT_PATH_I = os.path.join(FONTS_DIR, 'DejaVuSans-BoldOblique.ttf')
+REPORT_FONTS = {'': FONT_PATH, 'B': FONT_PATH_B, 'I': FONT_PATH_I}
+
+# Символы отчётов: латиница, кириллица, типографские знаки и валюты.
+# Шрифты урезаются до этого набора один раз на процесс — разбор и подсеттинг
+# полного DejaVu (~700 КБ) на каждый отчёт занимал большую часть времени экспорта.
+# Текст с другими символами (греческий, грузинский и т. п.) выводится полным шрифтом —
+# он подключается к отчёту, только если такой текст встретился.
+REPORT_CHARSET = [
+    code
+    for first, last in ((0x20, 0x7E), (0xA0, 0x24F), (0x400, 0x4FF), (0x2000, 0x206F),
+                        (0x20A0, 0x20BF), (0x2100, 0x214F))
+    for code in range(first, last + 1)
+]
+_REPORT_CHARS = frozenset(chr(code) for code in REPORT_CHARSET)
+# Каталог кэша урезанных шрифтов (общий для процессов одной машины)
+FONT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'kpi_report_fonts')
+# Сколько строк отчёта читаем из базы за раз
+REPORT_ROWS_BATCH = 500
+
+_fonts_lock = threading.Lock()
+_subset_fonts = None
+
+
+def _subset_font(source):
+    from fontTools import subset, ttLib
+
+    stat = os.stat(source)
+    key = hashlib.sha1(f"{source}:{stat.st_size}:{stat.st_mtime}:{len(REPORT_CHARSET)}".encode()).hexdigest()[:16]
+    target = os.path.join(FONT_CACHE_DIR, f"{os.path.splitext(os.path.basename(source))[0]}-{key}.ttf")
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+    font = ttLib.TTFont(source, recalcTimestamp=False)
+    options = subset.Options(notdef_outline=True, recommended_glyphs=True)
+    options.layout_features = []
+    options.drop_tables += ['FFTM']
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=REPORT_CHARSET)
+    subsetter.subset(font)
+    # Запись через временный файл, чтобы параллельный процесс не прочитал недописанный шрифт
+    fd, tmp_path = tempfile.mkstemp(suffix='.ttf', dir=FONT_CACHE_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        font.save(f)
+    os.replace(tmp_path, target)
+    return target
+
+
+def report_fonts():
+    """Пути к шрифтам отчёта {стиль: путь}, урезанным до REPORT_CHARSET."""
+    global _subset_fonts
+    with _fonts_lock:
+        if _subset_fonts is None:
+            try:
+                _subset_fonts = {style: _subset_font(path) for style, path in REPORT_FONTS.items()}
+            except Exception:
+                # Без кэша отчёт всё равно строится — на полных шрифтах
+                _subset_fonts = dict(REPORT_FONTS)
+    return _subset_fonts
+
+
+class PerformanceReport(FPDF):
+    """Отчёт по эффективности: титул на первой странице, шапка таблицы — на каждой."""
+    COLUMNS = ('Место', 'ФИО', 'Подразделение', 'Ср. балл')
+    COL_WIDTHS = (18, 75, 60, 30)
+
+    def __init__(self, title, cycle_name):
+        super().__init__()
+        self.report_title = title
+        self.cycle_name = cycle_name
+        self.created = datetime.now().strftime('%d.%m.%Y %H:%M')
+        self._fonts = report_fonts()
+        for style, path in self._fonts.items():
+            self.add_font("DejaVu", style=style, fname=path)
+        self._full_font = False
+        self.ensure_glyphs(title, cycle_name)
+        # Шрифт строк таблицы: add_page восстанавливает его после отрисовки шапки
+        self.set_font("DejaVu", size=11)
+
+    def ensure_glyphs(self, *texts):
+        """Подключает полный шрифт запасным, если в тексте есть символы вне урезанного набора."""
+        if self._full_font or self._fonts == REPORT_FONTS:
+            return
+        if any(not _REPORT_CHARS.issuperset(text) for text in texts if text):
+            self.add_font("DejaVuFull", fname=FONT_PATH)
+            self.set_fallback_fonts(["DejaVuFull"], exact_match=False)
+            self._full_font = True
+
+    def header(self):
+        if self.page_no() == 1:
+            # Заголовок
+            self.set_font("DejaVu", size=12)
+            self.cell(0, 10, 'Отчёт по эффективности', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+            self.cell(0, 10, self.report_title, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+            self.ln(5)
+
+            # Информация
+            self.cell(0, 8, f"Цикл: {self.cycle_name}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.cell(0, 8, f"Дата: {self.created}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.ln(10)
+
+        # Шапка таблицы
+        self.set_font("DejaVu", 'B', 12)
+        self.set_fill_color(200, 220, 255)
+        for width, caption in zip(self.COL_WIDTHS, self.COLUMNS):
+            self.cell(width, 10, caption, border=1, fill=True)
+        self.ln(10)
+
+    def add_row(self, rank, full_name, dept_name, avg_score):
+        self.ensure_glyphs(full_name, dept_name)
+        self.cell(self.COL_WIDTHS[0], 8, str(rank), border=1)
+        self.cell(self.COL_WIDTHS[1], 8, full_name, border=1)
+        self.cell(self.COL_WIDTHS[2], 8, dept_name, border=1)
+        self.cell(self.COL_WIDTHS[3], 8, f"{avg_score:.2f}", border=1)
+        self.ln(8)
+
+
+# Запрос строк отчёта: сотрудники цикла по месту в рейтинге (app/rankings.py), и заголовок отчёта.
+# mean — средний балл по оценкам цикла (из cycle_stats) для отчётов выше/ниже среднего
+def report_rows(session, report_type, department_id, cycle, mean):
+    rank = EmployeeCycleStats.rank
+    query = session.query(
+        Employee.full_name,
+        Department.name.label('dept_name'),
+        EmployeeCycleStats.avg_score
+    ).join(Employee, Employee.id == EmployeeCycleStats.employee_id) \
+     .join(Department, EmployeeCycleStats.department_id == Department.id) \
+     .filter(EmployeeCycleStats.cycle_id == cycle.id, EmployeeCycleStats.score_count > 0)
+
+    if report_type == 'above_avg':
+        query = query.filter(EmployeeCycleStats.avg_score > mean)
+        title = "Сотрудники с оценкой выше средней"
+    elif report_type == 'below_avg':
+        query = query.filter(EmployeeCycleStats.avg_score < mean)
+        title = "Сотрудники с оценкой ниже средней"
+    elif report_type == 'by_department' and department_id:
+        # Место внутри подразделения — по индексу (cycle_id, department_id, dept_rank)
+        rank = EmployeeCycleStats.dept_rank
+        query = query.filter(EmployeeCycleStats.department_id == int(department_id))
+        dept_name = session.get(Department, int(department_id)).name
+        title = f"Сотрудники подразделения: {dept_name}"
+    else:
+        title = "Все сотрудники"
+
+    return title, query.add_columns(rank.label('rank')).order_by(rank, EmployeeCycleStats.employee_id)
+
+
+# PDF-отчёт по эффективности: (байты PDF, имя файла для скачивания)
+def build_performance_report(report_type, department_id, cycle):
+    # Места досчитываются в основной сессии: отчётная только читает
+    mean = rankings.cycle_mean(rankings.ensure_ranking(cycle.id))
+    with report_session() as session:
+        title, query = report_rows(session, report_type, department_id, cycle, mean)
+
+        pdf = PerformanceReport(title, cycle.name)
+        pdf.add_page()
+
+        # Данные читаются из базы пачками и сразу выводятся на страницы
+        total = 0
+        for emp in query.yield_per(REPORT_ROWS_BATCH):
+            pdf.add_row(emp.rank, emp.full_name, emp.dept_name, emp.avg_score)
+            total += 1
+
+    pdf.ln(10)
+    pdf.set_font("DejaVu", 'I', 10)
+    pdf.cell(0, 8, f"Всего: {total} сотруд.", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    download_name = f'report_{report_type}_{datetime.now().strftime("%d%m%Y")}.pdf'
+    return bytes(pdf.output()), download_name
@@ -0,0 +1,33 @@
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from app.models import Employee, PerformanceMetric, MetricExclusion
+
+# Связи сотрудника, которые читают шаблоны списков (many-to-one — подгружаются через JOIN)
+DIRECTORY_RELATIONS = (Employee.role, Employee.department, Employee.position)
+
+
+def employees_with(*relations):
+    """Запрос сотрудников с заранее загруженными связями: одна выборка вместо запроса на каждую строку шаблона."""
+    return Employee.query.options(*(joinedload(relation) for relation in relations))
+
+
+# Справочник сотрудников: должность, подразделение и роль (employees, admin_employees)
+def directory_query():
+    return employees_with(*DIRECTORY_RELATIONS)
+
+
+# Список для выбора сотрудника с должностью (исключения метрик)
+def picker_query():
+    return employees_with(Employee.position).filter(Employee.is_active == True)
+
+
+# Список получателей: шаблону нужны только id и ФИО
+def names_query():
+    return Employee.query.options(load_only(Employee.id, Employee.full_name))
+
+
+# Метрика вместе с исключениями и их должностями/сотрудниками
+def metric_with_exclusions(metric_id):
+    return PerformanceMetric.query.options(
+        selectinload(PerformanceMetric.exclusions).joinedload(MetricExclusion.position),
+        selectinload(PerformanceMetric.exclusions).joinedload(MetricExclusion.employee)
+    ).get_or_404(metric_id)
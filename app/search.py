@@ -0,0 +1,208 @@
+import re
+from markupsafe import Markup, escape
+from flask import url_for
+from sqlalchemy import event, text
+from app.extensions import db
+from app import principals
+
+# Полнотекстовый поиск на SQLite FTS5. Одна таблица search_index на все источники: rowid = id * 4 + код
+# источника, поэтому триггеры находят и удаляют строку по rowid, без просмотра таблицы.
+# Триггеры на таблицах-источниках держат индекс в актуальном состоянии при любой записи — через сессию,
+# Core или напрямую в базе. Источник (kind) индексируется как слово: отбор по нему идёт внутри MATCH,
+# а не перебором всех совпадений. ref_id/owner_id/visible не индексируются и служат для фильтров.
+
+# Источник -> (код, таблица, заголовок, текст, владелец, признак видимости)
+SOURCES = {
+    'employee': (0, 'employees', 'full_name', 'email', 'NULL', 'is_active'),
+    'news': (1, 'news', 'title', 'content', 'NULL', 'is_published'),
+    'faq': (2, 'faqs', 'question', 'answer', 'NULL', 'is_published'),
+    # Обратную связь видит только получатель
+    'feedback': (3, 'feedbacks', "''", 'content', 'employee_id', '1'),
+}
+KIND_TITLES = {
+    'employee': 'Сотрудники',
+    'news': 'Новости',
+    'faq': 'Вопросы',
+    'feedback': 'Обратная связь',
+}
+SEARCH_PAGE_SIZE = 20
+SUGGEST_LIMIT = 8
+# Поиск по префиксу начинается с двух символов слова (под них заведены индексы префиксов)
+MIN_PREFIX = 2
+
+_CREATE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+    "title, body, kind, ref_id UNINDEXED, owner_id UNINDEXED, visible UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+_WORD = re.compile(r'\w+', re.UNICODE)
+# Маркеры совпадений в snippet(): текст экранируется, затем маркеры заменяются на <mark>
+_MARK_OPEN, _MARK_CLOSE = '\x02', '\x03'
+
+
+def _row_values(kind, alias):
+    code, _, title, body, owner, visible = SOURCES[kind]
+
+    def column(expr):
+        return expr if expr in ("''", 'NULL', '1') else f"{alias}.{expr}"
+    return (f"{alias}.id * 4 + {code}, {column(title)}, {column(body)}, '{kind}', {alias}.id, "
+            f"{column(owner)}, {column(visible)}")
+
+
+def _trigger_statements(kind):
+    code, table, *_ = SOURCES[kind]
+    insert = ("INSERT INTO search_index (rowid, title, body, kind, ref_id, owner_id, visible) "
+              f"VALUES ({_row_values(kind, 'new')});")
+    delete = f"DELETE FROM search_index WHERE rowid = old.id * 4 + {code};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_au AFTER UPDATE ON {table} BEGIN {delete} {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS search_{table}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+    ]
+
+
+def create_schema(connection):
+    connection.execute(text(_CREATE_TABLE))
+    for kind in SOURCES:
+        for statement in _trigger_statements(kind):
+            connection.execute(text(statement))
+
+
+def reindex(connection=None):
+    """Заполняет индекс заново по всем источникам. Возвращает число строк в индексе."""
+    connection = connection or db.session.connection()
+    create_schema(connection)
+    connection.execute(text("DELETE FROM search_index"))
+    for kind, (_, table, *_) in SOURCES.items():
+        connection.execute(text(
+            "INSERT INTO search_index (rowid, title, body, kind, ref_id, owner_id, visible) "
+            f"SELECT {_row_values(kind, 't')} FROM {table} t"
+        ))
+    connection.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    return connection.execute(text("SELECT count(*) FROM search_index")).scalar()
+
+
+# create_all/drop_all создают и удаляют индекс вместе с таблицами (новая база, тесты);
+# в существующих базах индекс заводит миграция
+@event.listens_for(db.metadata, 'after_create')
+def _create_after_tables(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        create_schema(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_before_tables(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text("DROP TABLE IF EXISTS search_index"))
+
+
+def match_expression(query_text):
+    """Запрос пользователя -> выражение MATCH: все слова, последнее — по префиксу. None, если слов нет.
+    Слова берутся в кавычки, поэтому синтаксис FTS5 (OR, NEAR, *, ^) из ввода не исполняется."""
+    words = _WORD.findall(query_text or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words[:-1]]
+    last = words[-1]
+    terms.append(f'"{last}"*' if len(last) >= MIN_PREFIX else f'"{last}"')
+    return ' '.join(terms)
+
+
+def _scopes(expression, kind=None, columns=None):
+    """Части запроса с учётом прав: [(выражение MATCH, условие)], объединяются через UNION ALL.
+    columns — искать только в этих столбцах. Гостям сотрудники ищутся только по имени:
+    email в публичном справочнике не показывается."""
+    principal = principals.current_principal()
+    access = "(kind != 'feedback' OR owner_id = :user_id)"
+    # Неопубликованное и уволенных видит только администратор
+    if not (principal and 'admin' in principal.permissions):
+        access += " AND visible = 1"
+    params = {'user_id': principal.id if principal else -1}
+
+    def scoped(columns, kind_clause):
+        text_part = f"{{{' '.join(columns)}}} : ({expression})" if columns else f"({expression})"
+        return f"{text_part} {kind_clause}" if kind_clause else text_part
+
+    columns = columns or ['title', 'body']
+    kinds = [kind] if kind in SOURCES else list(SOURCES)
+    if principal or 'employee' not in kinds:
+        return [(scoped(columns, _kind_clause(kinds)), access)], params
+    others = [k for k in kinds if k != 'employee']
+    scopes = [(scoped(['title'], _kind_clause(['employee'])), access)]
+    if others:
+        scopes.append((scoped(columns, _kind_clause(others)), access))
+    return scopes, params
+
+
+def _kind_clause(kinds):
+    if set(kinds) == set(SOURCES):
+        return ''
+    return 'AND kind : (' + ' OR '.join(f'"{k}"' for k in kinds) + ')'
+
+
+def _select(columns, scopes, params):
+    parts = []
+    for i, (expression, condition) in enumerate(scopes):
+        params[f'expression{i}'] = expression
+        parts.append(f"SELECT {columns} FROM search_index WHERE search_index MATCH :expression{i} AND {condition}")
+    return ' UNION ALL '.join(parts)
+
+
+def _highlight(snippet):
+    return Markup(str(escape(snippet)).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>'))
+
+
+def result_url(kind, ref_id):
+    principal = principals.current_principal()
+    if kind == 'news':
+        return url_for('views.news_detail', news_id=ref_id)
+    if kind == 'faq':
+        return url_for('views.faq') + f'#faq-{ref_id}'
+    if kind == 'feedback':
+        return url_for('views.dashboard')
+    if principal and (principal.id == ref_id or 'manage' in principal.permissions):
+        return url_for('views.employee_performance', emp_id=ref_id)
+    return url_for('views.employees')
+
+
+def search(query_text, kind=None, page=1, per_page=SEARCH_PAGE_SIZE):
+    """Ранжированный поиск (bm25, заголовок весомее текста) с учётом прав текущего пользователя.
+    Возвращает (результаты, есть ли следующая страница)."""
+    expression = match_expression(query_text)
+    if expression is None:
+        return [], False
+    scopes, params = _scopes(expression, kind)
+    params.update(limit=per_page + 1, offset=(page - 1) * per_page, mark_open=_MARK_OPEN, mark_close=_MARK_CLOSE)
+    columns = ("kind, ref_id, title, snippet(search_index, 1, :mark_open, :mark_close, '…', 16) AS snippet, "
+               "bm25(search_index, 10.0, 1.0, 0.0) AS score")
+    rows = db.session.execute(text(
+        _select(columns, scopes, params) + " ORDER BY score LIMIT :limit OFFSET :offset"
+    ), params).all()
+    authenticated = principals.current_principal() is not None
+    results = [{
+        'kind': row.kind,
+        'kind_title': KIND_TITLES[row.kind],
+        'id': row.ref_id,
+        'title': row.title or KIND_TITLES[row.kind],
+        'snippet': _highlight(row.snippet) if row.kind != 'employee' or authenticated else '',
+        'url': result_url(row.kind, row.ref_id),
+    } for row in rows[:per_page]]
+    return results, len(rows) > per_page
+
+
+def suggest(query_text, limit=SUGGEST_LIMIT):
+    """Подсказки для поля поиска: совпадения по заголовкам, новые первыми.
+    Без ранжирования: FTS5 останавливается на первых limit совпадениях по rowid вместо оценки всех,
+    поэтому время ответа не растёт с числом совпадений у короткого префикса."""
+    expression = match_expression(query_text)
+    if expression is None:
+        return []
+    scopes, params = _scopes(expression, columns=['title'])
+    rows = []
+    for i, (scope_expression, condition) in enumerate(scopes):
+        rows.extend(db.session.execute(text(
+            "SELECT rowid, kind, ref_id, title FROM search_index "
+            f"WHERE search_index MATCH :expression AND {condition} ORDER BY rowid DESC LIMIT :limit"
+        ), dict(params, expression=scope_expression, limit=limit)).all())
+    rows = sorted(rows, key=lambda row: row.rowid, reverse=True)[:limit]
+    return [{'kind': row.kind, 'title': row.title, 'url': result_url(row.kind, row.ref_id)} for row in rows]
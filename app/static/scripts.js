@@ -28,4 +28,80 @@ $(document).ready(function () {
 
         return true;
     });
-});
\ No newline at end of file
+
+    // Подсказки поиска: запрос к /search/suggest после паузы в наборе
+    $('input[data-suggest]').each(function () {
+        const input = $(this);
+        const list = $('<ul class="search-suggest"></ul>').hide().insertAfter(input);
+        let timer = null;
+        let last = '';
+
+        input.on('input', function () {
+            clearTimeout(timer);
+            const q = input.val().trim();
+            if (q.length < 2) {
+                list.hide();
+                return;
+            }
+            timer = setTimeout(function () {
+                last = q;
+                $.getJSON('/search/suggest', { q: q }, function (items) {
+                    if (q !== last) {
+                        return;
+                    }
+                    list.empty();
+                    items.forEach(function (item) {
+                        $('<li></li>').append($('<a></a>').attr('href', item.url).text(item.title)).appendTo(list);
+                    });
+                    list.toggle(items.length > 0);
+                });
+            }, 150);
+        });
+
+        input.on('blur', function () {
+            setTimeout(function () { list.hide(); }, 200);
+        });
+    });
+
+    // Графики: данные — по адресу из data-chart (/api/charts/*), Chart.js подключает сама страница.
+    // data-chart-table — tbody, куда выводятся те же данные таблицей
+    $('canvas[data-chart]').each(function () {
+        const canvas = $(this);
+        $.getJSON(canvas.data('chart'), function (payload) {
+            const table = $(canvas.data('chart-table'));
+            if (!payload.labels.length) {
+                canvas.replaceWith('<p class="text-muted">Нет данных.</p>');
+                table.closest('table').hide();
+                return;
+            }
+            const line = payload.type === 'line';
+            new Chart(canvas[0], {
+                type: payload.type,
+                data: {
+                    labels: payload.labels,
+                    datasets: payload.datasets.map(function (dataset) {
+                        return $.extend({
+                            backgroundColor: line ? 'rgba(78, 115, 223, 0.2)' : '#2c5282',
+                            borderColor: '#4e73df',
+                            borderWidth: line ? 3 : 0,
+                            fill: line,
+                            tension: 0.3
+                        }, dataset);
+                    })
+                },
+                options: {
+                    responsive: true,
+                    plugins: { legend: { display: payload.datasets.length > 1 || line } }
+                }
+            });
+            payload.labels.forEach(function (label, i) {
+                $('<tr></tr>')
+                    .append($('<td></td>').text(label))
+                    .append($('<td></td>').append($('<strong></strong>').text(payload.datasets[0].data[i].toFixed(2))))
+                    .appendTo(table);
+            });
+        }).fail(function () {
+            canvas.replaceWith('<p class="text-muted">Не удалось загрузить данные графика.</p>');
+        });
+    });
+});
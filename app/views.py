@@ -1,22 +1,35 @@
 from datetime import datetime
 import io
-from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, send_file, jsonify
+from flask import Response, stream_with_context, send_from_directory
 from flask_login import login_required, current_user
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
 from app.models import Department, MetricExclusion, db
 from app.models import (
     ContactMessage, Employee, EvaluationCycle, MetricCategory,
     PerformanceMetric, EmployeeMetric, Feedback, FeedbackType,
-    FAQ, News, Role, Department, Position
+    FAQ, News, Role, Department, Position, Job
 )
-from fpdf import FPDF
+from app.models import DepartmentCycleStats, EmployeeCycleStats
+from app import analytics, caching, charts, evaluations, exports, images, importer, jobs, principals, rankings, reports, repository, search
+from app import cycles as evaluation_cycles
+from app import dashboard as user_dashboard
+from app.pagination import paginate, page_size, cached_count
 from io import BytesIO
-from fpdf.enums import XPos, YPos
 
 views = Blueprint('views', __name__)
-FONT_PATH = "app/static/fonts/DejaVuSans.ttf"
-FONT_PATH_B = "app/static/fonts/DejaVuSans-Bold.ttf"
-FONT_PATH_I = "app/static/fonts/DejaVuSans-BoldOblique.ttf"
+# Сколько строк отчёта об ошибках импорта показываем на странице
+IMPORT_ERRORS_SHOWN = 200
+# Сколько последних фоновых задач показываем на странице импорта/экспорта
+RECENT_JOBS_SHOWN = 10
+
+# Ключи сортировки списков для постраничного вывода (последний столбец уникален, под ключ есть индекс)
+EMPLOYEE_ORDER = [(Employee.full_name, False), (Employee.id, False)]
+NEWS_ORDER = [(News.published_at, True), (News.id, True)]
+FAQ_ORDER = [(FAQ.category, False), (FAQ.id, False)]
+MESSAGE_ORDER = [(ContactMessage.created_at, True), (ContactMessage.id, True)]
+RANKING_ORDER = [(EmployeeCycleStats.rank, False), (EmployeeCycleStats.employee_id, False)]
 
 # Вспомогательная функция для хлебных крошек
 def render_with_breadcrumbs(template, breadcrumbs, **context):
@@ -27,7 +40,7 @@ def admin_or_manager_required(f):
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
             abort(403)
-        if current_user.role.name not in ['admin', 'manager']:
+        if not principals.has_permission('manage'):
             abort(403)
         return f(*args, **kwargs)
     decorated_function.__name__ = f.__name__
@@ -35,24 +48,16 @@ def admin_or_manager_required(f):
 
 @views.route('/')
 @views.route('/index')
+@caching.cached_page(ttl=60, depends=('evaluation_cycles', 'news', 'employees'))
 def index():
-    from datetime import datetime
-    current_date = datetime.utcnow()
-    expired_active_cycles = EvaluationCycle.query.filter(
-        EvaluationCycle.is_active == True,
-        EvaluationCycle.end_date < current_date
-    ).all()
-    for cycle in expired_active_cycles:
-        cycle.is_active = False
-        db.session.add(cycle)
-    if expired_active_cycles:
-        db.session.commit()
-    active_cycles = EvaluationCycle.query.filter_by(is_active=True).all()
+    # Истёкшие циклы закрывает планировщик (app/cycles.py) — страница только читает
+    active_cycles = evaluation_cycles.active_cycles()
     latest_news = News.query.filter_by(is_published=True).order_by(News.published_at.desc()).limit(3).all()
     breadcrumbs = [("Главная", url_for('views.index'))]
     return render_with_breadcrumbs('index.html', breadcrumbs, active_cycles=active_cycles, latest_news=latest_news)
 
 @views.route('/about')
+@caching.cached_page(ttl=3600)
 def about():
     breadcrumbs = [("Главная", url_for('views.index')), ("О компании", url_for('views.about'))]
     return render_with_breadcrumbs('about.html', breadcrumbs)
@@ -74,12 +79,33 @@ def contact():
     breadcrumbs = [("Главная", url_for('views.index')), ("Контакты", url_for('views.contact'))]
     return render_with_breadcrumbs('contact.html', breadcrumbs)
 
-@views.route('/employee/<int:emp_id>/performance')
-@login_required
-def employee_performance(emp_id):
-    from sqlalchemy import func
+# Средний балл сотрудника по каждому циклу одним агрегирующим запросом.
+# В режиме weighted балл взвешивается весом метрики и весом её категории.
+def employee_cycle_scores(emp_id, weighted=False):
+    if weighted:
+        weight = func.coalesce(PerformanceMetric.weight, 1.0) * func.coalesce(MetricCategory.weight, 1.0)
+        score_expr = func.sum(EmployeeMetric.score * weight) / func.nullif(func.sum(weight), 0)
+    else:
+        score_expr = func.avg(EmployeeMetric.score)
 
-    # Получаем сотрудника
+    query = db.session.query(
+        EvaluationCycle.id,
+        EvaluationCycle.name,
+        EvaluationCycle.start_date,
+        score_expr.label('avg_score')
+    ).join(EmployeeMetric, EmployeeMetric.cycle_id == EvaluationCycle.id)
+
+    if weighted:
+        query = query.join(PerformanceMetric, EmployeeMetric.metric_id == PerformanceMetric.id) \
+                     .outerjoin(MetricCategory, PerformanceMetric.category_id == MetricCategory.id)
+
+    return query.filter(EmployeeMetric.employee_id == emp_id) \
+                .group_by(EvaluationCycle.id, EvaluationCycle.name, EvaluationCycle.start_date) \
+                .having(score_expr.isnot(None)) \
+                .order_by(EvaluationCycle.start_date, EvaluationCycle.id) \
+                .all()
+
+def performance_employee_or_403(emp_id):
     employee = Employee.query.get_or_404(emp_id)
 
     # Проверка доступа
@@ -88,25 +114,14 @@ def employee_performance(emp_id):
             abort(403)
     elif current_user.role.name != 'admin' and current_user.id != emp_id:
         abort(403)
+    return employee
 
-    # Все циклы (отсортированы по дате)
-    cycles = EvaluationCycle.query.order_by(EvaluationCycle.start_date).all()
-
-    cycle_names = []
-    avg_scores = []
-
-    for cycle in cycles:
-        score = db.session.query(func.avg(EmployeeMetric.score)).filter(
-            EmployeeMetric.employee_id == emp_id,
-            EmployeeMetric.cycle_id == cycle.id
-        ).scalar()
-
-        if score is not None:
-            # Безопасное имя цикла
-            safe_name = f"{cycle.name} ({cycle.start_date.strftime('%m.%Y')})"
-            safe_name = safe_name.replace('"', "'").strip()
-            cycle_names.append(safe_name)
-            avg_scores.append(round(float(score), 2))
+@views.route('/employee/<int:emp_id>/performance')
+@login_required
+def employee_performance(emp_id):
+    # Каркас страницы: график и таблица подгружаются из employee_performance_chart
+    employee = performance_employee_or_403(emp_id)
+    weighted = request.args.get('weighted', type=int) == 1
 
     # Хлебные крошки
     breadcrumbs = [
@@ -117,8 +132,16 @@ def employee_performance(emp_id):
 
     return render_with_breadcrumbs('employee_performance.html', breadcrumbs,
                                    employee=employee,
-                                   cycle_names=cycle_names,
-                                   avg_scores=avg_scores)
+                                   weighted=weighted)
+
+@views.route('/api/charts/employee/<int:emp_id>/performance')
+@login_required
+def employee_performance_chart(emp_id):
+    performance_employee_or_403(emp_id)
+    weighted = request.args.get('weighted', type=int) == 1
+    payload = charts.employee_performance(employee_cycle_scores(emp_id, weighted=weighted), weighted)
+    # Данные сотрудника: только в браузере пользователя, перед показом сверяются по ETag
+    return charts.chart_response(payload, max_age=0, private=True)
 
 @views.route('/admin/employees')
 @login_required
@@ -126,31 +149,34 @@ def employee_performance(emp_id):
 def admin_employees():
     dept_filter = request.args.get('department', type=int)
     if current_user.role.name == 'manager':
-        query = Employee.query.filter_by(department_id=current_user.department_id)
+        query = repository.directory_query().filter_by(department_id=current_user.department_id)
     else:
-        query = Employee.query
+        query = repository.directory_query()
     if dept_filter:
         query = query.filter_by(department_id=dept_filter)
-    employees_list = query.all()
+    page = paginate(query, EMPLOYEE_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     if current_user.role.name == 'manager':
         departments = [current_user.department]
     else:
         departments = Department.query.all()
     breadcrumbs = [("Главная", url_for('views.index')), ("Управление сотрудниками", "")]
-    return render_with_breadcrumbs('admin_employees.html', breadcrumbs, employees=employees_list, departments=departments, selected_dept=dept_filter)
+    return render_with_breadcrumbs('admin_employees.html', breadcrumbs, employees=page.items, page=page, departments=departments, selected_dept=dept_filter)
 
 @views.route('/employees')
 def employees():
     dept_filter = request.args.get('department', type=int)
-    query = Employee.query.filter_by(is_active=True)
+    query = repository.directory_query().filter_by(is_active=True)
     if dept_filter:
         query = query.filter_by(department_id=dept_filter)
-    emps = query.all()
+    page = paginate(query, EMPLOYEE_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     departments = Department.query.all()
     breadcrumbs = [("Главная", url_for('views.index')), ("Сотрудники", url_for('views.employees'))]
-    return render_with_breadcrumbs('employees.html', breadcrumbs, employees=emps, departments=departments, selected_dept=dept_filter)
+    return render_with_breadcrumbs('employees.html', breadcrumbs, employees=page.items, page=page, departments=departments, selected_dept=dept_filter)
 
 @views.route('/metrics')
+@caching.cached_page(ttl=600, depends=('performance_metrics', 'metric_categories', 'departments'))
 def metrics():
     categories = MetricCategory.query.all()
     metrics = PerformanceMetric.query.filter_by(is_active=True).all()
@@ -158,23 +184,14 @@ def metrics():
     return render_with_breadcrumbs('metrics.html', breadcrumbs, categories=categories, metrics=metrics)
 
 @views.route('/cycles')
+@caching.cached_page(ttl=60, depends=('evaluation_cycles',))
 def cycles():
-    from datetime import datetime
-    current_date = datetime.utcnow()
-    expired_active_cycles = EvaluationCycle.query.filter(
-        EvaluationCycle.is_active == True,
-        EvaluationCycle.end_date < current_date
-    ).all()
-    for cycle in expired_active_cycles:
-        cycle.is_active = False
-        db.session.add(cycle)
-    if expired_active_cycles:
-        db.session.commit()
     cycles_list = EvaluationCycle.query.order_by(EvaluationCycle.start_date.desc()).all()
     breadcrumbs = [("Главная", url_for('views.index')), ("Циклы оценки", url_for('views.cycles'))]
     return render_with_breadcrumbs('cycles.html', breadcrumbs, cycles=cycles_list)
 
 @views.route('/faq')
+@caching.cached_page(ttl=600, depends=('faqs',))
 def faq():
     faq_items = FAQ.query.filter_by(is_published=True).order_by(FAQ.category, FAQ.id).all()
     categories = sorted(set(item.category for item in faq_items))
@@ -182,17 +199,22 @@ def faq():
     return render_with_breadcrumbs('faq.html', breadcrumbs, faq_items=faq_items, categories=categories)
 
 @views.route('/documentation')
+@caching.cached_page(ttl=3600)
 def documentation():
     breadcrumbs = [("Главная", url_for('views.index')), ("Документация", url_for('views.documentation'))]
     return render_with_breadcrumbs('documentation.html', breadcrumbs)
 
 @views.route('/news')
+@caching.cached_page(ttl=300, depends=('news', 'employees'), query_args=('cursor', 'per_page'))
 def news_list():
-    news_items = News.query.filter_by(is_published=True).order_by(News.published_at.desc()).all()
+    query = News.query.options(joinedload(News.author)).filter_by(is_published=True)
+    page = paginate(query, NEWS_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     breadcrumbs = [("Главная", url_for('views.index')), ("Новости", url_for('views.news_list'))]
-    return render_with_breadcrumbs('news.html', breadcrumbs, news_items=news_items)
+    return render_with_breadcrumbs('news.html', breadcrumbs, news_items=page.items, page=page)
 
 @views.route('/news/<int:news_id>')
+@caching.cached_page(ttl=300, depends=('news', 'employees'))
 def news_detail(news_id):
     item = News.query.filter_by(id=news_id, is_published=True).first_or_404()
     breadcrumbs = [
@@ -202,14 +224,33 @@ def news_detail(news_id):
     ]
     return render_with_breadcrumbs('news_detail.html', breadcrumbs, news=item)
 
+@views.route('/search')
+def search_page():
+    query_text = request.args.get('q', '').strip()
+    kind = request.args.get('kind')
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, has_next = search.search(query_text, kind, page)
+    breadcrumbs = [("Главная", url_for('views.index')), ("Поиск", url_for('views.search_page'))]
+    return render_with_breadcrumbs('search.html', breadcrumbs, query=query_text, kind=kind, page=page,
+                                   results=results, has_next=has_next, kinds=search.KIND_TITLES)
+
+# Подсказки для поля поиска (JSON)
+@views.route('/search/suggest')
+def search_suggest():
+    return jsonify(search.suggest(request.args.get('q', '')))
+
 @views.route('/stats')
+@caching.cached_page(ttl=60, depends=('evaluation_cycles', 'performance_metrics', 'metric_categories',
+                                              'employees', 'departments', 'feedbacks'))
 def stats():
-    total_emps = Employee.query.filter_by(is_active=True).count()
+    # Активный цикл, число активных сотрудников и метрик — из кэша app/cycles.py
+    state = evaluation_cycles.active_state()
+    total_emps = state.participant_count
     total_cycles = EvaluationCycle.query.count()
-    active_metrics = PerformanceMetric.query.filter_by(is_active=True).count()
+    active_metrics = len(state.metric_ids)
     feedback_count = Feedback.query.count()
 
-    active_cycle = EvaluationCycle.query.filter_by(is_active=True).first()
+    active_cycle = state.cycles[0] if state.cycles else None
 
     if not active_cycle:
         flash("Нет активного цикла оценки.", "info")
@@ -217,25 +258,18 @@ def stats():
         evaluated_count = 0
         not_evaluated_count = 0
         department_stats = []
-        category_names = []
-        category_scores = []
-        all_scores = []
-        dept_names = []
-        dept_avg_scores = []
+        composite = None
+        department_distributions = []
+        outliers = None
     else:
-        from sqlalchemy import func
-
-        # --- Топ-5 ---
-        top_employee_data = db.session.query(
-            Employee.full_name,
-            Department.name.label('dept_name'),
-            func.avg(EmployeeMetric.score).label('avg_score')
-        ).join(EmployeeMetric, Employee.id == EmployeeMetric.employee_id) \
-         .join(Department, Employee.department_id == Department.id) \
-         .filter(EmployeeMetric.cycle_id == active_cycle.id) \
-         .group_by(Employee.id, Department.name) \
-         .order_by(func.avg(EmployeeMetric.score).desc()) \
-         .limit(5).all()
+        # Агрегаты цикла материализованы в cycle_stats и смежных таблицах (app/aggregates.py),
+        # места сотрудников — в employee_cycle_stats (app/rankings.py)
+        summary = rankings.ensure_ranking(active_cycle.id)
+
+        # --- Топ-5: первые места рейтинга, по индексу (cycle_id, rank) ---
+        top_employee_data = ranking_query(active_cycle.id) \
+            .order_by(EmployeeCycleStats.rank, EmployeeCycleStats.employee_id) \
+            .limit(5).all()
 
         top_employees = [
             {"full_name": row.full_name, "department": {"name": row.dept_name}, "avg_score": float(row.avg_score)}
@@ -243,57 +277,35 @@ def stats():
         ]
 
         # --- Завершённость ---
-        all_employees = Employee.query.filter_by(is_active=True).all()
-        evaluated_ids = {item[0] for item in db.session.query(EmployeeMetric.employee_id).filter(
-            EmployeeMetric.cycle_id == active_cycle.id
-        ).distinct().all()}
-        evaluated_count = len(evaluated_ids)
-        not_evaluated_count = len(all_employees) - evaluated_count
+        evaluated_count = summary.evaluated_count
+        not_evaluated_count = total_emps - evaluated_count
 
         # --- Активность по подразделениям ---
+        active_by_dept = dict(db.session.query(Employee.department_id, func.count(Employee.id))
+                              .filter(Employee.is_active == True)
+                              .group_by(Employee.department_id).all())
+        dept_rows = {row.department_id: row for row in
+                     DepartmentCycleStats.query.filter_by(cycle_id=active_cycle.id).all()}
         department_stats = []
         for dept in Department.query.all():
-            emps = Employee.query.filter_by(department_id=dept.id, is_active=True).all()
-            if emps:
-                total = len(emps)
-                evaluated = len([e for e in emps if e.id in evaluated_ids])
-                percent = (evaluated / total) * 100
+            total = active_by_dept.get(dept.id, 0)
+            row = dept_rows.get(dept.id)
+            if total:
+                evaluated = min(row.evaluated_count if row else 0, total)
                 department_stats.append({
                     "name": dept.name,
                     "total": total,
                     "evaluated": evaluated,
-                    "percent": round(percent, 1)
+                    "percent": round((evaluated / total) * 100, 1)
                 })
 
-        # --- Все оценки для гистограммы ---
-        all_scores = [float(row.score) for row in db.session.query(EmployeeMetric.score).filter(
-            EmployeeMetric.cycle_id == active_cycle.id
-        ).all()]
-
-        # --- Средний балл по подразделениям (для pie и bar) ---
-        dept_avg_data = db.session.query(
-            Department.name,
-            func.avg(EmployeeMetric.score).label('avg_score')
-        ).join(Employee, Department.id == Employee.department_id) \
-         .join(EmployeeMetric, Employee.id == EmployeeMetric.employee_id) \
-         .filter(EmployeeMetric.cycle_id == active_cycle.id) \
-         .group_by(Department.id, Department.name).all()
-
-        dept_names = [row.name for row in dept_avg_data]
-        dept_avg_scores = [float(row.avg_score) for row in dept_avg_data]
-
-        # --- Средние по категориям ---
-        category_data = db.session.query(
-            MetricCategory.name,
-            func.avg(EmployeeMetric.score).label('avg_score')
-        ).join(PerformanceMetric, EmployeeMetric.metric_id == PerformanceMetric.id) \
-        .join(MetricCategory, PerformanceMetric.category_id == MetricCategory.id) \
-        .filter(EmployeeMetric.cycle_id == active_cycle.id) \
-        .group_by(MetricCategory.id, MetricCategory.name) \
-        .all()
-
-        category_names = [item.name for item in category_data]
-        category_scores = [float(item.avg_score) if item.avg_score else 0.0 for item in category_data]
+        # Гистограммы и средние по подразделениям и категориям страница подгружает из /api/charts/stats/*
+
+        # --- Итоговые взвешенные баллы: распределение по циклу и подразделениям (app/analytics.py) ---
+        cycle_analytics = analytics.cycle_analytics(active_cycle.id)
+        composite = cycle_analytics.overall
+        department_distributions = analytics.department_rows(cycle_analytics)
+        outliers = cycle_analytics.outliers
 
     breadcrumbs = [("Главная", url_for('views.index')), ("Статистика", url_for('views.stats'))]
     return render_with_breadcrumbs('stats.html', breadcrumbs,
@@ -306,36 +318,59 @@ def stats():
                                    evaluated_count=evaluated_count,
                                    not_evaluated_count=not_evaluated_count,
                                    department_stats=department_stats,
-                                   category_names=category_names,
-                                   category_scores=category_scores,
-                                   all_scores=all_scores,
-                                   dept_names=dept_names,
-                                   dept_avg_scores=dept_avg_scores)
+                                   composite=composite,
+                                   department_distributions=department_distributions,
+                                   outliers=outliers)
+
+# Графики страницы статистики по активному циклу: имя -> построитель данных (app/charts.py)
+STATS_CHARTS = {
+    'score-histogram': charts.score_histogram,
+    'composite-histogram': charts.composite_histogram,
+    'department-averages': charts.department_averages,
+    'category-averages': charts.category_averages,
+}
+
+
+@views.route('/api/charts/stats/<name>')
+def stats_chart(name):
+    builder = STATS_CHARTS.get(name)
+    if builder is None:
+        abort(404)
+    active_cycle = evaluation_cycles.active_cycle()
+    payload = builder(active_cycle.id) if active_cycle else charts.empty_chart()
+    return charts.chart_response(payload)
+
+def ranking_query(cycle_id):
+    # Рейтинг цикла (места посчитаны rankings.ensure_ranking) с ФИО и подразделением
+    return db.session.query(
+        EmployeeCycleStats.employee_id,
+        EmployeeCycleStats.avg_score,
+        EmployeeCycleStats.composite_score,
+        EmployeeCycleStats.rank,
+        EmployeeCycleStats.percentile,
+        Employee.full_name,
+        Department.name.label('dept_name')
+    ).join(Employee, Employee.id == EmployeeCycleStats.employee_id) \
+     .join(Department, EmployeeCycleStats.department_id == Department.id) \
+     .filter(EmployeeCycleStats.cycle_id == cycle_id, EmployeeCycleStats.score_count > 0)
 
 @views.route('/stats/all-employees')
 def all_employees():
-    active_cycle = EvaluationCycle.query.filter_by(is_active=True).first()
+    active_cycle = evaluation_cycles.active_cycle()
     if not active_cycle:
         flash("Нет активного цикла оценки.", "warning")
         return redirect(url_for('views.stats'))
 
-    from sqlalchemy import func
-
-    # Все сотрудники с их средними баллами
-    all_employee_data = db.session.query(
-        Employee.full_name,
-        Department.name.label('dept_name'),
-        func.avg(EmployeeMetric.score).label('avg_score')
-    ).join(EmployeeMetric, Employee.id == EmployeeMetric.employee_id) \
-     .join(Department, Employee.department_id == Department.id) \
-     .filter(EmployeeMetric.cycle_id == active_cycle.id) \
-     .group_by(Employee.id, Department.name) \
-     .order_by(func.avg(EmployeeMetric.score).desc()) \
-     .all()
+    # Сотрудники цикла по месту в рейтинге — по индексу (cycle_id, rank);
+    # общее число оценённых уже посчитано в статистике цикла
+    stats = rankings.ensure_ranking(active_cycle.id)
+    page = paginate(ranking_query(active_cycle.id), RANKING_ORDER, request.args.get('cursor'), page_size(),
+                    total=stats.evaluated_count)
 
     employees = [
-        {"full_name": row.full_name, "department": {"name": row.dept_name}, "avg_score": float(row.avg_score)}
-        for row in all_employee_data
+        {"full_name": row.full_name, "department": {"name": row.dept_name}, "avg_score": float(row.avg_score),
+         "rank": row.rank, "percentile": row.percentile, "composite_score": row.composite_score}
+        for row in page.items
     ]
 
     breadcrumbs = [
@@ -343,7 +378,7 @@ def all_employees():
         ("Статистика", url_for('views.stats')),
         ("Все сотрудники", url_for('views.all_employees'))
     ]
-    return render_with_breadcrumbs('all_employees.html', breadcrumbs, employees=employees, cycle_name=active_cycle.name)
+    return render_with_breadcrumbs('all_employees.html', breadcrumbs, employees=employees, page=page, cycle_name=active_cycle.name)
 
 @views.route('/categories')
 def categories():
@@ -355,9 +390,11 @@ def categories():
 @login_required
 @admin_or_manager_required
 def admin_faq():
-    faqs = FAQ.query.order_by(FAQ.category, FAQ.id).all()
+    query = FAQ.query
+    page = paginate(query, FAQ_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     breadcrumbs = [("Главная", url_for('views.index')), ("Админ: FAQ", url_for('views.admin_faq'))]
-    return render_with_breadcrumbs('admin_faq.html', breadcrumbs, faqs=faqs)
+    return render_with_breadcrumbs('admin_faq.html', breadcrumbs, faqs=page.items, page=page)
 
 @views.route('/admin/faq/add', methods=['GET', 'POST'])
 @login_required
@@ -413,9 +450,11 @@ def delete_faq(faq_id):
 @login_required
 @admin_or_manager_required
 def admin_news():
-    news_items = News.query.order_by(News.published_at.desc()).all()
+    query = News.query
+    page = paginate(query, NEWS_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     breadcrumbs = [("Главная", url_for('views.index')), ("Админ: Новости", url_for('views.admin_news'))]
-    return render_with_breadcrumbs('admin_news.html', breadcrumbs, news_items=news_items)
+    return render_with_breadcrumbs('admin_news.html', breadcrumbs, news_items=page.items, page=page)
 
 @views.route('/admin/news/add', methods=['GET', 'POST'])
 @login_required
@@ -478,22 +517,11 @@ def delete_news(news_id):
 def dashboard():
     user = current_user
 
-    # Оценки за текущий активный цикл
-    received_evals = EmployeeMetric.query.filter_by(employee_id=user.id)\
-        .join(EvaluationCycle).filter(EvaluationCycle.is_active == True).all()
-
-    given_evals = EmployeeMetric.query.filter_by(evaluator_id=user.id)\
-        .join(EvaluationCycle).filter(EvaluationCycle.is_active == True).all()
-
-    # Активная (не в архиве) обратная связь
-    active_feedbacks = Feedback.query.filter_by(employee_id=user.id, is_archived=False)\
-        .join(FeedbackType).add_columns(FeedbackType.name.label('type_name'))\
-        .order_by(Feedback.created_at.desc()).all()
-
-    # Архивная обратная связь
-    archived_feedbacks = Feedback.query.filter_by(employee_id=user.id, is_archived=True)\
-        .join(FeedbackType).add_columns(FeedbackType.name.label('type_name'))\
-        .order_by(Feedback.created_at.desc()).all()
+    # Оценки за текущие активные циклы (id циклов — из кэша) и обратная связь — по запросу на каждое;
+    # счётчики и средний балл — из кэша сводок
+    active_ids = [cycle.id for cycle in evaluation_cycles.active_cycles()]
+    received_evals = user_dashboard.received_evaluations(user.id, active_ids)
+    active_feedbacks, archive = user_dashboard.feedback(user.id, request.args.get('cursor'))
 
     breadcrumbs = [
         ("Главная", url_for('views.index')),
@@ -502,10 +530,10 @@ def dashboard():
 
     return render_with_breadcrumbs('dashboard.html', breadcrumbs,
                                    user=user,
+                                   summary=user_dashboard.user_summary(user.id),
                                    received_evals=received_evals,
-                                   given_evals=given_evals,
                                    active_feedbacks=active_feedbacks,
-                                   archived_feedbacks=archived_feedbacks)
+                                   archive=archive)
 
 @views.route('/feedback/archive/<int:fb_id>')
 @login_required
@@ -525,7 +553,7 @@ def archive_feedback(fb_id):
 @views.route('/feedback/send', methods=['GET', 'POST'])
 @login_required
 def send_feedback():
-    employees = Employee.query.filter(Employee.id != current_user.id).all()
+    employees = repository.names_query().filter(Employee.id != current_user.id).all()
     types = FeedbackType.query.all()
 
     if request.method == 'POST':
@@ -618,13 +646,14 @@ def add_metric():
                 exclusion = MetricExclusion(metric_id=metric.id, employee_id=int(emp_id))
                 db.session.add(exclusion)
         db.session.commit()
+        evaluations.invalidate_metric_rules()
         flash("Метрика добавлена.", "success")
         return redirect(url_for('views.admin_metrics'))
 
     categories = MetricCategory.query.all()
     departments = [current_user.department] if current_user.role.name == 'manager' else Department.query.all()
     all_positions = Position.query.all()
-    all_employees = Employee.query.filter_by(is_active=True).all()
+    all_employees = repository.picker_query().all()
 
     return render_template('add_metric.html',
                            categories=categories,
@@ -647,7 +676,7 @@ def add_employee():
 
     if request.method == 'POST':
         full_name = request.form.get('full_name')
-        email = request.form.get('email')
+        email = (request.form.get('email') or '').strip().lower()
         department_id = request.form.get('department_id')
         position_id = request.form.get('position_id')
         role_id = request.form.get('role_id')
@@ -659,7 +688,7 @@ def add_employee():
             flash("Заполните все обязательные поля.", "error")
             return redirect(url_for('views.add_employee'))
 
-        if Employee.query.filter_by(email=email).first():
+        if Employee.query.filter(func.lower(Employee.email) == email).first():
             flash("Сотрудник с таким email уже существует.", "error")
             return redirect(url_for('views.add_employee'))
 
@@ -711,6 +740,8 @@ def add_employee():
         )
         db.session.add(employee)
         db.session.commit()
+        if employee.photo:
+            images.submit_employee_photo(employee)
         flash(f"Сотрудник {full_name} добавлен.", "success")
         return redirect(url_for('views.admin_employees'))
 
@@ -740,7 +771,7 @@ def edit_employee(emp_id):
 
     if request.method == 'POST':
         full_name = request.form.get('full_name')
-        email = request.form.get('email')
+        email = (request.form.get('email') or '').strip().lower()
         department_id = request.form.get('department_id')
         position_id = request.form.get('position_id')
         role_id = request.form.get('role_id')
@@ -768,12 +799,13 @@ def edit_employee(emp_id):
                 return redirect(url_for('views.edit_employee', emp_id=emp_id))
 
             # Проверка уникальности email (кроме текущего сотрудника)
-            existing = Employee.query.filter(Employee.email == email, Employee.id != emp_id).first()
+            existing = Employee.query.filter(func.lower(Employee.email) == email, Employee.id != emp_id).first()
             if existing:
                 flash("Сотрудник с таким email уже существует.", "error")
                 return redirect(url_for('views.edit_employee', emp_id=emp_id))
 
             # === Обработка фото ===
+            replaced_photo_hash = False
             if photo_file and photo_file.filename != '':
                 ext = photo_file.filename.rsplit('.', 1)[-1].lower()
                 if ext not in ['jpg', 'jpeg', 'png']:
@@ -786,9 +818,11 @@ def edit_employee(emp_id):
                 os.makedirs(upload_folder, exist_ok=True)
                 filepath = os.path.join(upload_folder, filename)
 
-                # Сохраняем новое фото
+                # Сохраняем новое фото; уменьшенные копии готовятся в фоне, до тех пор показывается исходное
                 photo_file.save(filepath)
                 employee.photo = f"uploads/photos/{filename}"  # обновляем путь к фото
+                replaced_photo_hash = employee.photo_hash
+                employee.photo_hash = None
 
             # === Обновление остальных данных ===
             employee.full_name = full_name
@@ -804,6 +838,9 @@ def edit_employee(emp_id):
                 employee.password_hash = generate_password_hash(password)
 
             db.session.commit()
+            principals.invalidate(employee.id)
+            if replaced_photo_hash is not False:
+                images.submit_employee_photo(employee, replaced_photo_hash)
             flash("Данные сотрудника обновлены.", "success")
             return redirect(url_for('views.admin_employees'))
 
@@ -831,6 +868,7 @@ def delete_employee(emp_id):
     else:
         db.session.delete(employee)
         db.session.commit()
+        principals.invalidate(emp_id)
         flash("Сотрудник удалён.", "success")
     return redirect(url_for('views.admin_employees'))
 
@@ -839,7 +877,7 @@ def delete_employee(emp_id):
 @login_required
 @admin_or_manager_required
 def edit_metric(metric_id):
-    metric = PerformanceMetric.query.get_or_404(metric_id)
+    metric = repository.metric_with_exclusions(metric_id)
     categories = MetricCategory.query.all()
     departments = Department.query.all()
 
@@ -871,6 +909,8 @@ def edit_metric(metric_id):
                 db.session.add(exclusion)
 
         db.session.commit()
+        # Исключения удалены массовым DELETE мимо сессии — кэш сбрасываем явно
+        evaluations.invalidate_metric_rules()
         flash("Метрика обновлена.", "success")
         return redirect(url_for('views.admin_metrics'))
     excluded_positions = [excl.position for excl in metric.exclusions if excl.position]
@@ -882,7 +922,7 @@ def edit_metric(metric_id):
                                    categories=categories,
                                    departments=departments,
                                    all_positions=Position.query.all(),
-                                   all_employees=Employee.query.filter_by(is_active=True).all(),
+                                   all_employees=repository.picker_query().all(),
                                    excluded_positions=excluded_positions,
                                    excluded_employees=excluded_employees)
 
@@ -900,6 +940,7 @@ def delete_metric(metric_id):
 
     db.session.delete(metric)
     db.session.commit()
+    evaluations.invalidate_metric_rules()
     flash("Метрика удалена.", "success")
     return redirect(url_for('views.admin_metrics'))
 
@@ -915,6 +956,7 @@ def add_cycle():
         end_date = request.form.get('end_date')
         description = request.form.get('description')
         is_active = bool(request.form.get('is_active'))
+        auto_activate = bool(request.form.get('auto_activate')) and not is_active
 
         if not all([name, start_date, end_date]):
             flash("Заполните название, дату начала и окончания.", "error")
@@ -930,10 +972,12 @@ def add_cycle():
                         start_date=start,
                         end_date=end,
                         description=description,
-                        is_active=is_active
+                        is_active=is_active,
+                        auto_activate=auto_activate
                     )
                     db.session.add(cycle)
                     db.session.commit()
+                    evaluation_cycles.invalidate()
                     flash("Цикл оценки создан.", "success")
                     return redirect(url_for('views.admin_cycles'))
             except ValueError:
@@ -952,12 +996,13 @@ def edit_cycle(cycle_id):
     if request.method == 'POST':
         new_is_active = bool(request.form.get('is_active'))
 
-        if cycle.is_active and not new_is_active:
+        if cycle.is_open and not new_is_active:
             cycle.is_active = False
             db.session.commit()
+            evaluation_cycles.invalidate()
             flash("Цикл успешно деактивирован.", "success")
             return redirect(url_for('views.admin_cycles'))
-        elif cycle.is_active:
+        elif cycle.is_open:
             flash("Нельзя изменять параметры активного цикла. Можно только деактивировать.", "error")
             return redirect(url_for('views.admin_cycles'))
 
@@ -966,11 +1011,13 @@ def edit_cycle(cycle_id):
         cycle.end_date = datetime.fromisoformat(request.form.get('end_date'))
         cycle.description = request.form.get('description')
         cycle.is_active = new_is_active
+        cycle.auto_activate = bool(request.form.get('auto_activate')) and not new_is_active
 
         if cycle.start_date >= cycle.end_date:
             flash("Дата начала должна быть раньше даты окончания.", "error")
         else:
             db.session.commit()
+            evaluation_cycles.invalidate()
             flash("Цикл обновлён.", "success")
             return redirect(url_for('views.admin_cycles'))
 
@@ -983,51 +1030,46 @@ def edit_cycle(cycle_id):
 @admin_or_manager_required
 def delete_cycle(cycle_id):
     cycle = EvaluationCycle.query.get_or_404(cycle_id)
-    if cycle.is_active:
+    if cycle.is_open:
         flash("Нельзя удалить активный цикл.", "error")
     else:
         db.session.delete(cycle)
         db.session.commit()
+        evaluation_cycles.invalidate()
         flash("Цикл удалён.", "success")
     return redirect(url_for('views.admin_cycles'))
 
+# Кого может оценивать текущий пользователь: None — можно, иначе текст отказа
+def evaluation_denied(employee):
+    if current_user.role.name == 'admin':
+        return None
+    if current_user.role.name == 'manager':
+        if employee.department_id != current_user.department_id:
+            return "Вы можете оценивать только сотрудников своего подразделения."
+        return None
+    if employee.id != current_user.id:
+        return "Вы можете оценить только себя."
+    return None
+
 @views.route('/evaluate/<int:emp_id>', methods=['GET', 'POST'])
 @login_required
 def evaluate(emp_id):
     employee = Employee.query.get_or_404(emp_id)
-    cycle = EvaluationCycle.query.filter_by(is_active=True).first()
+    cycle = evaluation_cycles.active_cycle()
     
     if not cycle:
         flash("Нет активного цикла оценки.", "error")
         return redirect(url_for('views.dashboard'))
 
-    if current_user.role.name == 'admin':
-        pass
-    elif current_user.role.name == 'manager':
-        if employee.department_id != current_user.department_id:
-            flash("Вы можете оценивать только сотрудников своего подразделения.", "error")
-            return redirect(url_for('views.dashboard'))
-    else:
-        if employee.id != current_user.id:
-            flash("Вы можете оценить только себя.", "error")
-            return redirect(url_for('views.dashboard'))
-
-    emp_position_id = employee.position_id
-    excluded_metric_ids = db.session.query(MetricExclusion.metric_id).filter(
-        db.or_(
-            MetricExclusion.employee_id == emp_id,
-            MetricExclusion.position_id == emp_position_id
-        )
-    ).subquery()
+    denied = evaluation_denied(employee)
+    if denied:
+        flash(denied, "error")
+        return redirect(url_for('views.dashboard'))
 
-    metrics = PerformanceMetric.query.filter(
-        (PerformanceMetric.department_id == employee.department_id) |
-        (PerformanceMetric.department_id.is_(None))
-    ).filter_by(is_active=True)\
-    .filter(~PerformanceMetric.id.in_(excluded_metric_ids))\
-    .all()
+    metrics = list(evaluations.applicable_metrics([employee])[employee.id].values())
 
     if request.method == 'POST':
+        scores = {}
         for metric in metrics:
             score = request.form.get(f"score_{metric.id}")
             comment = request.form.get(f"comment_{metric.id}")
@@ -1035,29 +1077,13 @@ def evaluate(emp_id):
                 try:
                     score = float(score)
                     if 0 <= score <= metric.max_score:
-                        existing = EmployeeMetric.query.filter_by(
-                            employee_id=employee.id,
-                            metric_id=metric.id,
-                            cycle_id=cycle.id,
-                            evaluator_id=current_user.id
-                        ).first()
-                        if existing:
-                            existing.score = score
-                            existing.comment = comment
-                        else:
-                            eval_metric = EmployeeMetric(
-                                employee_id=employee.id,
-                                metric_id=metric.id,
-                                cycle_id=cycle.id,
-                                score=score,
-                                comment=comment,
-                                evaluator_id=current_user.id
-                            )
-                            db.session.add(eval_metric)
+                        scores[(employee.id, metric.id)] = (score, comment)
                     else:
                         flash(f"Балл за '{metric.name}' вне диапазона.", "error")
                 except ValueError:
                     flash(f"Некорректное значение для '{metric.name}'.", "error")
+        # Все оценки формы — одной пакетной записью в одной транзакции
+        evaluations.save_evaluations(cycle.id, current_user.id, scores)
         db.session.commit()
         flash(f"Оценка сотрудника {employee.full_name} сохранена.", "success")
         return redirect(url_for('views.dashboard'))
@@ -1068,6 +1094,109 @@ def evaluate(emp_id):
                                    metrics=metrics,
                                    cycle=cycle)
 
+# Уменьшенные копии фото: в имени файла хэш содержимого, поэтому браузер и CDN кэшируют их на год
+@views.route('/media/thumbs/<path:filename>')
+def photo_thumb(filename):
+    response = send_from_directory(images.thumbs_folder(), filename, max_age=images.THUMB_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+# Идентификаторы из JSON — ключи словарей: списки и объекты дали бы TypeError, bool — подмену 0/1
+def is_valid_batch_item(item):
+    return isinstance(item, dict) and all(
+        isinstance(item.get(key), int) and not isinstance(item.get(key), bool)
+        for key in ('employee_id', 'metric_id')
+    )
+
+
+# Пакетная оценка (JSON): {"evaluations": [{"employee_id", "metric_id", "score", "comment"}, ...]}
+# Все оценки пишутся в одной транзакции; при любой ошибке не сохраняется ничего
+@views.route('/evaluate/batch', methods=['POST'])
+@login_required
+def evaluate_batch():
+    cycle = evaluation_cycles.active_cycle()
+    if not cycle:
+        return jsonify({'error': "Нет активного цикла оценки."}), 409
+
+    payload = request.get_json(silent=True) or {}
+    items = payload.get('evaluations')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': "Ожидается непустой список evaluations."}), 400
+
+    employee_ids = {item['employee_id'] for item in items if is_valid_batch_item(item)}
+    employees = {e.id: e for e in Employee.query.filter(Employee.id.in_(employee_ids))}
+    applicable = evaluations.applicable_metrics(list(employees.values()))
+
+    errors = []
+    scores = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({'index': index, 'error': "Ожидается объект."})
+            continue
+        if not is_valid_batch_item(item):
+            errors.append({'index': index, 'error': "employee_id и metric_id должны быть целыми числами."})
+            continue
+        employee = employees.get(item.get('employee_id'))
+        if employee is None:
+            errors.append({'index': index, 'error': "Сотрудник не найден."})
+            continue
+        denied = evaluation_denied(employee)
+        if denied:
+            errors.append({'index': index, 'error': denied})
+            continue
+        metric = applicable[employee.id].get(item.get('metric_id'))
+        if metric is None:
+            errors.append({'index': index, 'error': "Метрика не применяется к сотруднику."})
+            continue
+        score = item.get('score')
+        # Балл — только число JSON: true сохранился бы как 1.0
+        if isinstance(score, bool) or not isinstance(score, (int, float)):
+            errors.append({'index': index, 'error': "Некорректный балл."})
+            continue
+        if not 0 <= score <= metric.max_score:
+            errors.append({'index': index, 'error': f"Балл за '{metric.name}' вне диапазона."})
+            continue
+        comment = item.get('comment')
+        if comment is not None and not isinstance(comment, str):
+            errors.append({'index': index, 'error': "Комментарий должен быть строкой."})
+            continue
+        scores[(employee.id, metric.id)] = (float(score), comment)
+
+    if errors:
+        return jsonify({'saved': 0, 'errors': errors}), 400
+
+    result = evaluations.save_evaluations(cycle.id, current_user.id, scores)
+    db.session.commit()
+    return jsonify({
+        'cycle_id': cycle.id,
+        'saved': result.saved,
+        'inserted': result.inserted,
+        'updated': result.updated,
+        'unchanged': result.unchanged,
+        'errors': []
+    })
+
+
+# Применимость метрик ко всем активным сотрудникам подразделения одним вызовом
+@views.route('/departments/<int:department_id>/applicable-metrics')
+@login_required
+@admin_or_manager_required
+def department_applicable_metrics(department_id):
+    department = Department.query.get_or_404(department_id)
+    if current_user.role.name == 'manager' and department.id != current_user.department_id:
+        abort(403)
+    applicable = evaluations.department_metric_ids(department.id)
+    metric_ids = set().union(*applicable.values()) if applicable else set()
+    metrics = PerformanceMetric.query.filter(PerformanceMetric.id.in_(metric_ids)) \
+        .order_by(PerformanceMetric.id).all() if metric_ids else []
+    return jsonify({
+        'department_id': department.id,
+        'metrics': [{'id': m.id, 'name': m.name, 'max_score': m.max_score, 'weight': m.weight} for m in metrics],
+        'employees': {str(employee_id): sorted(ids) for employee_id, ids in applicable.items()}
+    })
+
 @views.route('/export-import')
 @login_required
 @admin_or_manager_required
@@ -1079,7 +1208,17 @@ def export_import():
         ("Главная", url_for('views.index')),
         ("Импорт/Экспорт", "")
     ]
-    return render_with_breadcrumbs('export_import.html', breadcrumbs)
+    return render_with_breadcrumbs('export_import.html', breadcrumbs, jobs_list=recent_jobs(),
+                                   cycles=export_cycles())
+
+
+# Последние фоновые задачи текущего пользователя
+def recent_jobs():
+    return Job.query.filter_by(owner_id=current_user.id).order_by(Job.id.desc()).limit(RECENT_JOBS_SHOWN).all()
+
+# Циклы для выгрузки оценок: активный первым
+def export_cycles():
+    return EvaluationCycle.query.order_by(EvaluationCycle.is_active.desc(), EvaluationCycle.start_date.desc()).all()
 
 @views.route('/import-data', methods=['POST'])
 @login_required
@@ -1099,128 +1238,64 @@ def import_data():
         flash("Поддерживаются только .xlsx и .xls файлы.", "error")
         return redirect(url_for('views.export_import'))
 
-    active_cycle = EvaluationCycle.query.filter_by(is_active=True).first()
+    active_cycle = evaluation_cycles.active_cycle()
     if not active_cycle:
         flash("Нет активного цикла оценки.", "error")
         return redirect(url_for('views.export_import'))
 
+    if request.form.get('background'):
+        job = jobs.submit_job('import', current_user.id, {
+            'path': jobs.save_upload(file),
+            'filename': file.filename,
+            'cycle_id': active_cycle.id,
+            'evaluator_id': current_user.id
+        })
+        flash(f"Импорт поставлен в очередь (задача №{job.id}).", "info")
+        return redirect(url_for('views.export_import'))
+
+    # Сохраним файл временно (с исходным расширением — openpyxl определяет формат по нему)
+    import tempfile
+    suffix = os.path.splitext(file.filename)[1].lower()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        tmp_path = tmp.name
+
     try:
-        # Сохраним файл временно
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.tmp') as tmp:
-            file.save(tmp.name)
-            tmp_path = tmp.name
-    
-        imported = 0
-    
-        # --- НОВЫЙ БЛОК: Определение типа файла и чтение ---
-        if file.filename.lower().endswith('.csv'):
-            import csv
-            with open(tmp_path, newline='', encoding='utf-8') as csvfile:
-                reader = csv.reader(csvfile)
-                rows = list(reader)
-                if len(rows) < 2:
-                    flash("Файл пуст или содержит только заголовок.", "error")
-                    return redirect(url_for('views.export_import'))
-                # Пропускаем первую строку (заголовок)
-                for row in rows[1:]:
-                    if len(row) < 3:
-                        continue
-                    emp_email, metric_name, score = row[0], row[1], row[2]
-                    comment = row[3] if len(row) > 3 else ''
-                    # ... остальная логика обработки строки (как в Excel) ...
-                    employee = Employee.query.filter_by(email=emp_email).first()
-                    metric = PerformanceMetric.query.filter_by(name=metric_name).first()
-                    if not employee:
-                        flash(f"Не найден сотрудник с email: {emp_email}", "warning")
-                        continue
-                    if not metric:
-                        flash(f"Не найдена метрика: {metric_name}", "warning")
-                        continue
-                    try:
-                        score = float(score)
-                    except (TypeError, ValueError):
-                        flash(f"Некорректный балл для {emp_email}: {score}", "error")
-                        continue
-                    existing = EmployeeMetric.query.filter_by(
-                        employee_id=employee.id,
-                        metric_id=metric.id,
-                        cycle_id=active_cycle.id
-                    ).first()
-                    if existing:
-                        existing.score = score
-                        existing.comment = str(comment)
-                    else:
-                        eval_metric = EmployeeMetric(
-                            employee_id=employee.id,
-                            metric_id=metric.id,
-                            cycle_id=active_cycle.id,
-                            score=score,
-                            comment=str(comment),
-                            evaluator_id=current_user.id
-                        )
-                        db.session.add(eval_metric)
-                    imported += 1
-    
-        else:  # Это Excel
-            from openpyxl import load_workbook
-            workbook = load_workbook(tmp_path)
-            sheet = workbook.active
-            if sheet.max_row < 2:
-                flash("Файл пуст или содержит только заголовок.", "error")
-                return redirect(url_for('views.export_import'))
-            for row in sheet.iter_rows(min_row=2, values_only=True):
-                if not row[0]:
-                    continue
-                emp_email, metric_name, score, comment = row[0], row[1], row[2], row[3] or ''
-                # ... та же логика обработки строки, что и выше ...
-                employee = Employee.query.filter_by(email=emp_email).first()
-                metric = PerformanceMetric.query.filter_by(name=metric_name).first()
-                if not employee:
-                    flash(f"Не найден сотрудник с email: {emp_email}", "warning")
-                    continue
-                if not metric:
-                    flash(f"Не найдена метрика: {metric_name}", "warning")
-                    continue
-                try:
-                    score = float(score)
-                except (TypeError, ValueError):
-                    flash(f"Некорректный балл для {emp_email}: {score}", "error")
-                    continue
-                existing = EmployeeMetric.query.filter_by(
-                    employee_id=employee.id,
-                    metric_id=metric.id,
-                    cycle_id=active_cycle.id
-                ).first()
-                if existing:
-                    existing.score = score
-                    existing.comment = str(comment)
-                else:
-                    eval_metric = EmployeeMetric(
-                        employee_id=employee.id,
-                        metric_id=metric.id,
-                        cycle_id=active_cycle.id,
-                        score=score,
-                        comment=str(comment),
-                        evaluator_id=current_user.id
-                    )
-                    db.session.add(eval_metric)
-                imported += 1
-    
-        db.session.commit()
-        flash(f"Успешно импортировано {imported} оценок.", "success")
-    
-    except Exception as e:
-        db.session.rollback()
-        print("Ошибка при импорте:", str(e))
-        flash(f"Ошибка при обработке файла: {str(e)}", "error")
+        # Файл удаляется в finally, даже если сохранение оборвалось
+        file.save(tmp_path)
+        # Пачки коммитятся по отдельности; при сбое повторная загрузка того же файла продолжит импорт
+        checkpoint = importer.start_checkpoint(tmp_path, active_cycle.id)
+        rows = importer.read_rows(tmp_path, file.filename)
+        report = importer.import_evaluations(rows, active_cycle.id, current_user.id, checkpoint=checkpoint)
+        importer.finish_checkpoint(checkpoint)
+        if report.total == 0 and not report.resumed_from:
+            flash("Файл пуст или содержит только заголовок.", "error")
+            return redirect(url_for('views.export_import'))
+
+        if report.resumed_from:
+            flash(f"Импорт продолжен после строки {report.resumed_from}.", "info")
+        flash(f"Успешно импортировано {report.imported} оценок "
+              f"({report.rows_per_second:.0f} строк/с).", "success")
+        if report.error_count:
+            flash(f"Пропущено строк с ошибками: {report.error_count}.", "warning")
 
     except Exception as e:
         db.session.rollback()
         print("Ошибка при импорте:", str(e))
         flash(f"Ошибка при обработке файла: {str(e)}", "error")
+        return redirect(url_for('views.export_import'))
+
+    finally:
+        os.remove(tmp_path)
 
-    return redirect(url_for('views.export_import'))
+    breadcrumbs = [
+        ("Главная", url_for('views.index')),
+        ("Импорт/Экспорт", "")
+    ]
+    return render_with_breadcrumbs('export_import.html', breadcrumbs,
+                                   jobs_list=recent_jobs(),
+                                   cycles=export_cycles(),
+                                   import_report=report,
+                                   import_errors=report.errors[:IMPORT_ERRORS_SHOWN])
 
 @views.route('/export-pdf', methods=['POST'])
 @login_required
@@ -1229,99 +1304,85 @@ def export_pdf():
     report_type = request.form.get('report_type')
     department_id = request.form.get('department_id')
 
-    active_cycle = EvaluationCycle.query.filter_by(is_active=True).first()
+    active_cycle = evaluation_cycles.active_cycle()
     if not active_cycle:
         flash("Нет активного цикла оценки.", "error")
         return redirect(request.url)
 
-    from sqlalchemy import func
-
-    # Получаем средний балл
-    avg_score = db.session.query(func.avg(EmployeeMetric.score)).filter(
-        EmployeeMetric.cycle_id == active_cycle.id
-    ).scalar()
-    avg_score = avg_score or 0
+    if request.form.get('background'):
+        job = jobs.submit_job('export_pdf', current_user.id, {
+            'report_type': report_type,
+            'department_id': department_id,
+            'cycle_id': active_cycle.id
+        })
+        flash(f"Отчёт формируется в фоне (задача №{job.id}).", "info")
+        return redirect(url_for('views.export_import'))
 
-    query = db.session.query(
-        Employee.full_name,
-        Department.name.label('dept_name'),
-        func.avg(EmployeeMetric.score).label('avg_score')
-    ).join(EmployeeMetric, Employee.id == EmployeeMetric.employee_id) \
-     .join(Department, Employee.department_id == Department.id) \
-     .filter(EmployeeMetric.cycle_id == active_cycle.id) \
-     .group_by(Employee.id, Department.name)
-    
-    if report_type == 'above_avg':
-        query = query.having(func.avg(EmployeeMetric.score) > avg_score)
-        title = "Сотрудники с оценкой выше средней"
-    elif report_type == 'below_avg':
-        query = query.having(func.avg(EmployeeMetric.score) < avg_score)
-        title = "Сотрудники с оценкой ниже средней"
-    elif report_type == 'by_department' and department_id:
-        query = query.filter(Employee.department_id == int(department_id))
-        dept_name = Department.query.get(department_id).name
-        title = f"Сотрудники подразделения: {dept_name}"
-    else:
-        title = "Все сотрудники"
-
-    employees = query.order_by(func.avg(EmployeeMetric.score).desc()).all()
-
-    pdf = FPDF()
-    pdf.add_font("DejaVu", style="", fname=FONT_PATH)
-    pdf.add_font("DejaVu", style="B", fname=FONT_PATH_B)
-    pdf.add_font("DejaVu", style="I", fname=FONT_PATH_I)
-    pdf.set_font("DejaVu", size=12)
-    pdf.add_page()
-
-    # Заголовок
-    pdf.cell(0, 10, 'Отчёт по эффективности', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-    pdf.cell(0, 10, title, new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-    pdf.ln(5)
-
-    # Информация
-    pdf.cell(0, 8, f"Цикл: {active_cycle.name}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.cell(0, 8, f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.ln(10)
-
-    # Шапка таблицы
-    pdf.set_font("DejaVu", 'B', 12)
-    col_widths = [80, 60, 30]
-    pdf.set_fill_color(200, 220, 255)
-    pdf.cell(col_widths[0], 10, 'ФИО', border=1, fill=True)
-    pdf.cell(col_widths[1], 10, 'Подразделение', border=1, fill=True)
-    pdf.cell(col_widths[2], 10, 'Ср. балл', border=1, fill=True)
-    pdf.ln(10)
-
-    # Данные
-    pdf.set_font("DejaVu", size=11)
-    for emp in employees:
-        pdf.cell(col_widths[0], 8, emp.full_name, border=1)
-        pdf.cell(col_widths[1], 8, emp.dept_name, border=1)
-        pdf.cell(col_widths[2], 8, f"{emp.avg_score:.2f}", border=1)
-        pdf.ln(8)
-
-    pdf.ln(10)
-    pdf.set_font("DejaVu", 'I', 10)
-    pdf.cell(0, 8, f"Всего: {len(employees)} сотруд.", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-
-    pdf_output = pdf.output()
+    pdf_output, download_name = reports.build_performance_report(report_type, department_id, active_cycle)
 
     return send_file(
         BytesIO(pdf_output),
         as_attachment=True,
-        download_name=f'report_{report_type}_{datetime.now().strftime("%d%m%Y")}.pdf',
+        download_name=download_name,
         mimetype='application/pdf'
     )
 
+@views.route('/export-evaluations')
+@login_required
+@admin_or_manager_required
+def export_evaluations():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exports.EXPORT_FORMATS:
+        abort(400)
+
+    cycle_id = request.args.get('cycle_id', type=int)
+    if cycle_id:
+        cycle = EvaluationCycle.query.get_or_404(cycle_id)
+    else:
+        cycle = evaluation_cycles.active_cycle()
+        if not cycle:
+            flash("Нет активного цикла оценки.", "error")
+            return redirect(url_for('views.export_import'))
+
+    # Ответ отдаётся по частям по мере чтения строк из базы
+    mimetype, extension = exports.EXPORT_FORMATS[fmt]
+    download_name = f'evaluations_cycle{cycle.id}_{datetime.now().strftime("%d%m%Y")}.{extension}'
+    return Response(
+        stream_with_context(exports.export_evaluations(cycle.id, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+
+@views.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.owner_id != current_user.id and current_user.role.name != 'admin':
+        abort(403)
+    return jsonify(jobs.job_payload(job))
+
+@views.route('/jobs/<int:job_id>/download')
+@login_required
+def job_download(job_id):
+    job = Job.query.get_or_404(job_id)
+    if job.owner_id != current_user.id and current_user.role.name != 'admin':
+        abort(403)
+    if job.status != 'done' or not job.result_path or not os.path.exists(job.result_path):
+        abort(404)
+    return send_file(job.result_path, as_attachment=True,
+                     download_name=job.result_name, mimetype=job.result_mimetype)
+
 @views.route('/admin/messages')
 @login_required
 @admin_or_manager_required
 def admin_messages():
     if current_user.role.name != 'admin':
         abort(403)
-    messages = ContactMessage.query.order_by(ContactMessage.created_at.desc()).all()
+    query = ContactMessage.query
+    page = paginate(query, MESSAGE_ORDER, request.args.get('cursor'), page_size(),
+                    total=cached_count(query))
     breadcrumbs = [("Главная", url_for('views.index')), ("Сообщения обратной связи", "")]
-    return render_with_breadcrumbs('admin_messages.html', breadcrumbs, messages=messages)
+    return render_with_breadcrumbs('admin_messages.html', breadcrumbs, messages=page.items, page=page)
 
 
 @views.route('/admin/messages/toggle-read/<int:message_id>', methods=['POST'])
@@ -1,6 +1,11 @@
 from app import create_app
+from app import cycles, jobs
 
 app = create_app()
+# Планировщик циклов и восстановление фоновых задач — только в процессах сервера (gunicorn main:app, python main.py)
+cycles.start_scheduler(app)
+with app.app_context():
+    jobs.recover_jobs(app)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,326 @@
+"""Замеры основных страниц на синтетической организации: задержки, число SQL-запросов и пик памяти.
+
+    python tests/synthetic.py --out /tmp/org.db
+    python tests/benchmark.py --db /tmp/org.db --output before.json
+    python tests/benchmark.py --db /tmp/org.db --baseline before.json --output after.json
+
+Без --db база создаётся заново (размеры — как у tests/synthetic.py). Запросы идут через тестовый клиент
+Flask от имени администратора; база копируется во временный каталог — записи замеров её не меняют.
+Результат — JSON: по каждому сценарию перцентили задержки, запросы к базе и пик памяти Python;
+с --baseline — отношения к прошлому прогону (больше 1 — медленнее).
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests import synthetic
+
+PERCENTILES = (50, 90, 95, 99)
+ITERATIONS = 20
+WARMUP = 2
+# Строк в файле одного импорта
+IMPORT_ROWS = 1000
+REPORT_TYPES = ('above_avg', 'below_avg', 'by_department')
+STATS_CHART_NAMES = ('score-histogram', 'composite-histogram', 'department-averages', 'category-averages')
+
+
+class Context:
+    """Что нужно сценариям: администратор, активный цикл, сотрудники и их метрики."""
+
+    def __init__(self, app, seed):
+        from app.extensions import db
+        from app.models import Employee, Role, Department, PerformanceMetric
+        from app import cycles as evaluation_cycles, evaluations
+        self.random = random.Random(seed)
+        with app.app_context():
+            self.admin_id = Employee.query.join(Role).filter(Role.name == 'admin') \
+                .order_by(Employee.id).first().id
+            self.cycle_id = evaluation_cycles.active_cycle().id
+            sample = Employee.query.filter(Employee.id != self.admin_id, Employee.is_active == True) \
+                .order_by(Employee.id).all()
+            sample = self.random.sample(sample, min(len(sample), 200))
+            self.employee_ids = [employee.id for employee in sample]
+            self.emails = [employee.email for employee in sample]
+            # Метрики, по которым форма оценки примет балл каждого сотрудника
+            self.metric_ids = {employee_id: sorted(metrics)
+                               for employee_id, metrics in evaluations.applicable_metrics(sample).items()}
+            self.metric_names = [name for name, in db.session.query(PerformanceMetric.name)
+                                 .filter(PerformanceMetric.is_active == True, PerformanceMetric.department_id == None)]
+            self.department_ids = [department_id for department_id, in db.session.query(Department.id)]
+        self.counter = 0
+
+    def employee(self):
+        return self.random.choice(self.employee_ids)
+
+    def next(self):
+        self.counter += 1
+        return self.counter
+
+
+# Сценарий: функция(контекст) -> (метод, путь, аргументы тестового клиента)
+SCENARIOS = {}
+
+
+def scenario(name):
+    def decorator(f):
+        SCENARIOS[name] = f
+        return f
+    return decorator
+
+
+@scenario('stats')
+def _stats(ctx):
+    return 'GET', '/stats', {}
+
+
+@scenario('stats_chart')
+def _stats_chart(ctx):
+    name = STATS_CHART_NAMES[ctx.next() % len(STATS_CHART_NAMES)]
+    return 'GET', f'/api/charts/stats/{name}', {}
+
+
+@scenario('evaluate')
+def _evaluate(ctx):
+    employee_id = ctx.employee()
+    data = {f'score_{metric_id}': str(ctx.random.randint(0, 10)) for metric_id in ctx.metric_ids[employee_id]}
+    return 'POST', f'/evaluate/{employee_id}', {'data': data}
+
+
+@scenario('import_data')
+def _import_data(ctx):
+    # Каждый файл свой: одинаковый файл продолжил бы прошлый импорт по точке восстановления
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['email', 'metric', 'score', 'comment'])
+    run = ctx.next()
+    for i in range(IMPORT_ROWS):
+        writer.writerow([ctx.random.choice(ctx.emails), ctx.random.choice(ctx.metric_names),
+                         ctx.random.randint(0, 10), f'Импорт {run}-{i}'])
+    data = {'file': (io.BytesIO(buffer.getvalue().encode('utf-8')), f'import_{run}.csv')}
+    return 'POST', '/import-data', {'data': data, 'content_type': 'multipart/form-data'}
+
+
+@scenario('export_pdf')
+def _export_pdf(ctx):
+    report_type = REPORT_TYPES[ctx.next() % len(REPORT_TYPES)]
+    data = {'report_type': report_type}
+    if report_type == 'by_department':
+        data['department_id'] = str(ctx.random.choice(ctx.department_ids))
+    return 'POST', '/export-pdf', {'data': data}
+
+
+@scenario('employee_performance')
+def _employee_performance(ctx):
+    return 'GET', f'/employee/{ctx.employee()}/performance', {}
+
+
+@scenario('employee_performance_chart')
+def _employee_performance_chart(ctx):
+    return 'GET', f'/api/charts/employee/{ctx.employee()}/performance', {}
+
+
+@contextmanager
+def count_queries(app, counter):
+    """Считает SQL-запросы всех движков приложения (основного и только для чтения)."""
+    from sqlalchemy import event
+    from app.extensions import db
+
+    def record(*args):
+        counter[0] += 1
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+
+def request(client, ctx, name):
+    method, path, kwargs = SCENARIOS[name](ctx)
+    response = client.open(path, method=method, **kwargs)
+    # Тело читается целиком: выгрузки отдаются потоком
+    response.get_data()
+    return response.status_code
+
+
+def measure(app, client, ctx, name, iterations, warmup):
+    for _ in range(warmup):
+        request(client, ctx, name)
+
+    latencies, queries, statuses = [], [], {}
+    for _ in range(iterations):
+        counter = [0]
+        with count_queries(app, counter):
+            started = time.perf_counter()
+            status = request(client, ctx, name)
+            latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter[0])
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    # Память — отдельным запросом: tracemalloc замедляет выполнение и исказил бы задержки
+    tracemalloc.start()
+    try:
+        request(client, ctx, name)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'iterations': iterations,
+        'statuses': statuses,
+        'latency_ms': dict(
+            {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+            mean=round(float(latencies.mean()), 2), min=round(float(latencies.min()), 2),
+            max=round(float(latencies.max()), 2)
+        ),
+        'queries': {'min': min(queries), 'max': max(queries), 'mean': round(sum(queries) / len(queries), 1)},
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline):
+    """Отношения к прошлому прогону по сценариям, которые есть в обоих."""
+    changes = {}
+    for name, current in results.items():
+        previous = baseline.get('routes', {}).get(name)
+        if not previous:
+            continue
+
+        def ratio(new, old):
+            return round(new / old, 3) if old else None
+        changes[name] = {
+            'p50_ms': ratio(current['latency_ms']['p50'], previous['latency_ms']['p50']),
+            'p95_ms': ratio(current['latency_ms']['p95'], previous['latency_ms']['p95']),
+            'queries_mean': ratio(current['queries']['mean'], previous['queries']['mean']),
+            'peak_memory_kb': ratio(current['peak_memory_kb'], previous['peak_memory_kb']),
+        }
+    return changes
+
+
+def run(app, names=None, iterations=ITERATIONS, warmup=WARMUP, seed=synthetic.SEED, log=None):
+    """Прогоняет сценарии на приложении app. Возвращает {сценарий: результаты}."""
+    log = log or (lambda message: None)
+    ctx = Context(app, seed)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(ctx.admin_id)
+        session['_fresh'] = True
+    results = {}
+    for name in names or SCENARIOS:
+        results[name] = measure(app, client, ctx, name, iterations, warmup)
+        log(f"{name}: p50 {results[name]['latency_ms']['p50']} мс, "
+            f"запросов {results[name]['queries']['mean']}")
+    return results
+
+
+def prepare_database(source, path):
+    """Копия базы для замеров. Если активный цикл базы уже закончился (база создана давно),
+    последний цикл продлевается — иначе планировщик снимет его при запуске приложения."""
+    shutil.copyfile(source, path)
+    connection = sqlite3.connect(path)
+    try:
+        now = datetime.utcnow()
+        active = connection.execute('SELECT count(*) FROM evaluation_cycles WHERE is_active = 1 AND end_date >= ?',
+                                    (now.isoformat(' '),)).fetchone()[0]
+        if not active:
+            end_date = now + timedelta(days=synthetic.CYCLE_DAYS)
+            connection.execute('UPDATE evaluation_cycles SET is_active = 1, end_date = ? '
+                               'WHERE id = (SELECT max(id) FROM evaluation_cycles)', (end_date.isoformat(' '),))
+            connection.commit()
+    finally:
+        connection.close()
+
+
+def database_summary(path):
+    connection = sqlite3.connect(path)
+    try:
+        return {table: connection.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+                for table in ('employees', 'performance_metrics', 'evaluation_cycles', 'employee_metrics')}
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='готовая база tests/synthetic.py (по умолчанию создаётся новая)')
+    parser.add_argument('--config', default='development', choices=['development', 'production'])
+    parser.add_argument('--routes', nargs='+', choices=sorted(SCENARIOS), help='сценарии (по умолчанию все)')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--output', help='файл для JSON (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    parser.add_argument('--quiet', action='store_true')
+    synthetic.add_size_arguments(parser)
+    args = parser.parse_args()
+    log = None if args.quiet else (lambda message: print(message, file=sys.stderr))
+
+    workdir = tempfile.mkdtemp(prefix='kpi_bench_')
+    path = os.path.join(workdir, 'bench.db')
+    # Для production: путь к базе читается из окружения при загрузке настроек
+    os.environ['DATABASE_PATH'] = path
+    try:
+        if args.db:
+            prepare_database(args.db, path)
+            generated = None
+        else:
+            generated = synthetic.generate(path, log=log, **synthetic.size_arguments(args))
+        app = synthetic.create_app_for(path, args.config)
+        # Каталоги задач и файлового кэша — тоже во временном каталоге
+        app.config.update(JOBS_FOLDER=os.path.join(workdir, 'jobs'), RESPONSE_CACHE_DIR=os.path.join(workdir, 'cache'),
+                          PROPAGATE_EXCEPTIONS=False)
+        app.logger.disabled = True
+
+        results = run(app, args.routes, args.iterations, args.warmup, args.seed, log)
+        output = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'config': args.config,
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'seed': args.seed,
+                'database': database_summary(path),
+                'generated': generated,
+                'iterations': args.iterations,
+                'warmup': args.warmup,
+                # Пик резидентной памяти процесса, включая генерацию базы (Linux — КБ)
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            },
+            'routes': results,
+        }
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                output['compare'] = compare(results, json.load(f))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
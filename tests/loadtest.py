@@ -0,0 +1,144 @@
+"""Нагрузочный тест SQLite: смешанные чтения (/stats, выгрузка) и записи (/evaluate) из нескольких потоков.
+
+    python tests/loadtest.py --config production --threads 8 --seconds 20
+
+Работает на копии базы разработки; результат печатается одной строкой JSON.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEV_DB = os.path.join(BASE_DIR, 'app', 'database_dev.db')
+
+
+def prepare_database(path):
+    shutil.copyfile(DEV_DB, path)
+    os.environ['DATABASE_PATH'] = path
+
+
+def create_app_for(config_name, path):
+    from app.config import config
+    config[config_name].SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    from app import create_app
+    return create_app(config_name)
+
+
+def setup_cycle(app, extra_rows):
+    """Активный цикл, администратор-оценщик и сотрудники с метриками для записи.
+    extra_rows — сколько оценок добавить в цикл, чтобы чтения были тяжелее."""
+    from sqlalchemy import insert
+    from app.extensions import db
+    from app.models import Employee, Role, EvaluationCycle, PerformanceMetric, EmployeeMetric
+    from app import aggregates
+    with app.app_context():
+        cycle = EvaluationCycle.query.order_by(EvaluationCycle.id.desc()).first()
+        EvaluationCycle.query.update({'is_active': False})
+        cycle.is_active = True
+        admin = Employee.query.join(Role).filter(Role.name == 'admin').first()
+        employees = [e.id for e in Employee.query.filter_by(is_active=True)]
+        metrics = [m.id for m in PerformanceMetric.query.filter_by(is_active=True)]
+        # Оценщики с id вне справочника — не пересекаются с ключом оценок из /evaluate
+        for start in range(0, extra_rows, 10000):
+            db.session.execute(insert(EmployeeMetric), [
+                {'employee_id': random.choice(employees), 'metric_id': random.choice(metrics),
+                 'cycle_id': cycle.id, 'score': random.randint(0, 10), 'evaluator_id': 1000000 + i}
+                for i in range(start, min(start + 10000, extra_rows))
+            ])
+        aggregates.rebuild_cycle_stats(cycle.id)
+        db.session.commit()
+        return admin.id, cycle.id, employees, metrics
+
+
+def worker(app, user_id, cycle_id, employees, metrics, write_ratio, deadline, results, lock):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    counts = {'read': 0, 'write': 0, 'errors': 0}
+    latencies = []
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if random.random() < write_ratio:
+                kind = 'write'
+                data = {f"score_{metric_id}": random.randint(0, 10) for metric_id in metrics}
+                response = client.post(f'/evaluate/{random.choice(employees)}', data=data)
+            else:
+                kind = 'read'
+                if random.random() < 0.9:
+                    response = client.get('/stats')
+                else:
+                    response = client.get(f'/export-evaluations?format=csv&cycle_id={cycle_id}')
+                    response.get_data()
+            ok = response.status_code < 500
+        except Exception:
+            kind, ok = 'write', False
+        latencies.append(time.perf_counter() - started)
+        counts[kind if ok else 'errors'] += 1
+    with lock:
+        for key, value in counts.items():
+            results[key] += value
+        results['latencies'].extend(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default='production', choices=['development', 'production'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--rows', type=int, default=100000, help='дополнительные оценки в активном цикле')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='kpi_load_')
+    path = os.path.join(workdir, 'load.db')
+    prepare_database(path)
+    app = create_app_for(args.config, path)
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.logger.disabled = True
+    user_id, cycle_id, employees, metrics = setup_cycle(app, args.rows)
+
+    results = {'read': 0, 'write': 0, 'errors': 0, 'latencies': []}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(app, user_id, cycle_id, employees, metrics,
+                                              args.write_ratio, deadline, results, lock))
+        for _ in range(args.threads)
+    ]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(results.pop('latencies')) or [0]
+    total = results['read'] + results['write'] + results['errors']
+    print(json.dumps({
+        'config': args.config,
+        'threads': args.threads,
+        'seconds': round(elapsed, 1),
+        'requests': total,
+        'rps': round(total / elapsed, 1),
+        'reads': results['read'],
+        'writes': results['write'],
+        'errors': results['errors'],
+        'rows': args.rows,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 1)
+    }, ensure_ascii=False))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
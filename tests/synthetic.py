@@ -0,0 +1,245 @@
+"""Синтетическая организация для нагрузочных замеров: подразделения, сотрудники, метрики, циклы и оценки.
+
+    python tests/synthetic.py --out /tmp/org.db
+    python tests/synthetic.py --out /tmp/small.db --employees 500 --metrics 40 --cycles 6
+
+По умолчанию — 10 000 сотрудников, 200 метрик, 40 циклов и по 10 оценок на сотрудника в цикле (4 млн оценок).
+Одно и то же зерно (--seed) даёт одну и ту же базу; даты отсчитываются от дня генерации так, чтобы
+последний, активный цикл шёл сейчас. Сводка печатается одной строкой JSON.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Размеры по умолчанию
+EMPLOYEES = 10000
+METRICS = 200
+CYCLES = 40
+EVALUATIONS = 10
+DEPARTMENTS = 50
+CATEGORIES = 8
+SEED = 42
+# Доля метрик, заведённых для одного подразделения (остальные — общие)
+DEPARTMENT_METRIC_SHARE = 0.1
+# Отзывов обратной связи на сотрудника
+FEEDBACK_PER_EMPLOYEE = 2
+# Строк в одном INSERT
+CHUNK = 20000
+# Пароль всех синтетических сотрудников; администратор — admin.s<зерно>@example.org
+PASSWORD = 'password'
+CYCLE_DAYS = 90
+
+
+def create_app_for(path, config_name='development'):
+    from app.config import config
+    config[config_name].SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    from app import create_app
+    return create_app(config_name)
+
+
+def _insert(model, rows):
+    from sqlalchemy import insert
+    from app.extensions import db
+    for start in range(0, len(rows), CHUNK):
+        db.session.execute(insert(model), rows[start:start + CHUNK])
+
+
+def _ids(model, *criteria):
+    from app.extensions import db
+    return [row_id for row_id, in db.session.query(model.id).filter(*criteria).order_by(model.id)]
+
+
+def _role_ids():
+    from app.extensions import db
+    from app.models import Role
+    roles = {role.name: role for role in Role.query}
+    for name, description in (('admin', 'Полный доступ'), ('manager', 'Руководитель подразделения'),
+                              ('employee', 'Обычный сотрудник')):
+        if name not in roles:
+            roles[name] = Role(name=name, description=description)
+            db.session.add(roles[name])
+    db.session.flush()
+    return {name: role.id for name, role in roles.items()}
+
+
+def populate(employees=EMPLOYEES, metrics=METRICS, cycles=CYCLES, evaluations=EVALUATIONS,
+             departments=DEPARTMENTS, seed=SEED, log=None):
+    """Заполняет текущую базу приложения (нужен контекст приложения). Справочники и циклы пишутся
+    через сессию, сотрудники, оценки и отзывы — пачками INSERT, агрегаты циклов пересобираются в конце.
+    Последний цикл — активный. Возвращает сводку: сколько чего создано и за сколько секунд."""
+    from werkzeug.security import generate_password_hash
+    from app.extensions import db
+    from app.models import (Department, Position, Employee, MetricCategory, PerformanceMetric, EvaluationCycle,
+                            EmployeeMetric, FeedbackType, Feedback)
+    from app import aggregates, caching, cycles as evaluation_cycles
+
+    log = log or (lambda message: None)
+    started = time.monotonic()
+    rng = np.random.default_rng(seed)
+    # Существующие объекты не трогаем: имена и email синтетических — с меткой зерна
+    tag = f's{seed}'
+    roles = _role_ids()
+    # Последний цикл начался половину цикла назад
+    first_cycle = datetime.combine(date.today(), datetime.min.time()) \
+        - timedelta(days=CYCLE_DAYS * (cycles - 1) + CYCLE_DAYS // 2)
+
+    db.session.add_all(Department(name=f'Подразделение {tag}-{i + 1:03d}') for i in range(departments))
+    db.session.add_all(MetricCategory(name=f'Категория {tag}-{i + 1}', weight=round(float(w), 2))
+                       for i, w in enumerate(rng.uniform(0.1, 0.4, CATEGORIES)))
+    db.session.flush()
+    department_ids = _ids(Department, Department.name.like(f'Подразделение {tag}-%'))
+    category_ids = _ids(MetricCategory, MetricCategory.name.like(f'Категория {tag}-%'))
+
+    db.session.add_all(Position(title=title, department_id=department_id)
+                       for department_id in department_ids for title in ('Руководитель', 'Специалист'))
+    metric_departments = np.where(rng.random(metrics) < DEPARTMENT_METRIC_SHARE,
+                                  rng.choice(department_ids, metrics), 0)
+    db.session.add_all(PerformanceMetric(
+        name=f'Метрика {tag}-{i + 1:03d}', category_id=int(rng.choice(category_ids)),
+        max_score=10.0, weight=round(float(rng.uniform(0.5, 2.0)), 2),
+        department_id=int(metric_departments[i]) or None, is_active=True
+    ) for i in range(metrics))
+    db.session.add_all(EvaluationCycle(
+        name=f'Цикл {tag}-{i + 1:02d}', start_date=first_cycle + timedelta(days=CYCLE_DAYS * i),
+        end_date=first_cycle + timedelta(days=CYCLE_DAYS * (i + 1) - 1), is_active=False
+    ) for i in range(cycles))
+    db.session.add_all(FeedbackType(name=name) for name in ('Благодарность', 'Рекомендация', 'Замечание'))
+    db.session.flush()
+    positions = {(p.department_id, p.title): p.id
+                 for p in Position.query.filter(Position.department_id.in_(department_ids))}
+    metric_ids = np.array(_ids(PerformanceMetric, PerformanceMetric.name.like(f'Метрика {tag}-%')))
+    cycle_ids = _ids(EvaluationCycle, EvaluationCycle.name.like(f'Цикл {tag}-%'))
+    feedback_type_ids = _ids(FeedbackType)
+    # Активен только последний цикл: из нескольких активных текущим считается цикл с меньшим id
+    EvaluationCycle.query.update({'is_active': False})
+    db.session.get(EvaluationCycle, cycle_ids[-1]).is_active = True
+    db.session.commit()
+    log(f'Справочники: {departments} подразделений, {metrics} метрик, {cycles} циклов')
+
+    # Сотрудники: первый — администратор, первый в каждом подразделении — руководитель
+    password_hash = generate_password_hash(PASSWORD)
+    employee_departments = np.sort(rng.choice(department_ids, employees))
+    first_in_department = np.r_[True, employee_departments[1:] != employee_departments[:-1]]
+    rows = []
+    for i in range(employees):
+        department_id = int(employee_departments[i])
+        manager = bool(first_in_department[i])
+        rows.append({
+            'full_name': f'Сотрудник {tag}-{i + 1:05d}',
+            'email': f'admin.{tag}@example.org' if i == 0 else f'user{i + 1:05d}.{tag}@example.org',
+            'password_hash': password_hash,
+            'role_id': roles['admin'] if i == 0 else roles['manager'] if manager else roles['employee'],
+            'department_id': department_id,
+            'position_id': positions[(department_id, 'Руководитель' if manager else 'Специалист')],
+            'hire_date': first_cycle - timedelta(days=int(rng.integers(0, 3650))),
+            'is_active': True,
+        })
+    _insert(Employee, rows)
+    employee_ids = np.array(_ids(Employee, Employee.full_name.like(f'Сотрудник {tag}-%')))
+    managers = dict(zip(employee_departments[first_in_department].tolist(),
+                        employee_ids[first_in_department].tolist()))
+    evaluator_ids = np.array([managers[d] for d in employee_departments.tolist()])
+    log(f'Сотрудники: {employees}')
+
+    # Каждый сотрудник получает в цикле оценки по evaluations разным метрикам — общим или своего
+    # подразделения — от руководителя подразделения. Балл — способность сотрудника плюс шум.
+    ability = rng.normal(6.5, 1.5, employees)
+    allowed = (metric_departments[None, :] == 0) | (metric_departments[None, :] == employee_departments[:, None])
+    per_employee = min(evaluations, int(allowed.sum(axis=1).min()))
+    evaluation_count = 0
+    for cycle_index, cycle_id in enumerate(cycle_ids):
+        # Случайные ключи у недоступных метрик больше единицы — они не попадают в первые per_employee
+        keys = rng.random((employees, len(metric_ids))) + ~allowed
+        chosen = np.argpartition(keys, per_employee - 1, axis=1)[:, :per_employee]
+        scores = np.clip(np.rint(ability[:, None] + rng.normal(0, 1.5, chosen.shape)), 0, 10)
+        evaluated_at = min(first_cycle + timedelta(days=CYCLE_DAYS * cycle_index + CYCLE_DAYS - 10), datetime.now())
+        _insert(EmployeeMetric, [
+            {'employee_id': employee_id, 'metric_id': metric_id, 'cycle_id': cycle_id, 'score': score,
+             'evaluator_id': evaluator_id, 'evaluated_at': evaluated_at}
+            for employee_id, evaluator_id, metric_row, score_row in zip(
+                employee_ids.tolist(), evaluator_ids.tolist(), metric_ids[chosen].tolist(), scores.tolist())
+            for metric_id, score in zip(metric_row, score_row)
+        ])
+        aggregates.rebuild_cycle_stats(cycle_id)
+        db.session.commit()
+        evaluation_count += chosen.size
+        log(f'Цикл {cycle_index + 1}/{cycles}: {chosen.size} оценок')
+
+    feedback_count = employees * FEEDBACK_PER_EMPLOYEE
+    recipients = rng.choice(employee_ids, feedback_count)
+    senders = rng.choice(employee_ids, feedback_count)
+    _insert(Feedback, [{
+        'employee_id': recipient, 'sender_id': sender, 'cycle_id': int(rng.choice(cycle_ids)),
+        'feedback_type_id': int(rng.choice(feedback_type_ids)), 'content': f'Отзыв {i + 1} о работе',
+        'created_at': first_cycle + timedelta(days=int(rng.integers(0, CYCLE_DAYS * (cycles - 1) + CYCLE_DAYS // 2))),
+        'is_anonymous': i % 5 == 0, 'is_archived': i % 3 == 0,
+    } for i, (recipient, sender) in enumerate(zip(recipients.tolist(), senders.tolist()))])
+    db.session.commit()
+
+    # Записи мимо сессии не сбрасывают кэши сами
+    caching.invalidate('employees', 'employee_metrics', 'feedbacks', 'evaluation_cycles')
+    evaluation_cycles.invalidate()
+    return {
+        'seed': seed,
+        'departments': departments,
+        'employees': employees,
+        'metrics': metrics,
+        'cycles': cycles,
+        'evaluations': evaluation_count,
+        'feedbacks': feedback_count,
+        'seconds': round(time.monotonic() - started, 1),
+    }
+
+
+def generate(path, log=None, **sizes):
+    """Новая база в файле path, заполненная populate(**sizes). Возвращает сводку."""
+    if os.path.exists(path):
+        os.remove(path)
+    app = create_app_for(path)
+    app.logger.disabled = True
+    from app.extensions import db
+    with app.app_context():
+        # Без журнала и fsync: база одноразовая, при сбое генерация повторяется с тем же зерном
+        db.session.execute(db.text('PRAGMA journal_mode = OFF'))
+        db.session.execute(db.text('PRAGMA synchronous = OFF'))
+        summary = populate(log=log, **sizes)
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+    summary['path'] = path
+    summary['size_mb'] = round(os.path.getsize(path) / 1024 / 1024, 1)
+    return summary
+
+
+def add_size_arguments(parser):
+    parser.add_argument('--employees', type=int, default=EMPLOYEES)
+    parser.add_argument('--metrics', type=int, default=METRICS)
+    parser.add_argument('--cycles', type=int, default=CYCLES)
+    parser.add_argument('--evaluations', type=int, default=EVALUATIONS, help='оценок на сотрудника в цикле')
+    parser.add_argument('--departments', type=int, default=DEPARTMENTS)
+    parser.add_argument('--seed', type=int, default=SEED)
+
+
+def size_arguments(args):
+    return {name: getattr(args, name) for name in
+            ('employees', 'metrics', 'cycles', 'evaluations', 'departments', 'seed')}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', required=True, help='файл базы (перезаписывается)')
+    parser.add_argument('--quiet', action='store_true')
+    add_size_arguments(parser)
+    args = parser.parse_args()
+    log = None if args.quiet else (lambda message: print(message, file=sys.stderr))
+    print(json.dumps(generate(args.out, log=log, **size_arguments(args)), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
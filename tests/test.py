@@ -1,24 +1,40 @@
 import sys
 import os
+import shutil
+import tempfile
 import unittest
+from contextlib import contextmanager
 from io import BytesIO
 from datetime import datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from main import app
+from tests.synthetic import create_app_for
 from app.models import db, Employee, Role, Department, Position, EvaluationCycle, PerformanceMetric
 
+# Своя временная база: dev-база не мигрируется и не перезаписывается тестами
+_db_dir = tempfile.mkdtemp(prefix='kpi-test-')
+app = create_app_for(os.path.join(_db_dir, 'test.db'), 'testing')
+
+
+def tearDownModule():
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(_db_dir, ignore_errors=True)
+
+
 class TestApp(unittest.TestCase):
 
     def setUp(self):
         """Настройка тестового клиента и БД"""
         app.config['TESTING'] = True
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
         app.config['WTF_CSRF_ENABLED'] = False
         app.config['SECRET_KEY'] = 'testkey'
 
         self.app = app.test_client()
+        # Попытки входа считаются в процессе — каждый тест начинает с полных корзин
+        from app import ratelimit
+        ratelimit.store.clear()
 
         with app.app_context():
             db.create_all()
@@ -64,7 +80,7 @@ class TestApp(unittest.TestCase):
             cycle = EvaluationCycle(
                 name="Тестовый цикл",
                 start_date=datetime(2025, 1, 1),
-                end_date=datetime(2025, 1, 31),
+                end_date=datetime(2099, 1, 31),
                 is_active=True
             )
             db.session.add(cycle)
@@ -80,6 +96,23 @@ class TestApp(unittest.TestCase):
             db.session.add(metric)
             db.session.commit()
 
+    @contextmanager
+    def assertQueryBudget(self, limit):
+        """Падает, если внутри блока выполнено больше limit SQL-запросов"""
+        from sqlalchemy import event
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertLessEqual(len(statements), limit,
+                             f"Превышен бюджет запросов ({len(statements)} > {limit}):\n" + "\n".join(statements))
+
     def tearDown(self):
         """Очистка после тестов"""
         with app.app_context():
@@ -209,7 +242,8 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.headers['Content-Type'], 'application/pdf')
 
     def test_import_csv_success(self):
-        """Попытка импорта CSV — отклонена (поддерживаются только .xlsx)"""
+        """Успешный импорт CSV"""
+        from app.models import EmployeeMetric
         self.app.post('/login', data={
             'email': 'admin@test.ru',
             'password': 'admin123'
@@ -223,8 +257,14 @@ admin@test.ru,Производительность,8.5,Отличная рабо
         response = self.app.post('/import-data', data=data,
                                content_type='multipart/form-data',
                                follow_redirects=True)
-        # Система не поддерживает .csv
-        self.assertIn('Поддерживаются только .xlsx и .xls файлы'.encode('utf-8'), response.data)
+        self.assertIn('Успешно импортировано 1 оценок'.encode('utf-8'), response.data)
+
+        with app.app_context():
+            evaluation = EmployeeMetric.query.one()
+            self.assertEqual(evaluation.employee.email, 'admin@test.ru')
+            self.assertEqual(evaluation.metric_id, PerformanceMetric.query.one().id)
+            self.assertEqual(evaluation.score, 8.5)
+            self.assertEqual(evaluation.comment, 'Отличная работа')
 
     def test_import_invalid_format(self):
         """Импорт неподдерживаемого формата (.txt)"""
@@ -273,5 +313,1171 @@ admin@test.ru,Производительность,8.5,Отличная рабо
         self.assertIn('Успешно импортировано'.encode('utf-8'), response.data)
 
 
+    def test_employee_performance_trend(self):
+        """Динамика сотрудника: простой и взвешенный средний балл по циклам"""
+        from app.models import EmployeeMetric, MetricCategory
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            db.session.add(MetricCategory(id=1, name="Результат", weight=1.0))
+            light = PerformanceMetric(name="Инициативность", category_id=1, weight=3.0, is_active=True)
+            db.session.add(light)
+            db.session.flush()
+            heavy = PerformanceMetric.query.filter_by(name="Производительность").first()
+            db.session.add_all([
+                EmployeeMetric(employee_id=admin.id, metric_id=heavy.id, cycle_id=cycle.id,
+                               score=4.0, evaluator_id=admin.id),
+                EmployeeMetric(employee_id=admin.id, metric_id=light.id, cycle_id=cycle.id,
+                               score=8.0, evaluator_id=admin.id),
+            ])
+            db.session.commit()
+            emp_id = admin.id
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        response = self.app.get(f'/employee/{emp_id}/performance')
+        self.assertEqual(response.status_code, 200)
+        # Страница — каркас, баллы приходят из API графиков
+        data = self.app.get(f'/api/charts/employee/{emp_id}/performance').get_json()
+        self.assertEqual(data['datasets'][0]['data'], [6.0])
+
+        response = self.app.get(f'/employee/{emp_id}/performance?weighted=1')
+        self.assertEqual(response.status_code, 200)
+        data = self.app.get(f'/api/charts/employee/{emp_id}/performance?weighted=1').get_json()
+        self.assertEqual(data['datasets'][0]['data'], [7.0])
+
+    def test_stats_aggregates_follow_evaluations(self):
+        """Материализованная статистика обновляется при оценке и совпадает с пересчётом"""
+        from app import aggregates
+        with app.app_context():
+            admin_id = Employee.query.filter_by(email='admin@test.ru').first().id
+            metric_id = PerformanceMetric.query.first().id
+            cycle_id = EvaluationCycle.query.first().id
+            cycle = db.session.get(EvaluationCycle, cycle_id)
+            cycle.end_date = datetime(2099, 1, 1)
+            db.session.commit()
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.app.post(f'/evaluate/{admin_id}', data={f'score_{metric_id}': '7'})
+        self.app.post(f'/evaluate/{admin_id}', data={f'score_{metric_id}': '9'})
+
+        with app.app_context():
+            self.assertEqual(aggregates.check_cycle_stats(cycle_id), [])
+            stats = aggregates.load_cycle_stats(cycle_id)
+            self.assertEqual(stats['cycle']['score_count'], 1)
+            self.assertEqual(stats['cycle']['evaluated_count'], 1)
+            self.assertAlmostEqual(stats['cycle']['score_sum'], 9.0)
+            self.assertEqual(stats['cycle']['histogram'][9], 1)
+
+        response = self.app.get('/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'9.00', response.data)
+
+    def test_cycle_stats_rebuild_keeps_request_session(self):
+        """Достраивание отсутствующих агрегатов не коммитит несохранённые изменения сессии запроса"""
+        from app import aggregates
+        from app.models import CycleStats
+        with app.app_context():
+            cycle_id = EvaluationCycle.query.first().id
+            db.session.query(CycleStats).filter_by(cycle_id=cycle_id).delete()
+            db.session.commit()
+
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            admin.full_name = "Не сохранять"
+            self.assertEqual(aggregates.get_cycle_stats(cycle_id).cycle_id, cycle_id)
+            db.session.rollback()
+            self.assertEqual(Employee.query.filter_by(email='admin@test.ru').first().full_name, "Тест Админ")
+            self.assertIsNotNone(db.session.get(CycleStats, cycle_id))
+
+    def test_import_xlsx_upsert_and_error_report(self):
+        """Повторный импорт обновляет оценки, ошибочные строки попадают в отчёт"""
+        from openpyxl import Workbook
+        from app.models import EmployeeMetric
+        from app import aggregates
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+
+        def upload(rows):
+            wb = Workbook()
+            ws = wb.active
+            ws.append(["email", "metric", "score", "comment"])
+            for row in rows:
+                ws.append(row)
+            buffer = BytesIO()
+            wb.save(buffer)
+            buffer.seek(0)
+            return self.app.post('/import-data', data={'file': (buffer, 'test.xlsx')},
+                                 content_type='multipart/form-data', follow_redirects=True)
+
+        upload([["admin@test.ru", "Производительность", 5, ""]])
+        response = upload([
+            ["admin@test.ru", "Производительность", 8, "Обновлено"],
+            ["nobody@test.ru", "Производительность", 7, ""],
+            ["admin@test.ru", "Нет такой метрики", 7, ""],
+            ["admin@test.ru", "Производительность", "abc", ""],
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Успешно импортировано 1 оценок'.encode('utf-8'), response.data)
+        self.assertIn('nobody@test.ru'.encode('utf-8'), response.data)
+        self.assertIn('Не найдена метрика'.encode('utf-8'), response.data)
+
+        with app.app_context():
+            evaluations = EmployeeMetric.query.all()
+            self.assertEqual(len(evaluations), 1)
+            self.assertEqual(evaluations[0].score, 8.0)
+            self.assertEqual(aggregates.check_cycle_stats(evaluations[0].cycle_id), [])
+
+        # Email сопоставляется без учёта регистра и пробелов, как при входе
+        response = upload([[" Admin@Test.RU ", "Производительность", 6, ""]])
+        self.assertIn('Успешно импортировано 1 оценок'.encode('utf-8'), response.data)
+        with app.app_context():
+            self.assertEqual([e.score for e in EmployeeMetric.query.all()], [6.0])
+
+    def test_import_resumes_from_checkpoint(self):
+        """Повторная загрузка прерванного файла продолжает импорт с точки восстановления"""
+        import hashlib
+        from openpyxl import Workbook
+        from app.models import EmployeeMetric, ImportCheckpoint
+
+        with app.app_context():
+            db.session.add(PerformanceMetric(name="Качество", category_id=1, is_active=True))
+            db.session.commit()
+            cycle_id = EvaluationCycle.query.first().id
+
+        wb = Workbook()
+        ws = wb.active
+        ws.append(["email", "metric", "score", "comment"])
+        ws.append(["admin@test.ru", "Производительность", 5, ""])
+        ws.append(["admin@test.ru", "Качество", 6, ""])
+        buffer = BytesIO()
+        wb.save(buffer)
+        content = buffer.getvalue()
+
+        # Первая строка данных (строка 2 листа) уже была закоммичена ранее
+        with app.app_context():
+            db.session.add(ImportCheckpoint(file_hash=hashlib.sha256(content).hexdigest(),
+                                            cycle_id=cycle_id, last_row=2, rows_done=1))
+            db.session.commit()
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        response = self.app.post('/import-data', data={'file': (BytesIO(content), 'test.xlsx')},
+                                 content_type='multipart/form-data', follow_redirects=True)
+        self.assertIn('Импорт продолжен после строки 2'.encode('utf-8'), response.data)
+
+        with app.app_context():
+            scores = [e.score for e in EmployeeMetric.query.all()]
+            self.assertEqual(scores, [6.0])
+            self.assertEqual(ImportCheckpoint.query.count(), 0)
+
+    def test_background_export_job(self):
+        """Фоновый экспорт PDF: задача выполняется, статус опрашивается, результат скачивается"""
+        import tempfile
+        app.config['JOBS_EAGER'] = True
+        app.config['JOBS_FOLDER'] = tempfile.mkdtemp()
+        try:
+            self.app.post('/login', data={
+                'email': 'admin@test.ru',
+                'password': 'admin123'
+            }, follow_redirects=True)
+            response = self.app.post('/export-pdf', data={
+                'report_type': 'all',
+                'background': 'on'
+            }, follow_redirects=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Фоновые задачи'.encode('utf-8'), response.data)
+
+            from app.models import Job
+            with app.app_context():
+                job_id = Job.query.one().id
+
+            status = self.app.get(f'/jobs/{job_id}').get_json()
+            self.assertEqual(status['status'], 'done')
+            self.assertEqual(status['progress'], 100)
+            self.assertTrue(status['has_result'])
+
+            response = self.app.get(f'/jobs/{job_id}/download')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Type'], 'application/pdf')
+            response.close()
+        finally:
+            app.config['JOBS_EAGER'] = False
+
+    def test_recover_jobs(self):
+        """При старте ошибкой помечаются только задачи завершившихся процессов"""
+        import socket
+        import subprocess
+        from app import jobs
+        from app.models import Job
+
+        finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+        finished.wait()
+        host = socket.gethostname()
+        with app.app_context():
+            admin_id = Employee.query.filter_by(email='admin@test.ru').one().id
+            orphan = Job(kind='import', owner_id=admin_id, status='running', worker=f'{host}:{finished.pid}')
+            alive = Job(kind='import', owner_id=admin_id, status='running', worker=f'{host}:{os.getpid()}')
+            db.session.add_all([orphan, alive])
+            db.session.commit()
+            orphan_id, alive_id = orphan.id, alive.id
+
+        # create_app (команды flask, тесты, замеры) задачи не восстанавливает — только main.py
+        other = create_app_for(os.path.join(_db_dir, 'test.db'), 'testing')
+        with other.app_context():
+            self.assertEqual(db.session.get(Job, orphan_id).status, 'running')
+            db.engine.dispose()
+
+        with app.app_context():
+            jobs.recover_jobs(app)
+            orphan, alive = db.session.get(Job, orphan_id), db.session.get(Job, alive_id)
+            self.assertEqual(orphan.status, 'failed')
+            self.assertIsNotNone(orphan.finished_at)
+            self.assertEqual(alive.status, 'running')
+
+    def test_export_evaluations_formats(self):
+        """Выгрузка оценок цикла в CSV, JSON Lines и XLSX"""
+        import json
+        from openpyxl import load_workbook
+        from app.models import EmployeeMetric
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            db.session.add(EmployeeMetric(employee_id=admin.id, metric_id=PerformanceMetric.query.first().id,
+                                          cycle_id=EvaluationCycle.query.first().id, score=7.5,
+                                          comment="Хорошо", evaluator_id=admin.id))
+            db.session.commit()
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+
+        response = self.app.get('/export-evaluations?format=csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).lstrip('\ufeff').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'employee', 'email'])
+        self.assertIn('Производительность', lines[1])
+
+        response = self.app.get('/export-evaluations?format=jsonl')
+        record = json.loads(response.get_data(as_text=True).splitlines()[0])
+        self.assertEqual(record['email'], 'admin@test.ru')
+        self.assertEqual(record['score'], 7.5)
+        self.assertEqual(record['department'], 'Тестовый отдел')
+
+        response = self.app.get('/export-evaluations?format=xlsx')
+        sheet = load_workbook(BytesIO(response.data), read_only=True).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][7], 'Хорошо')
+
+        self.assertEqual(self.app.get('/export-evaluations?format=pdf').status_code, 400)
+
+    def test_principal_cache(self):
+        """Пользователь загружается из кэша без запросов; правка сотрудника сбрасывает кэш"""
+        from sqlalchemy import event
+        from app import principals
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.app.get('/export-import')
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        with app.app_context():
+            engine = db.engine
+            admin_id = Employee.query.filter_by(email='admin@test.ru').first().id
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = self.app.get('/export-import')
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([s for s in statements if 'FROM employees' in s or 'FROM roles' in s])
+
+        # Повышение роли сотрудника сбрасывает его запись в кэше — доступ меняется сразу
+        from werkzeug.security import generate_password_hash
+        with app.app_context():
+            admin = db.session.get(Employee, admin_id)
+            user = Employee(full_name="Тест Сотрудник", email="user@test.ru",
+                            password_hash=generate_password_hash("user123"),
+                            role_id=Role.query.filter_by(name='employee').first().id,
+                            department_id=admin.department_id, position_id=admin.position_id)
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            form = {'full_name': user.full_name, 'email': user.email,
+                    'department_id': user.department_id, 'position_id': user.position_id,
+                    'role_id': admin.role_id}
+
+        user_client = app.test_client()
+        user_client.post('/login', data={'email': 'user@test.ru', 'password': 'user123'})
+        self.assertEqual(user_client.get('/export-import').status_code, 403)
+        self.assertIsNotNone(principals.principal_cache.get(user_id))
+
+        self.app.post(f'/admin/employees/edit/{user_id}', data=form)
+        self.assertIsNone(principals.principal_cache.get(user_id))
+        self.assertEqual(user_client.get('/export-import').status_code, 200)
+
+    def test_employee_lists_query_budget(self):
+        """Списки сотрудников не делают отдельный запрос на каждую строку"""
+        from werkzeug.security import generate_password_hash
+        with app.app_context():
+            role_id = Role.query.filter_by(name='employee').first().id
+            metric_id = PerformanceMetric.query.first().id
+            for i in range(5):
+                dept = Department(name=f"Отдел {i}")
+                db.session.add(dept)
+                db.session.flush()
+                pos = Position(title=f"Должность {i}", department_id=dept.id)
+                db.session.add(pos)
+                db.session.flush()
+                for j in range(4):
+                    db.session.add(Employee(full_name=f"Сотрудник {i}-{j}", email=f"emp{i}{j}@test.ru",
+                                            password_hash=generate_password_hash("x"), role_id=role_id,
+                                            department_id=dept.id, position_id=pos.id))
+            db.session.commit()
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        for url in ['/employees', '/admin/employees', '/feedback/send', '/admin/metrics/add',
+                    f'/admin/metrics/edit/{metric_id}']:
+            self.app.get(url)
+            with self.assertQueryBudget(6):
+                response = self.app.get(url)
+            self.assertEqual(response.status_code, 200, url)
+
+    def test_keyset_pagination(self):
+        """Списки выводятся постранично; курсор в URL, общее число строк и переход назад"""
+        import re
+        from app.models import ContactMessage
+        with app.app_context():
+            for i in range(5):
+                db.session.add(ContactMessage(name=f"Автор {i}", email=f"a{i}@test.ru", message=f"Сообщение {i}",
+                                              created_at=datetime(2025, 1, 1 + i)))
+            db.session.commit()
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+
+        def next_link(html):
+            match = re.search(r'href="([^"]*)" class="btn btn-small btn-outline">Далее', html)
+            return match.group(1).replace('&amp;', '&') if match else None
+
+        seen = []
+        url = '/admin/messages?per_page=2'
+        while url:
+            html = self.app.get(url).get_data(as_text=True)
+            seen += re.findall(r'Сообщение (\d)', html)
+            url = next_link(html)
+            last = html
+        # Новые сверху, без пропусков и повторов
+        self.assertEqual(seen, ['4', '3', '2', '1', '0'])
+        self.assertIn('5–5 из 5', last)
+
+        back = re.search(r'href="([^"]*)" class="btn btn-small btn-outline">‹ Назад', last).group(1)
+        html = self.app.get(back.replace('&amp;', '&')).get_data(as_text=True)
+        self.assertEqual(re.findall(r'Сообщение (\d)', html), ['2', '1'])
+
+        # Испорченный курсор — первая страница
+        html = self.app.get('/admin/messages?per_page=2&cursor=garbage').get_data(as_text=True)
+        self.assertEqual(re.findall(r'Сообщение (\d)', html), ['4', '3'])
+
+        # Подделанный курсор: значения ключа не того типа, что столбцы, — тоже первая страница
+        from app import pagination
+        for forged in (['2025-01-01T00:00:00', 'x'], [{'a': 1}, 1], ['2025-01-01T00:00:00', None]):
+            cursor = pagination.encode_cursor(forged, 2, 'next')
+            html = self.app.get(f'/admin/messages?per_page=2&cursor={cursor}').get_data(as_text=True)
+            self.assertEqual(re.findall(r'Сообщение (\d)', html), ['4', '3'])
+
+    def test_cached_count_bounded(self):
+        """Подсчёты строк для разных параметров списка хранятся не больше COUNT_CACHE_SIZE"""
+        from unittest import mock
+        from app import caching, pagination
+
+        with mock.patch.object(pagination, '_counts', caching.MemoryBackend(2)) as counts:
+            for department in range(1, 6):
+                self.assertEqual(self.app.get(f'/employees?department={department}').status_code, 200)
+            self.assertEqual(len(counts._entries), 2)
+            with app.app_context():
+                query = Employee.query.filter_by(is_active=True)
+                self.assertEqual(pagination.cached_count(query), 1)
+                with self.assertQueryBudget(0):
+                    self.assertEqual(pagination.cached_count(query), 1)
+
+    def test_batch_evaluation(self):
+        """Форма оценки и JSON-пакет пишут оценки одной транзакцией, агрегаты сходятся"""
+        from app.models import EmployeeMetric
+        from app import aggregates
+
+        with app.app_context():
+            for i in range(10):
+                db.session.add(PerformanceMetric(name=f"Метрика {i}", category_id=1, is_active=True))
+            db.session.commit()
+            admin_id = Employee.query.filter_by(email='admin@test.ru').first().id
+            metric_ids = [m.id for m in PerformanceMetric.query.order_by(PerformanceMetric.id)]
+            cycle_id = EvaluationCycle.query.first().id
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+
+        form = {f'score_{metric_id}': 5 for metric_id in metric_ids}
+        with self.assertQueryBudget(20):
+            self.app.post(f'/evaluate/{admin_id}', data=form)
+        form[f'score_{metric_ids[0]}'] = 9
+        self.app.post(f'/evaluate/{admin_id}', data=form)
+
+        with app.app_context():
+            scores = sorted(e.score for e in EmployeeMetric.query.filter_by(employee_id=admin_id))
+            self.assertEqual(scores, [5.0] * 10 + [9.0])
+
+        # Ошибка в одном элементе — не сохраняется ничего
+        response = self.app.post('/evaluate/batch', json={'evaluations': [
+            {'employee_id': admin_id, 'metric_id': metric_ids[1], 'score': 7},
+            {'employee_id': admin_id, 'metric_id': metric_ids[2], 'score': 70},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['errors'][0]['index'], 1)
+
+        # Идентификаторы не целыми числами — ошибки элементов, а не 500
+        response = self.app.post('/evaluate/batch', json={'evaluations': [
+            {'employee_id': [admin_id], 'metric_id': metric_ids[1], 'score': 7},
+            {'employee_id': admin_id, 'metric_id': {'id': metric_ids[2]}, 'score': 7},
+            {'employee_id': True, 'metric_id': metric_ids[2], 'score': 7},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['index'] for e in response.get_json()['errors']], [0, 1, 2])
+
+        # Балл — только число, комментарий — строка или null
+        response = self.app.post('/evaluate/batch', json={'evaluations': [
+            {'employee_id': admin_id, 'metric_id': metric_ids[1], 'score': True},
+            {'employee_id': admin_id, 'metric_id': metric_ids[1], 'score': '7'},
+            {'employee_id': admin_id, 'metric_id': metric_ids[2], 'score': 7, 'comment': ['a']},
+            {'employee_id': admin_id, 'metric_id': metric_ids[2], 'score': 7, 'comment': 5},
+            {'employee_id': admin_id, 'metric_id': metric_ids[3], 'score': 7, 'comment': None},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['index'] for e in response.get_json()['errors']], [0, 1, 2, 3])
+
+        response = self.app.post('/evaluate/batch', json={'evaluations': [
+            {'employee_id': admin_id, 'metric_id': metric_ids[1], 'score': 7, 'comment': 'Пакет'},
+            {'employee_id': admin_id, 'metric_id': metric_ids[2], 'score': 5},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual((result['updated'], result['unchanged'], result['inserted']), (1, 1, 0))
+
+        with app.app_context():
+            self.assertEqual(EmployeeMetric.query.filter_by(metric_id=metric_ids[1]).one().score, 7.0)
+            self.assertEqual(aggregates.check_cycle_stats(cycle_id), [])
+
+    def test_save_evaluations_before_unique_key(self):
+        """База со схемой до уникального ключа оценок: после автоматических миграций оценки сохраняются,
+        после flask db-upgrade — через UPSERT"""
+        from app import evaluations, migrations
+        from app.models import EmployeeMetric
+
+        with app.app_context():
+            # Схема до миграций 0002 и 0010: без составных индексов и ключа оценок
+            for index in (evaluations.UNIQUE_KEY_INDEX, 'ix_employee_metrics_cycle_employee_score',
+                          'ix_employee_metrics_evaluator_cycle'):
+                db.session.execute(db.text(f"DROP INDEX {index}"))
+            db.session.execute(db.text("DELETE FROM schema_migrations WHERE version IN "
+                                       "('0002_employee_metrics_indexes', '0010_employee_metrics_unique_key')"))
+            db.session.commit()
+            evaluations._unique_key_ready = False
+            self.assertEqual(migrations.run_migrations(include_manual=False), ['0002_employee_metrics_indexes'])
+            self.assertFalse(evaluations.has_unique_key())
+
+            admin_id = Employee.query.filter_by(email='admin@test.ru').first().id
+            metric_id = PerformanceMetric.query.first().id
+            cycle_id = EvaluationCycle.query.first().id
+            for score in (5.0, 8.0):
+                result = evaluations.save_evaluations(cycle_id, admin_id, {(admin_id, metric_id): (score, '')})
+                db.session.commit()
+            self.assertEqual((result.inserted, result.updated), (0, 1))
+            self.assertEqual([e.score for e in EmployeeMetric.query.filter_by(employee_id=admin_id)], [8.0])
+
+        self.assertIn('0010_employee_metrics_unique_key', app.test_cli_runner().invoke(args=['db-upgrade']).output)
+        with app.app_context():
+            self.assertTrue(evaluations.has_unique_key())
+            result = evaluations.save_evaluations(cycle_id, admin_id, {(admin_id, metric_id): (6.0, '')})
+            db.session.commit()
+            self.assertEqual(result.updated, 1)
+            self.assertEqual([e.score for e in EmployeeMetric.query.filter_by(employee_id=admin_id)], [6.0])
+
+    def test_applicable_metrics_cache(self):
+        """Применимость метрик берётся из кэша и сбрасывается при правке метрики"""
+        from app.models import MetricExclusion
+        from app import evaluations
+
+        with app.app_context():
+            dept = Department.query.first()
+            pos = Position.query.first()
+            other = Employee(full_name="Тест Сотрудник", email="emp@test.ru", password_hash="x",
+                             role_id=Role.query.filter_by(name='employee').first().id,
+                             department_id=dept.id, position_id=pos.id)
+            global_metric = PerformanceMetric.query.first()
+            dept_metric = PerformanceMetric(name="Метрика отдела", category_id=1, is_active=True,
+                                            department_id=dept.id)
+            db.session.add_all([other, dept_metric])
+            db.session.flush()
+            db.session.add(MetricExclusion(metric_id=dept_metric.id, employee_id=other.id))
+            db.session.commit()
+            admin_id = Employee.query.filter_by(email='admin@test.ru').first().id
+            ids = (dept.id, other.id, global_metric.id, dept_metric.id)
+
+        dept_id, other_id, global_id, dept_metric_id = ids
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+
+        response = self.app.get(f'/departments/{dept_id}/applicable-metrics')
+        self.assertEqual(response.status_code, 200)
+        employees = response.get_json()['employees']
+        self.assertEqual(employees[str(admin_id)], sorted([global_id, dept_metric_id]))
+        self.assertEqual(employees[str(other_id)], [global_id])
+
+        # Правила уже в кэше: повторный расчёт не читает метрики и исключения
+        with app.app_context(), self.assertQueryBudget(1):
+            evaluations.department_metric_ids(dept_id)
+
+        # Правка метрики снимает исключение — кэш сброшен
+        self.app.post(f'/admin/metrics/edit/{dept_metric_id}', data={
+            'name': "Метрика отдела", 'category_id': 1, 'max_score': 10, 'weight': 1,
+            'department_id': dept_id
+        })
+        employees = self.app.get(f'/departments/{dept_id}/applicable-metrics').get_json()['employees']
+        self.assertEqual(employees[str(other_id)], sorted([global_id, dept_metric_id]))
+
+        # Запись мимо сессии (другой процесс) видна после METRIC_RULES_TTL
+        import time
+        from unittest import mock
+        with app.app_context():
+            db.session.execute(db.text("UPDATE performance_metrics SET is_active = 0 WHERE id = :id"),
+                               {'id': dept_metric_id})
+            db.session.commit()
+            self.assertIn(dept_metric_id, evaluations.metric_rules().by_department[dept_id])
+            later = time.monotonic() + evaluations.METRIC_RULES_TTL + 1
+            with mock.patch('app.evaluations.time.monotonic', return_value=later):
+                self.assertNotIn(dept_metric_id, evaluations.metric_rules().by_department.get(dept_id, frozenset()))
+
+    def test_public_page_cache(self):
+        """Публичная страница отдаётся из кэша с ETag, 304 на условный запрос, сброс после записи"""
+        from app.models import FAQ
+
+        with app.app_context():
+            db.session.add(FAQ(question="Первый вопрос?", answer="Ответ", category="Общее"))
+            db.session.commit()
+
+        response = self.app.get('/faq')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        with self.assertQueryBudget(0):
+            response = self.app.get('/faq', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        with app.app_context():
+            db.session.add(FAQ(question="Второй вопрос?", answer="Ответ", category="Общее"))
+            db.session.commit()
+
+        response = self.app.get('/faq', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Второй вопрос?'.encode('utf-8'), response.data)
+
+        # Параметры, которых страница не читает, не создают новых записей
+        etag = response.headers['ETag']
+        with self.assertQueryBudget(0):
+            response = self.app.get('/faq?x=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_public_page_cache_pagination(self):
+        """Анонимная лента новостей: каждая страница кэшируется под своим курсором"""
+        import html
+        import re
+        from app.models import News
+
+        with app.app_context():
+            db.session.query(News).delete()
+            for day in (1, 2, 3):
+                db.session.add(News(title=f"Новость номер {day}", content="Текст", published_at=datetime(2025, 1, day)))
+            db.session.commit()
+
+        first = self.app.get('/news?per_page=2')
+        self.assertIn('Новость номер 3'.encode('utf-8'), first.data)
+        self.assertNotIn('Новость номер 1'.encode('utf-8'), first.data)
+        next_url = html.unescape(re.search(r'href="(/news\?[^"]*cursor=[^"]*)"', first.data.decode('utf-8')).group(1))
+
+        second = self.app.get(next_url)
+        self.assertIn('Новость номер 1'.encode('utf-8'), second.data)
+        self.assertNotIn('Новость номер 3'.encode('utf-8'), second.data)
+        # Повтор первой страницы — из кэша, но это всё ещё первая страница
+        self.assertEqual(self.app.get('/news?per_page=2').data, first.data)
+
+    def test_filesystem_cache_cleanup(self):
+        """Файловый кэш: истёкшие записи и лишние сверх maxsize удаляются при записи"""
+        import tempfile
+        import time
+        from unittest import mock
+        from app import caching
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = caching.FileSystemBackend(directory, maxsize=4)
+            cache.set('version:news', 1)
+            self.assertEqual(cache.get('version:news'), 1)
+            cache.set('page:old', 'старая', ttl=10)
+            with mock.patch('time.time', return_value=time.time() + 20):
+                cache.cleanup()
+            self.assertIsNone(cache.get('page:old'))
+            self.assertEqual(cache.get('version:news'), 1)
+
+            for i in range(10):
+                cache.set(f'page:{i}', i, ttl=60)
+            files = [name for name in os.listdir(directory) if name.endswith('.cache')]
+            self.assertLessEqual(len(files), 4)
+            self.assertEqual(cache.get('page:9'), 9)
+
+    def test_cycle_scheduler(self):
+        """Главная только читает; истёкшие циклы закрывает и запланированные запускает планировщик"""
+        from app import cycles
+
+        with app.app_context():
+            planned = EvaluationCycle(name="Запланированный", start_date=datetime(2025, 2, 1),
+                                      end_date=datetime(2099, 1, 1), is_active=False, auto_activate=True)
+            db.session.add(planned)
+            expired = EvaluationCycle.query.filter_by(is_active=True).one()
+            expired.end_date = datetime(2025, 1, 31)
+            db.session.commit()
+            expired_id = expired.id
+            planned_id = planned.id
+            # Закончившийся цикл не считается активным и до прохода планировщика
+            self.assertEqual(cycles.active_cycles(), ())
+
+        with self.assertQueryBudget(10) as statements:
+            self.assertEqual(self.app.get('/').status_code, 200)
+        self.assertFalse([s for s in statements if s.lstrip().upper().startswith(('UPDATE', 'INSERT', 'DELETE'))])
+
+        with app.app_context():
+            self.assertEqual(cycles.run_maintenance(now=datetime(2025, 3, 1)), (1, 1))
+            self.assertEqual(cycles.run_maintenance(now=datetime(2025, 3, 1)), (0, 0))
+            self.assertEqual([c.id for c in cycles.active_cycles()], [planned_id])
+            self.assertFalse(db.session.get(EvaluationCycle, expired_id).is_active)
+            self.assertFalse(db.session.get(EvaluationCycle, planned_id).auto_activate)
+
+        # Вне production планировщик выключен; create_app его не запускает
+        cycles.start_scheduler(app)
+        self.assertNotIn('cycle_scheduler', app.extensions)
+
+    def test_active_cycle_cache(self):
+        """Активный цикл, метрики и число участников читаются из кэша и сбрасываются правкой цикла"""
+        from app import cycles
+
+        with app.app_context():
+            cycle_id = EvaluationCycle.query.filter_by(is_active=True).one().id
+            state = cycles.active_state()
+            self.assertEqual(cycles.active_cycle().id, cycle_id)
+            self.assertEqual((len(state.metric_ids), state.participant_count), (1, 1))
+            with self.assertQueryBudget(0):
+                self.assertEqual(cycles.active_cycle().id, cycle_id)
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.app.post(f'/admin/cycles/edit/{cycle_id}', data={})
+
+        with app.app_context():
+            self.assertIsNone(cycles.active_cycle())
+        response = self.app.get('/stats/all-employees')
+        self.assertEqual(response.status_code, 302)
+
+    def test_ended_cycle_not_active(self):
+        """Закончившийся цикл с is_active без прохода планировщика: завершён на страницах циклов, удаляется"""
+        with app.app_context():
+            cycle = EvaluationCycle.query.filter_by(is_active=True).one()
+            cycle.end_date = datetime(2025, 1, 31)
+            db.session.commit()
+            cycle_id = cycle.id
+
+        self.assertNotIn('Активен'.encode('utf-8'), self.app.get('/cycles').data)
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.assertNotIn('Активен'.encode('utf-8'), self.app.get('/admin/cycles').data)
+
+        response = self.app.post(f'/admin/cycles/delete/{cycle_id}', follow_redirects=True)
+        self.assertIn('Цикл удалён.'.encode('utf-8'), response.data)
+        with app.app_context():
+            self.assertIsNone(db.session.get(EvaluationCycle, cycle_id))
+
+    def test_photo_thumbnails(self):
+        """Копии фото с хэшем в имени: квадратный аватар, WebP и JPEG, кэширование на год"""
+        import tempfile
+        from PIL import Image
+        from app import images
+
+        folder = tempfile.mkdtemp()
+        source = os.path.join(folder, 'photo.jpg')
+        Image.new('RGB', (1200, 900), 'navy').save(source)
+        digest = images.generate_variants(source, folder)
+        self.assertEqual(digest, images.generate_variants(source, folder))
+        with Image.open(os.path.join(folder, images.thumb_name(digest, 'sm', 'webp'))) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (100, 100)))
+        with Image.open(os.path.join(folder, images.thumb_name(digest, 'lg', 'jpeg'))) as thumb:
+            self.assertEqual(thumb.size, (800, 600))
+
+        app.config['THUMBS_FOLDER'] = folder
+        try:
+            with app.app_context():
+                admin = Employee.query.filter_by(email='admin@test.ru').first()
+                admin.photo, admin.photo_hash = 'uploads/photos/photo.jpg', digest
+                db.session.commit()
+            self.app.post('/login', data={
+                'email': 'admin@test.ru',
+                'password': 'admin123'
+            }, follow_redirects=True)
+            url = f"/media/thumbs/{images.thumb_name(digest, 'sm', 'webp')}"
+            self.assertIn(url.encode(), self.app.get('/employees').data)
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            response.close()
+        finally:
+            app.config['THUMBS_FOLDER'] = None
+
+    def test_search(self):
+        """Поиск: триггеры держат индекс в актуальном состоянии, права учитываются"""
+        from app.models import News, Feedback, FeedbackType
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            news = News(title="Итоги квартального цикла", content="Премирование по результатам", author_id=admin.id)
+            hidden = News(title="Черновик квартального плана", content="Не опубликовано", is_published=False)
+            feedback_type = FeedbackType(name="Похвала")
+            db.session.add_all([news, hidden, feedback_type])
+            db.session.flush()
+            db.session.add(Feedback(employee_id=admin.id, sender_id=admin.id, feedback_type_id=feedback_type.id,
+                                    content="Отличная квартальная работа"))
+            db.session.commit()
+            news_id = news.id
+
+        # Гость: только опубликованное, без чужой обратной связи и без поиска по email
+        response = self.app.get('/search/suggest?q=квартал')
+        self.assertEqual([item['title'] for item in response.get_json()], ["Итоги квартального цикла"])
+        self.assertNotIn('Отличная'.encode('utf-8'), self.app.get('/search?q=квартальная').data)
+        self.assertNotIn('Тест Админ'.encode('utf-8'), self.app.get('/search?q=admin').data)
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.assertIn('<mark>квартальная</mark>'.encode('utf-8'), self.app.get('/search?q=квартальная').data)
+        self.assertIn('Тест Админ'.encode('utf-8'), self.app.get('/search?q=admin').data)
+
+        with app.app_context():
+            news = db.session.get(News, news_id)
+            news.title = "Итоги годового цикла"
+            db.session.commit()
+        titles = [item['title'] for item in self.app.get('/search/suggest?q=годов').get_json()]
+        self.assertEqual(titles, ["Итоги годового цикла"])
+        self.assertNotIn("Итоги квартального цикла",
+                         [item['title'] for item in self.app.get('/search/suggest?q=квартал').get_json()])
+
+    def test_dashboard_queries(self):
+        """Кабинет: оценки и обратная связь — по запросу, архив постранично, сводка сбрасывается записью"""
+        from datetime import timedelta
+        from app.models import Feedback, FeedbackType, EmployeeMetric
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            metric = PerformanceMetric.query.first()
+            feedback_type = FeedbackType(name="Похвала")
+            db.session.add(feedback_type)
+            db.session.flush()
+            for i in range(13):
+                db.session.add(Feedback(employee_id=admin.id, sender_id=admin.id, feedback_type_id=feedback_type.id,
+                                        content=f"Отзыв {i}", is_archived=i > 0,
+                                        created_at=datetime(2025, 1, 1) + timedelta(hours=i)))
+            db.session.add(EmployeeMetric(employee_id=admin.id, evaluator_id=admin.id, metric_id=metric.id,
+                                          cycle_id=cycle.id, score=8.0))
+            db.session.commit()
+            unread_id = Feedback.query.filter_by(is_archived=False).one().id
+
+        self.app.post('/login', data={
+            'email': 'admin@test.ru',
+            'password': 'admin123'
+        }, follow_redirects=True)
+        self.app.get('/dashboard')
+        with self.assertQueryBudget(2) as statements:
+            response = self.app.get('/dashboard')
+        self.assertEqual(len(statements), 2)
+        self.assertIn('Отзыв 12'.encode('utf-8'), response.data)
+        self.assertIn('Отзыв 3'.encode('utf-8'), response.data)
+        self.assertNotIn('Отзыв 2<'.encode('utf-8'), response.data)
+        self.assertIn('Прочитанные: 12'.lower().encode('utf-8'), response.data)
+
+        # Вторая страница архива — по курсору из ссылки «Далее»
+        import re
+        next_url = re.search(r'href="([^"]*cursor=[^"]*)"', response.data.decode('utf-8')).group(1)
+        response = self.app.get(next_url.replace('&amp;', '&'))
+        self.assertIn('Отзыв 2<'.encode('utf-8'), response.data)
+        self.assertNotIn('Отзыв 12'.encode('utf-8'), response.data)
+
+        self.app.get(f'/feedback/archive/{unread_id}')
+        self.assertIn('Прочитанные: 13'.lower().encode('utf-8'), self.app.get('/dashboard').data)
+
+    def test_cycle_analytics(self):
+        """Итоговый балл: нормирование по максимуму, веса метрик и категорий, распределения"""
+        from app import analytics
+        from app.models import EmployeeMetric, MetricCategory
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            quality = MetricCategory(name="Качество", weight=0.75)
+            speed = MetricCategory(name="Скорость", weight=0.25)
+            db.session.add_all([quality, speed])
+            db.session.flush()
+            metrics = [
+                PerformanceMetric(name="Ошибки", category_id=quality.id, max_score=10.0, weight=3.0),
+                PerformanceMetric(name="Ревью", category_id=quality.id, max_score=5.0, weight=1.0),
+                PerformanceMetric(name="Сроки", category_id=speed.id, max_score=10.0, weight=1.0),
+            ]
+            db.session.add_all(metrics)
+            db.session.flush()
+            for metric, score in zip(metrics, (8.0, 5.0, 4.0)):
+                db.session.add(EmployeeMetric(employee_id=admin.id, evaluator_id=admin.id, metric_id=metric.id,
+                                              cycle_id=cycle.id, score=score))
+            db.session.commit()
+
+            result = analytics.cycle_analytics(cycle.id)
+            # Качество: (0.8 * 3 + 1.0 * 1) / 4 = 0.85; скорость 0.4; итог 0.85 * 0.75 + 0.4 * 0.25
+            self.assertAlmostEqual(float(result.scores.composite[0]), 73.75)
+            self.assertEqual(result.overall.count, 1)
+            self.assertEqual(result.overall.histogram[7], 1)
+            self.assertEqual(result.overall.percentiles[50], 73.75)
+            self.assertEqual(list(result.departments), [admin.department_id])
+            with self.assertQueryBudget(1):
+                self.assertIs(analytics.cycle_analytics(cycle.id), result)
+
+        response = self.app.get('/stats')
+        self.assertIn('Распределение итоговых баллов'.encode('utf-8'), response.data)
+        self.assertIn('73.8'.encode('utf-8'), response.data)
+
+    def test_chart_api(self):
+        """API графиков: готовые корзины, ETag и 304, сжатие, права на данные сотрудника"""
+        import gzip
+        import json
+        from unittest import mock
+        from app import charts
+        from app.models import EmployeeMetric
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            metric = PerformanceMetric.query.first()
+            db.session.add(EmployeeMetric(employee_id=admin.id, evaluator_id=admin.id, metric_id=metric.id,
+                                          cycle_id=cycle.id, score=7.0))
+            db.session.commit()
+            emp_id = admin.id
+
+        response = self.app.get('/api/charts/stats/score-histogram')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response.headers['Cache-Control'])
+        data = response.get_json()
+        self.assertEqual(len(data['labels']), 11)
+        self.assertEqual(data['datasets'][0]['data'][7], 1)
+
+        response = self.app.get('/api/charts/stats/score-histogram',
+                                headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        # Короткие ответы не сжимаются; с нулевым порогом — gzip
+        response = self.app.get('/api/charts/stats/composite-histogram', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        with mock.patch.object(charts, 'GZIP_MIN_SIZE', 0):
+            response = self.app.get('/api/charts/stats/composite-histogram', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(sum(json.loads(gzip.decompress(response.data))['datasets'][0]['data']), 1)
+
+        self.assertEqual(self.app.get('/api/charts/stats/unknown').status_code, 404)
+        self.assertEqual(self.app.get(f'/api/charts/employee/{emp_id}/performance').status_code, 401)
+
+    def test_ranking_index(self):
+        """Рейтинг цикла: места и процентили пересчитываются после записи оценок, итоговый балл — как в аналитике"""
+        from app import analytics, rankings
+        from app.models import EmployeeMetric, EmployeeCycleStats, CycleStats
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            metric = PerformanceMetric.query.first()
+            others = [Employee(full_name=f"Сотрудник {i}", email=f"e{i}@test.ru", password_hash='-',
+                               role_id=admin.role_id, department_id=admin.department_id,
+                               position_id=admin.position_id) for i in range(2)]
+            db.session.add_all(others)
+            db.session.flush()
+            for employee, score in zip([admin] + others, (6.0, 9.0, 6.0)):
+                db.session.add(EmployeeMetric(employee_id=employee.id, evaluator_id=admin.id, metric_id=metric.id,
+                                              cycle_id=cycle.id, score=score))
+            db.session.commit()
+            self.assertTrue(db.session.get(CycleStats, cycle.id).ranks_stale)
+
+            rankings.ensure_ranking(cycle.id)
+            rows = {row.employee_id: row for row in EmployeeCycleStats.query.filter_by(cycle_id=cycle.id)}
+            self.assertEqual([rows[e.id].rank for e in [admin] + others], [2, 1, 2])
+            self.assertAlmostEqual(rows[others[0].id].percentile, 100.0)
+            self.assertAlmostEqual(rows[admin.id].percentile, 200.0 / 3)
+            composite = dict(zip(*analytics.compute(cycle.id).scores[:3:2]))
+            self.assertAlmostEqual(rows[admin.id].composite_score, composite[admin.id])
+            with self.assertQueryBudget(1):
+                rankings.ensure_ranking(cycle.id)
+
+            evaluation = EmployeeMetric.query.filter_by(employee_id=admin.id, cycle_id=cycle.id).one()
+            evaluation.score = 10.0
+            db.session.commit()
+            # Пересчёт идёт в своей транзакции: несохранённое в сессии запроса не коммитится
+            cycle_id = cycle.id
+            db.session.add(Department(name="Несохранённый отдел"))
+            rankings.ensure_ranking(cycle_id)
+            db.session.rollback()
+            self.assertIsNone(Department.query.filter_by(name="Несохранённый отдел").first())
+            row = EmployeeCycleStats.query.filter_by(cycle_id=cycle.id, employee_id=admin.id).one()
+            self.assertEqual((row.rank, row.dept_rank), (1, 1))
+            self.assertAlmostEqual(row.composite_score, 100.0)
+
+        response = self.app.get('/stats/all-employees')
+        self.assertIn('<td><strong>3.</strong></td>'.encode('utf-8'), response.data)
+
+
+    def test_ranking_department_move(self):
+        """Перевод сотрудника в другое подразделение переносит его агрегаты и места во всех отчётах"""
+        from app import aggregates, rankings, reports
+        from app.models import EmployeeMetric, EmployeeCycleStats, DepartmentCycleStats
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            metric = PerformanceMetric.query.first()
+            other_dept = Department(name="Второй отдел")
+            db.session.add(other_dept)
+            moved = Employee(full_name="Переводимый Сотрудник", email="moved@test.ru", password_hash='-',
+                             role_id=admin.role_id, department_id=admin.department_id,
+                             position_id=admin.position_id)
+            db.session.add(moved)
+            db.session.flush()
+            for employee, score in ((admin, 6.0), (moved, 9.0)):
+                db.session.add(EmployeeMetric(employee_id=employee.id, evaluator_id=admin.id, metric_id=metric.id,
+                                              cycle_id=cycle.id, score=score))
+            db.session.commit()
+            rankings.ensure_ranking(cycle.id)
+            self.assertEqual(db.session.get(EmployeeCycleStats, (cycle.id, admin.id)).dept_rank, 2)
+
+            moved.department_id = other_dept.id
+            db.session.commit()
+            self.assertEqual(aggregates.check_cycle_stats(cycle.id), [])
+            self.assertEqual(db.session.get(DepartmentCycleStats, (cycle.id, other_dept.id)).score_sum, 9.0)
+
+            stats = rankings.ensure_ranking(cycle.id)
+            row = db.session.get(EmployeeCycleStats, (cycle.id, moved.id))
+            self.assertEqual((row.department_id, row.rank, row.dept_rank), (other_dept.id, 1, 1))
+            self.assertEqual(db.session.get(EmployeeCycleStats, (cycle.id, admin.id)).dept_rank, 1)
+            _, query = reports.report_rows(db.session, 'by_department', other_dept.id, cycle,
+                                           rankings.cycle_mean(stats))
+            self.assertEqual([(r.full_name, r.rank) for r in query], [("Переводимый Сотрудник", 1)])
+
+        response = self.app.get('/stats/all-employees')
+        self.assertIn('Второй отдел'.encode('utf-8'), response.data)
+
+    def test_manual_migrations(self):
+        """Миграции, меняющие данные, при старте пропускаются и выполняются только flask db-upgrade"""
+        from app import migrations
+
+        version = '0010_employee_metrics_unique_key'
+        with app.app_context():
+            db.session.execute(db.text("DELETE FROM schema_migrations WHERE version = :v"), {'v': version})
+            db.session.commit()
+            self.assertEqual(migrations.run_migrations(include_manual=False), [])
+            self.assertIn(version, [v for v, _ in migrations.pending_migrations()])
+
+        result = app.test_cli_runner().invoke(args=['db-upgrade'])
+        self.assertIn(version, result.output)
+        with app.app_context():
+            self.assertEqual(migrations.pending_migrations(), [])
+
+    def test_performance_report_fonts(self):
+        """PDF-отчёт строится на урезанных шрифтах; имена с другими алфавитами выводятся полным шрифтом"""
+        from app import reports
+        from app.models import EmployeeMetric
+
+        with app.app_context():
+            admin = Employee.query.filter_by(email='admin@test.ru').first()
+            cycle = EvaluationCycle.query.first()
+            metric = PerformanceMetric.query.first()
+            db.session.add(EmployeeMetric(employee_id=admin.id, evaluator_id=admin.id, metric_id=metric.id,
+                                          cycle_id=cycle.id, score=7.0))
+            db.session.commit()
+            plain, _ = reports.build_performance_report('all', None, cycle)
+            self.assertTrue(plain.startswith(b'%PDF'))
+
+            admin.full_name = "Σωκράτης Παπαδόπουλος"
+            db.session.commit()
+            mixed, _ = reports.build_performance_report('all', None, cycle)
+            self.assertEqual(mixed.count(b'/Subtype /Type0'), plain.count(b'/Subtype /Type0') + 1)
+
+    def test_login_rate_limit(self):
+        """Вход: email без учёта регистра, ограничение попыток по IP и паре IP и email, проверка хэша в пуле"""
+        import time
+        from unittest import mock
+        from app import ratelimit
+
+        # Email ищется по индексу без учёта регистра и пробелов
+        response = self.app.post('/login', data={'email': ' Admin@Test.RU ', 'password': 'admin123'})
+        self.assertEqual(response.status_code, 302)
+        self.app.get('/logout')
+        with app.app_context():
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT id FROM employees WHERE lower(email) = 'admin@test.ru'"
+            )).all()
+        self.assertIn('ix_employees_email_lower', ' '.join(str(row) for row in plan))
+
+        # Неизвестный email проверяется по фиктивному хэшу — так же, как настоящий пароль
+        with mock.patch('app.ratelimit.check_password_hash', wraps=ratelimit.check_password_hash) as checked:
+            response = self.app.post('/login', data={'email': 'nobody@test.ru', 'password': 'x'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(checked.call_count, 1)
+
+        # Неудачные попытки с чужого IP не блокируют вход владельцу
+        attempts, period = app.config['LOGIN_RATE_LIMITS']['account']
+        attacker = {'REMOTE_ADDR': '10.0.0.66'}
+        for _ in range(attempts + 1):
+            self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'wrong'}, environ_base=attacker)
+        response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'admin123'})
+        self.assertEqual(response.status_code, 302)
+        self.app.get('/logout')
+
+        # Лимит пары IP и email: пять неудач, шестая попытка — 429 без проверки хэша
+        for _ in range(attempts):
+            response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'wrong'})
+            self.assertEqual(response.status_code, 200)
+        with mock.patch('app.ratelimit.check_password_hash') as checked:
+            response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'admin123'})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(checked.called)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        self.assertIn('Слишком много попыток'.encode('utf-8'), response.data)
+        # Другой email с того же IP пока пускают
+        response = self.app.post('/login', data={'email': 'other@test.ru', 'password': 'x'})
+        self.assertEqual(response.status_code, 200)
+
+        # Перебор одного email с разных адресов только замедляется корзиной email: владелец входит
+        ratelimit.store.clear()
+        with mock.patch.dict(ratelimit.limits, {'email': (3, 600)}), \
+                mock.patch('app.ratelimit.time.sleep') as sleep:
+            for i in range(3):
+                response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'wrong'},
+                                         environ_base={'REMOTE_ADDR': f'10.0.1.{i}'})
+                self.assertEqual(response.status_code, 200)
+            self.assertFalse(sleep.called)
+            response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'wrong'},
+                                     environ_base={'REMOTE_ADDR': '10.0.1.99'})
+            self.assertEqual(response.status_code, 200)
+            sleep.assert_called_once_with(ratelimit.throttle_delay)
+            response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'admin123'})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(sleep.call_count, 2)
+        self.app.get('/logout')
+
+        # Пул и очередь проверок заняты — 503 вместо ожидания
+        ratelimit.store.clear()
+        with mock.patch.object(ratelimit, '_slots', mock.Mock(**{'acquire.return_value': False})):
+            response = self.app.post('/login', data={'email': 'admin@test.ru', 'password': 'admin123'})
+        self.assertEqual(response.status_code, 503)
+
+        # Хранилище в таблице rate_limits считает так же
+        with app.app_context():
+            store = ratelimit.DatabaseStore()
+            now = time.time()
+            results = [store.hit('email:x', 60.0, 120.0, now) for _ in range(3)]
+            self.assertEqual(results[:2], [0.0, 0.0])
+            self.assertAlmostEqual(results[2], 60.0)
+            self.assertEqual(store.hit('email:x', 60.0, 120.0, now + 60.0), 0.0)
+            self.assertAlmostEqual(store.peek('email:x', 60.0, 120.0, now + 60.0), 60.0)
+            store.reset('email:x')
+            self.assertEqual(store.peek('email:x', 60.0, 120.0, now + 60.0), 0.0)
+            self.assertEqual(store.hit('email:x', 60.0, 120.0, now + 60.0), 0.0)
+
+    def test_login_client_address_behind_proxy(self):
+        """Адрес для ограничения входа — из X-Forwarded-For только при PROXY_FIX_HOPS > 0"""
+        from unittest import mock
+        from app.config import config
+
+        def login_ip(client):
+            with mock.patch('app.ratelimit.check', return_value=0) as check:
+                client.post('/login', data={'email': 'nobody@test.ru', 'password': 'x'},
+                            headers={'X-Forwarded-For': '203.0.113.7'},
+                            environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            return check.call_args.kwargs['ip']
+
+        self.assertEqual(login_ip(self.app), '10.0.0.1')
+        # Число прокси задаёт развёртывание — по умолчанию заголовкам не доверяет и production
+        if 'PROXY_FIX_HOPS' not in os.environ:
+            self.assertEqual(config['production'].PROXY_FIX_HOPS, 0)
+
+        config['testing'].PROXY_FIX_HOPS = 1
+        try:
+            proxied = create_app_for(os.path.join(_db_dir, 'test.db'), 'testing')
+        finally:
+            del config['testing'].PROXY_FIX_HOPS
+        proxied.config['WTF_CSRF_ENABLED'] = False
+        self.assertEqual(login_ip(proxied.test_client()), '203.0.113.7')
+        with proxied.app_context():
+            db.engine.dispose()
+
+
+    def test_benchmark_harness(self):
+        """Синтетическая организация и замеры: все сценарии отвечают без ошибок, результат — в JSON"""
+        import json
+        from tests import benchmark, synthetic
+
+        with app.app_context():
+            summary = synthetic.populate(employees=40, metrics=12, cycles=3, evaluations=4, departments=4, seed=7)
+            self.assertEqual(summary['evaluations'], 40 * 4 * 3)
+            self.assertEqual(EvaluationCycle.query.filter_by(is_active=True).count(), 1)
+
+        results = benchmark.run(app, iterations=2, warmup=0, seed=7)
+        self.assertEqual(set(results), set(benchmark.SCENARIOS))
+        for name, result in results.items():
+            self.assertTrue(all(int(status) < 400 for status in result['statuses']), (name, result['statuses']))
+            self.assertGreater(result['queries']['max'], 0, name)
+            self.assertGreater(result['peak_memory_kb'], 0, name)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+        changes = benchmark.compare(results, json.loads(json.dumps({'routes': results})))
+        self.assertEqual(changes['stats']['p50_ms'], 1.0)
+
 if __name__ == '__main__':
-    unittest.main(verbosity=2)
\ No newline at end of file
+    unittest.main(verbosity=2)